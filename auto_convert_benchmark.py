@@ -0,0 +1,202 @@
+"""Lead auto-conversion benchmark: the old per-lead loop against the batch conversion
+
+Run: python auto_convert_benchmark.py [mongo_url] [lead_count]
+
+Seeds lead_count eligible leads (50k by default) plus leads that must be left alone,
+times the per-lead loop check_and_convert_old_leads used to run (100 leads per call)
+on a sample, then converts everything with LeadAutoConversion. Checks that every
+eligible lead got exactly one opportunity, that a second run converts nothing and that
+concurrent or stale runs never convert a lead twice. Finally converts lead_count more
+leads with the first lead_count opportunities already present, which should take about
+as long as the first run. Drops the database afterwards.
+"""
+import asyncio
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_convert_bench")
+LEAD_COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+LEGACY_SAMPLE = min(2_000, LEAD_COUNT)
+
+class AutoConvertBenchmark(ScratchDBScript):
+    def __init__(self, lead_count):
+        super().__init__()
+        self.lead_count = lead_count
+        self.subtypes = []
+        self.first_run_seconds = 0.0
+
+    @staticmethod
+    def lead(i, approved_at, **fields):
+        return {
+            "id": str(uuid.uuid4()),
+            "lead_id": f"LEAD-{i:07d}",
+            "project_title": f"Project {i}",
+            "project_description": "Benchmark lead",
+            "company_id": "company-1",
+            "assigned_to_user_id": "owner-1",
+            "expected_revenue": 100000.0 + i,
+            "approval_status": "approved",
+            "approved_at": approved_at,
+            "notes": None,
+            "is_active": True,
+            "is_deleted": False,
+            "created_at": approved_at,
+            "updated_at": approved_at,
+            **fields
+        }
+
+    async def seed(self, count, start=0):
+        rng = random.Random(start)
+        old = datetime.now(timezone.utc) - timedelta(weeks=6)
+        batch = []
+        for i in range(start, start + count):
+            batch.append(self.lead(i, old, lead_subtype_id=rng.choice(self.subtypes)))
+            if len(batch) == 5000:
+                await server.db.leads.insert_many(batch)
+                batch = []
+        if batch:
+            await server.db.leads.insert_many(batch)
+
+    async def seed_ineligible(self, start):
+        """Leads the conversion must skip: too recent, not approved, deleted or already converted"""
+        now = datetime.now(timezone.utc)
+        old = now - timedelta(weeks=6)
+        leads = [
+            self.lead(start, now - timedelta(weeks=1)),
+            self.lead(start + 1, old, approval_status="pending"),
+            self.lead(start + 2, old, is_deleted=True),
+            self.lead(start + 3, old)
+        ]
+        await server.db.leads.insert_many(leads)
+        await server.db.opportunities.insert_one({"id": str(uuid.uuid4()), "opportunity_id": "OPP-9999999",
+                                                  "lead_id": leads[3]["id"], "is_deleted": False})
+        return len(leads)
+
+    async def legacy_convert(self, limit=100):
+        """The per-lead loop check_and_convert_old_leads used to run: a find_one per lead for its
+        opportunity, subtype and initial stage, then one insert per opportunity and stage history
+        row and one update per lead"""
+        leads = await server.db.leads.find({
+            "approval_status": "approved",
+            "approved_at": {"$lte": datetime.now(timezone.utc) - timedelta(weeks=4)},
+            "is_deleted": False,
+            "is_active": True,
+            "notes": None
+        }).to_list(limit)
+        converted = 0
+        for lead in leads:
+            if await server.db.opportunities.find_one({"lead_id": lead["id"], "is_deleted": False}):
+                continue
+            subtype = await server.db.lead_subtype_master.find_one({"id": lead.get("lead_subtype_id"), "is_deleted": False})
+            opportunity_type = "Tender" if subtype and subtype.get("lead_subtype_name") in ["Tender", "Pretender"] else "Non-Tender"
+            stage = await server.db.opportunity_stages.find_one({"opportunity_type": opportunity_type, "sequence_order": 1, "is_deleted": False})
+            opportunity = server.Opportunity(
+                opportunity_id=await server.generate_opportunity_id(), sr_no=await server.get_next_sr_no(),
+                opportunity_title=lead["project_title"], company_id=lead["company_id"], current_stage_id=stage["id"],
+                opportunity_owner_id=lead["assigned_to_user_id"], opportunity_type=opportunity_type, lead_id=lead["id"],
+                auto_converted=True, created_by="system", updated_by="system"
+            )
+            await server.db.opportunities.insert_one(opportunity.dict())
+            await server.db.opportunity_stage_history.insert_one(server.OpportunityStageHistory(
+                opportunity_id=opportunity.id, to_stage_id=stage["id"], stage_name=stage["stage_name"], transitioned_by="system"
+            ).dict())
+            # Legacy rows are marked so the batch run below leaves them out of its count
+            await server.db.leads.update_one({"id": lead["id"]}, {"$set": {"notes": "legacy"}})
+            converted += 1
+        return converted
+
+    async def time_legacy(self):
+        started = time.perf_counter()
+        converted = 0
+        while converted < LEGACY_SAMPLE:
+            converted += await self.legacy_convert()
+        elapsed = time.perf_counter() - started
+        # Put the sample back so the batch run converts the same leads
+        await server.db.opportunities.delete_many({"auto_converted": True})
+        await server.db.opportunity_stage_history.delete_many({})
+        await server.db.leads.update_many({"notes": "legacy"}, {"$set": {"notes": None}})
+        return converted, elapsed
+
+    async def test_batch(self):
+        legacy_count, legacy_seconds = await self.time_legacy()
+        legacy_rate = legacy_count / legacy_seconds
+        print(f"\n🔍 Per-lead loop: {legacy_count} leads in {legacy_seconds:.2f}s ({legacy_rate:.0f} leads/s, "
+              f"{self.lead_count / legacy_rate:.1f}s projected for {self.lead_count})")
+
+        started = time.perf_counter()
+        conversion = server.LeadAutoConversion()
+        converted = await conversion.run()
+        elapsed = time.perf_counter() - started
+        self.first_run_seconds = elapsed
+        print(f"🔍 Batch conversion: {converted} leads in {elapsed:.2f}s ({converted / elapsed:.0f} leads/s)")
+
+        self.check("every eligible lead converted", converted == self.lead_count, f"({converted})")
+        opportunities = await server.db.opportunities.count_documents({"auto_converted": True})
+        self.check("one opportunity per lead", opportunities == self.lead_count, f"({opportunities})")
+        history = await server.db.opportunity_stage_history.count_documents({})
+        self.check("one stage history row per opportunity", history == self.lead_count, f"({history})")
+        tender = await server.db.opportunities.count_documents({"auto_converted": True, "opportunity_type": "Tender"})
+        self.check("tender and pretender leads become Tender opportunities", 0 < tender < self.lead_count, f"({tender})")
+        noted = await server.db.leads.count_documents({"notes": {"$regex": "^\\[Auto-converted to Opportunity OPP-"}})
+        self.check("converted leads noted", noted == self.lead_count, f"({noted})")
+        marked = await server.db.leads.count_documents({"auto_converted_at": {"$ne": None}})
+        self.check("converted leads marked", marked == self.lead_count, f"({marked})")
+        codes = await server.db.opportunities.distinct("opportunity_id")
+        self.check("opportunity codes distinct", len(codes) == self.lead_count + 1)
+        self.check("second run converts nothing", await server.LeadAutoConversion().run() == 0)
+
+    async def test_concurrent_runs(self):
+        count = min(5_000, self.lead_count)
+        print(f"\n🔍 Two concurrent runs over {count} more leads")
+        await self.seed(count, start=self.lead_count + 10)
+        first, second = server.LeadAutoConversion(batch_size=250), server.LeadAutoConversion(batch_size=250)
+        await asyncio.gather(first.run(), second.run())
+        self.check("each lead converted once", first.converted + second.converted == count,
+                   f"({first.converted} + {second.converted}, {first.skipped + second.skipped} skipped)")
+
+        print("\n🔍 A run converting leads it read before another run converted them")
+        await self.seed(count, start=self.lead_count + count + 20)
+        stale = server.LeadAutoConversion()
+        leads = await server.db.leads.aggregate(stale.pipeline()).to_list(None)
+        await server.LeadAutoConversion().run()
+        subtypes = await server.master_data_cache.index("lead_subtype_master", "id")
+        await stale.convert(leads, subtypes, await server.initial_opportunity_stages())
+        self.check("stale leads skipped", stale.converted == 0 and stale.skipped == count,
+                   f"({stale.converted} converted, {stale.skipped} skipped)")
+        pipeline = [{"$match": {"auto_converted": True}}, {"$group": {"_id": "$lead_id", "n": {"$sum": 1}}}, {"$match": {"n": {"$gt": 1}}}]
+        duplicates = await server.db.opportunities.aggregate(pipeline).to_list(None)
+        self.check("no lead has two opportunities", not duplicates, f"({len(duplicates)} duplicated)")
+
+    async def test_with_existing_opportunities(self, start):
+        existing = await server.db.opportunities.count_documents({})
+        print(f"\n🔍 Converting {self.lead_count} more leads with {existing} opportunities present")
+        plan = await server.db.opportunities.find({"lead_id": "lead-1"}).explain()
+        self.check("lead_id lookups use an index", "IXSCAN" in str(plan["queryPlanner"]["winningPlan"]))
+        await self.seed(self.lead_count, start=start)
+        started = time.perf_counter()
+        converted = await server.LeadAutoConversion().run()
+        elapsed = time.perf_counter() - started
+        print(f"   {converted} leads in {elapsed:.2f}s ({converted / elapsed:.0f} leads/s, first run {self.first_run_seconds:.2f}s)")
+        self.check("every new lead converted", converted == self.lead_count, f"({converted})")
+        self.check("existing opportunities do not slow the run down", elapsed < self.first_run_seconds * 3,
+                   f"({elapsed / self.first_run_seconds:.1f}x the first run)")
+
+    async def scenarios(self):
+        await server.ensure_indexes()
+        await server.initialize_lead_management_data()
+        await server.initialize_opportunity_stages()
+        self.subtypes = [row["id"] for row in await server.db.lead_subtype_master.find({}).to_list(None)]
+        print(f"🔍 Seeding {self.lead_count} eligible leads...")
+        await self.seed(self.lead_count)
+        await self.seed_ineligible(self.lead_count)
+        await self.test_batch()
+        await self.test_concurrent_runs()
+        await self.test_with_existing_opportunities(start=self.lead_count * 3 + 30)
+
+if __name__ == "__main__":
+    AutoConvertBenchmark(LEAD_COUNT).main()
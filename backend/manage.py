@@ -0,0 +1,49 @@
+"""Maintenance commands for the ERP backend: python manage.py --help"""
+import asyncio
+import json
+import typer
+
+from server import backfill_activity_log_fields, client, ensure_indexes, index_drift_report
+
+cli = typer.Typer()
+
+@cli.callback()
+def main():
+    """ERP backend maintenance commands"""
+
+def run(coro):
+    try:
+        return asyncio.run(coro)
+    finally:
+        client.close()
+
+@cli.command("backfill-activity-logs")
+def backfill_activity_logs(batch_size: int = typer.Option(500, help="Entries updated per bulk write")):
+    """Fill entity_type/entity_id/verb on activity logs written before those fields existed"""
+    updated = run(backfill_activity_log_fields(batch_size))
+    typer.echo(f"Backfilled {updated} activity log entries")
+
+@cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create every index declared in the registry that does not exist yet"""
+    result = run(ensure_indexes())
+    typer.echo(f"Created {len(result['created'])} indexes")
+    for name in result["created"]:
+        typer.echo(f"  + {name}")
+    for failure in result["failed"]:
+        typer.echo(f"  ! {failure['index']}: {failure['error']}")
+    for item in result["mismatched"]:
+        typer.echo(f"  ~ {item['collection']}.{item['name']} differs from its declaration (not changed)")
+    if result["failed"]:
+        raise typer.Exit(1)
+
+@cli.command("index-drift")
+def index_drift():
+    """Report declared indexes that are missing or differ, and undeclared ones"""
+    report = run(index_drift_report())
+    typer.echo(json.dumps(report, indent=2, default=str))
+    if not report["in_sync"]:
+        raise typer.Exit(1)
+
+if __name__ == "__main__":
+    cli()
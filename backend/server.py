@@ -1,9 +1,12 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 import os
@@ -11,12 +14,27 @@ import logging
 import jwt
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, validator
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from bson import ObjectId
 import functools
 import aiofiles
 import re
+import asyncio
+import csv
+import io
+import json
+import shutil
+import zlib
+import base64
+import hashlib
+import bisect
+import heapq
+import math
+from array import array
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,8 +49,13 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Authenticate access tokens from their claims instead of reading the user on every request
+STATELESS_AUTH = os.environ.get('STATELESS_AUTH', 'false').lower() == 'true'
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', '4'))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="password-hash")
 security = HTTPBearer()
 
 # Create the main app
@@ -206,6 +229,9 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 # ===== SALES MODULE MODELS =====
 
 # 1️⃣ Master Tables
@@ -494,6 +520,9 @@ class ActivityLog(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     action: str
+    entity_type: Optional[str] = None  # e.g. "lead", "opportunity", or a master table name
+    entity_id: Optional[str] = None
+    verb: Optional[str] = None  # e.g. "create", "update", "delete", "transition"
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_active: bool = True
     is_deleted: bool = False
@@ -511,6 +540,16 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """Verify a password on the bounded hashing pool instead of the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Hash a password on the bounded hashing pool instead of the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -528,23 +567,1120 @@ def create_refresh_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def build_access_claims(user: dict) -> dict:
+    """Claims carried by access tokens so requests can be authenticated without a user read"""
+    return {
+        "sub": user["id"],
+        "name": user["name"],
+        "email": user["email"],
+        "role_id": user["role_id"],
+        "is_active": user.get("is_active", True),
+        "auth_version": user.get("auth_version", 0)
+    }
+
+# Per-user auth versions for claims-based authentication
+class AuthStateMap:
+    """Tracks each user's auth_version and revoked (inactive/deleted) users in memory"""
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._revoked: set = set()
+
+    async def load(self):
+        """Load versions for every user that has ever been bumped or is revoked"""
+        users = await db.users.find(
+            {"$or": [{"auth_version": {"$gt": 0}}, {"is_active": False}, {"is_deleted": True}]},
+            {"_id": 0, "id": 1, "auth_version": 1, "is_active": 1, "is_deleted": 1}
+        ).to_list(None)
+        self._versions.clear()
+        self._revoked.clear()
+        for user in users:
+            self._apply(user)
+
+    def _apply(self, user: dict):
+        self._versions[user["id"]] = user.get("auth_version", 0)
+        if user.get("is_deleted") or not user.get("is_active", True):
+            self._revoked.add(user["id"])
+        else:
+            self._revoked.discard(user["id"])
+
+    async def refresh(self, user_id: str) -> bool:
+        """Re-read one user's auth state; False if the user no longer exists"""
+        user = await db.users.find_one(
+            {"id": user_id},
+            {"_id": 0, "id": 1, "auth_version": 1, "is_active": 1, "is_deleted": 1}
+        )
+        if not user:
+            self._versions.pop(user_id, None)
+            self._revoked.add(user_id)
+            return False
+        self._apply(user)
+        return True
+
+    async def bump(self, user_id: str):
+        """Invalidate every access token issued to a user so far"""
+        user = await db.users.find_one_and_update(
+            {"id": user_id},
+            {"$inc": {"auth_version": 1}},
+            projection={"_id": 0, "id": 1, "auth_version": 1, "is_active": 1, "is_deleted": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if user:
+            self._apply(user)
+        await cache_bus.publish("auth", user_id)
+
+    async def is_valid(self, claims: dict) -> bool:
+        user_id = claims["sub"]
+        token_version = claims.get("auth_version", 0)
+        known_version = self._versions.get(user_id, 0)
+        if token_version > known_version:
+            # Bumped by another worker since we loaded; refresh this one user
+            if not await self.refresh(user_id):
+                return False
+            known_version = self._versions[user_id]
+        return user_id not in self._revoked and token_version == known_version
+
+auth_state = AuthStateMap()
+
+# Rotating refresh tokens
+class RefreshTokenStore:
+    """Single-use refresh tokens grouped into families; reusing a spent token revokes its family"""
+
+    async def issue(self, user_id: str, family_id: Optional[str] = None) -> str:
+        """Store a new refresh token (optionally continuing a family) and return it encoded"""
+        token_id = str(uuid.uuid4())
+        family_id = family_id or str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        await db.refresh_tokens.insert_one({
+            "id": token_id,
+            "family_id": family_id,
+            "user_id": user_id,
+            "used": False,
+            "revoked": False,
+            "created_at": now,
+            "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        })
+        return create_refresh_token(data={"sub": user_id, "jti": token_id, "fam": family_id, "type": "refresh"})
+
+    async def consume(self, claims: dict) -> Optional[dict]:
+        """Mark a token as used and return it; None (after revoking the family) if it was already spent"""
+        token = await db.refresh_tokens.find_one_and_update(
+            {"id": claims["jti"], "used": False, "revoked": False},
+            {"$set": {"used": True, "used_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0}
+        )
+        if token is None:
+            await self.revoke_family(claims["fam"])
+        return token
+
+    async def revoke_family(self, family_id: str):
+        await db.refresh_tokens.update_many({"family_id": family_id}, {"$set": {"revoked": True}})
+
+    async def revoke_user(self, user_id: str):
+        """Revoke every outstanding refresh token issued to a user"""
+        await db.refresh_tokens.update_many(
+            {"user_id": user_id, "revoked": False}, {"$set": {"revoked": True}}
+        )
+
+refresh_tokens = RefreshTokenStore()
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        # Refresh tokens share the signing key but are only good at /auth/refresh
+        if user_id is None or payload.get("type") == "refresh":
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
+    if STATELESS_AUTH and "role_id" in payload:
+        if not payload.get("is_active", True) or not await auth_state.is_valid(payload):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return User(
+            id=user_id,
+            name=payload["name"],
+            email=payload["email"],
+            role_id=payload["role_id"],
+            is_active=payload.get("is_active", True)
+        )
+    
     user = await db.users.find_one({"id": user_id, "is_deleted": False})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     return User(**user)
 
+# Buffered log writers
+class BufferedLogWriter:
+    """Fire-and-forget writer that batches log documents into insert_many calls"""
+
+    _STOP = object()
+
+    def __init__(self, collection_name: str, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue_size: int = 10000):
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._task = loop.create_task(self._run())
+
+    def write(self, document: dict):
+        """Queue a document without waiting for the database; drops it if the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(document)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("%s writer queue full, %d entries dropped so far", self.collection_name, self.dropped)
+            return
+        self.enqueued += 1
+
+    async def stop(self):
+        """Flush everything queued so far and stop the background task"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(self._STOP)
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue_size": self.max_queue_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            # Gather whatever else arrives within the flush window
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, 0.05))
+                    continue
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._insert(batch)
+
+    async def _insert(self, batch: List[dict]):
+        try:
+            await db[self.collection_name].insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            self.written += inserted
+            self.failed += len(batch) - inserted
+            logger.error("Failed to write %d of %d documents to %s", len(batch) - inserted, len(batch), self.collection_name)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d documents to %s", len(batch), self.collection_name)
+
+login_log_writer = BufferedLogWriter("login_logs")
+activity_log_writer = BufferedLogWriter(
+    "activity_logs",
+    batch_size=int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', '200')),
+    flush_interval=float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', '0.5')),
+    max_queue_size=int(os.environ.get('ACTIVITY_LOG_MAX_QUEUE', '10000'))
+)
+
 async def log_activity(activity: ActivityLog):
     """Helper function to log user activities"""
-    await db.activity_logs.insert_one(activity.dict())
+    activity_log_writer.write(activity.dict())
+
+# Batched foreign key enrichment
+# Master data cache
+MASTER_COLLECTIONS = {
+    # collection: primary key field
+    "job_function_master": "job_function_id",
+    "partner_type_master": "partner_type_id",
+    "company_type_master": "company_type_id",
+    "head_of_company_master": "head_of_company_id",
+    "product_service_interest": "product_service_id",
+    "master_account_types": "account_type_id",
+    "master_account_regions": "region_id",
+    "master_business_types": "business_type_id",
+    "master_industry_segments": "industry_id",
+    "master_sub_industry_segments": "sub_industry_id",
+    "master_address_types": "address_type_id",
+    "master_countries": "country_id",
+    "master_states": "state_id",
+    "master_cities": "city_id",
+    "master_document_types": "document_type_id",
+    "master_currencies": "currency_id",
+    "lead_subtype_master": "id",
+    "tender_subtype_master": "id",
+    "submission_type_master": "id",
+    "clause_master": "id",
+    "competitor_master": "id",
+    "designation_master": "id",
+    "billing_master": "id",
+    "lead_source_master": "id",
+    # Not served by /master, but cached and invalidated the same way
+    "opportunity_stages": "id"
+}
+
+# /master/{table_name} names of the master collections
+MASTER_TABLE_COLLECTIONS = {
+    "job-functions": "job_function_master",
+    "partner-types": "partner_type_master",
+    "company-types": "company_type_master",
+    "head-of-company": "head_of_company_master",
+    "product-service-interests": "product_service_interest",
+    "account-types": "master_account_types",
+    "regions": "master_account_regions",
+    "business-types": "master_business_types",
+    "industry-segments": "master_industry_segments",
+    "sub-industry-segments": "master_sub_industry_segments",
+    "address-types": "master_address_types",
+    "countries": "master_countries",
+    "states": "master_states",
+    "cities": "master_cities",
+    "document-types": "master_document_types",
+    "currencies": "master_currencies",
+    # Lead Management Master Tables
+    "lead-subtypes": "lead_subtype_master",
+    "tender-subtypes": "tender_subtype_master",
+    "submission-types": "submission_type_master",
+    "clauses": "clause_master",
+    "competitors": "competitor_master",
+    "designations": "designation_master",
+    "billing-types": "billing_master",
+    "lead-sources": "lead_source_master"
+}
+
+# Field each master table is ordered and prefix-searched on
+MASTER_NAME_FIELDS = {
+    "job_function_master": "job_function_name",
+    "partner_type_master": "partner_type_name",
+    "company_type_master": "company_type_name",
+    "head_of_company_master": "head_role_name",
+    "product_service_interest": "product_service_name",
+    "master_account_types": "account_type_name",
+    "master_account_regions": "region_name",
+    "master_business_types": "business_type_name",
+    "master_industry_segments": "industry_name",
+    "master_sub_industry_segments": "sub_industry_name",
+    "master_address_types": "address_type_name",
+    "master_countries": "country_name",
+    "master_states": "state_name",
+    "master_cities": "city_name",
+    "master_document_types": "document_type_name",
+    "master_currencies": "currency_code",
+    "lead_subtype_master": "lead_subtype_name",
+    "tender_subtype_master": "tender_subtype_name",
+    "submission_type_master": "submission_type_name",
+    "clause_master": "clause_name",
+    "competitor_master": "competitor_name",
+    "designation_master": "designation_name",
+    "billing_master": "billing_type_name",
+    "lead_source_master": "lead_source_name"
+}
+
+# Master tables that can be scoped to one parent row
+MASTER_PARENT_FIELDS = {
+    "master_sub_industry_segments": "industry_id",
+    "master_states": "country_id",
+    "master_cities": "state_id"
+}
+
+MASTER_PAGE_SIZE = 50
+MASTER_PAGE_LIMIT = 1000
+
+class MasterDataCache:
+    """Rows of each master table held in process, with a version bumped on every write"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, collection: str) -> int:
+        return self._versions.get(collection, 0)
+
+    async def get(self, collection: str) -> Dict[str, Any]:
+        """Return {"version", "etag", "records" (live rows), "rows" (all rows)} for a master table"""
+        entry = self._entries.get(collection)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        generation = self._generation
+        version = self.version(collection)
+        rows = await db[collection].find({}, {"_id": 0}).to_list(None)
+        records = [row for row in rows if row.get("is_deleted") is False]
+        # The digest also changes the ETag for writes that did not go through publish()
+        digest = hashlib.sha1(json.dumps(records, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        entry = {
+            "version": version,
+            "etag": f'"{version}-{digest}"',
+            "records": records,
+            "rows": rows,
+            "indexes": {}
+        }
+        # Don't store rows that were invalidated while they were being read
+        if generation == self._generation:
+            self._entries[collection] = entry
+        return entry
+
+    async def index(self, collection: str, key: str, live_only: bool = True) -> Dict[Any, dict]:
+        """Return {row[key]: row} over the live (or all) rows of a master table"""
+        entry = await self.get(collection)
+        index = entry["indexes"].get((key, live_only))
+        if index is None:
+            index = {}
+            for row in entry["records"] if live_only else entry["rows"]:
+                if key in row:
+                    index.setdefault(row[key], row)
+            entry["indexes"][(key, live_only)] = index
+        return index
+
+    async def search(self, collection: str, name_field: str, prefix: str = "",
+                     parent_field: Optional[str] = None, parent_value: Optional[str] = None,
+                     skip: int = 0, limit: Optional[int] = None):
+        """Return (rows, total) for live rows whose name starts with prefix, ordered by name
+
+        Rows are kept sorted by case-folded name per parent value, so a lookup is a
+        binary search plus a slice rather than a scan of the table.
+        """
+        entry = await self.get(collection)
+        groups = entry["indexes"].get(("search", name_field, parent_field))
+        if groups is None:
+            groups = {}
+            for row in entry["records"]:
+                scope = row.get(parent_field) if parent_field else None
+                groups.setdefault(scope, []).append((str(row.get(name_field) or "").casefold(), row))
+            for scope, pairs in groups.items():
+                pairs.sort(key=lambda pair: pair[0])
+                groups[scope] = ([name for name, _ in pairs], [row for _, row in pairs])
+            entry["indexes"][("search", name_field, parent_field)] = groups
+
+        names, rows = groups.get(parent_value if parent_field else None, ([], []))
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + "\U0010ffff") if prefix else len(names)
+        stop = end if limit is None else min(end, start + skip + limit)
+        return rows[start + skip:stop], end - start
+
+    def invalidate(self, collection: str, version: Optional[int] = None):
+        """Drop a table's cached rows, recording its shared version when known"""
+        if version is not None:
+            self._versions[collection] = max(version, self.version(collection))
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(collection, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached_tables": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+            "invalidations": self.invalidations,
+            "versions": dict(self._versions)
+        }
+
+master_data_cache = MasterDataCache()
+
+class OpportunityStageCatalog:
+    """opportunity_stages indexed in process by id, by (opportunity_type, sequence_order) and by stage_code
+
+    Built over the master data cache entry for the table, so it is rebuilt after any
+    publish or change stream event on opportunity_stages.
+    """
+
+    def __init__(self, master_cache: MasterDataCache):
+        self.master_cache = master_cache
+
+    async def _catalog(self) -> Dict[str, Any]:
+        entry = await self.master_cache.get("opportunity_stages")
+        catalog = entry["indexes"].get("catalog")
+        if catalog is None:
+            catalog = {"by_id": {}, "live_by_id": {}, "by_order": {}, "by_code": {}, "by_type": {}}
+            for stage in entry["rows"]:
+                catalog["by_id"].setdefault(stage.get("id"), stage)
+            # Stable sort: among equal sequence orders the first stored row wins, as find_one would
+            for stage in sorted(entry["records"], key=lambda stage: stage.get("sequence_order") or 0):
+                opportunity_type = stage.get("opportunity_type")
+                catalog["live_by_id"].setdefault(stage.get("id"), stage)
+                catalog["by_order"].setdefault((opportunity_type, stage.get("sequence_order")), stage)
+                catalog["by_code"].setdefault((opportunity_type, stage.get("stage_code")), stage)
+                catalog["by_type"].setdefault(opportunity_type, []).append(stage)
+            entry["indexes"]["catalog"] = catalog
+        return catalog
+
+    async def load(self):
+        await self._catalog()
+
+    async def get(self, stage_id: Optional[str], live_only: bool = True) -> Optional[dict]:
+        if not stage_id:
+            return None
+        return (await self._catalog())["live_by_id" if live_only else "by_id"].get(stage_id)
+
+    async def at(self, opportunity_type: str, sequence_order: int) -> Optional[dict]:
+        """The live stage of a type at a position in its sequence"""
+        return (await self._catalog())["by_order"].get((opportunity_type, sequence_order))
+
+    async def with_code(self, opportunity_type: str, stage_code: str) -> Optional[dict]:
+        return (await self._catalog())["by_code"].get((opportunity_type, stage_code))
+
+    async def for_type(self, opportunity_type: str) -> List[dict]:
+        """Live stages of a type plus the shared ones, in sequence order"""
+        by_type = (await self._catalog())["by_type"]
+        stages = by_type.get(opportunity_type, []) + (by_type.get("Shared", []) if opportunity_type != "Shared" else [])
+        return sorted(stages, key=lambda stage: stage.get("sequence_order") or 0)
+
+    async def ids_named(self, stage_names: List[str]) -> List[str]:
+        """Ids of every stage, deleted or not, with one of the given names"""
+        return [stage_id for stage_id, stage in (await self._catalog())["by_id"].items()
+                if stage.get("stage_name") in stage_names]
+
+stage_catalog = OpportunityStageCatalog(master_data_cache)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True when an If-None-Match header covers the given ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+class ForeignKey:
+    """Declares how doc[field] resolves to display values in another collection"""
+
+    def __init__(self, field: str, collection: str, key: str = "id", display="name",
+                 target: Optional[str] = None, missing: Any = "Unknown", empty: Any = None,
+                 many: bool = False, live_only: bool = True, query: Optional[dict] = None):
+        self.field = field
+        self.collection = collection
+        self.key = key
+        if isinstance(display, str):
+            display = {target or field.replace("_id", "_name"): display}
+        self.display: Dict[str, str] = display  # {target field: source field}
+        self.missing = missing if isinstance(missing, dict) else {t: missing for t in display}
+        self.empty = empty if isinstance(empty, dict) else {t: empty for t in display}
+        self.many = many
+        self.live_only = live_only
+        self.query = query or {}
+
+    def group_key(self):
+        return (self.collection, self.key, self.live_only, tuple(sorted(self.query.items())))
+
+async def resolve_foreign_keys(docs: List[dict], refs: List[ForeignKey]) -> List[dict]:
+    """Fill display fields on docs with one concurrent $in query per referenced collection"""
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for ref in refs:
+        group = groups.setdefault(ref.group_key(), {"ref": ref, "ids": set(), "fields": {ref.key}})
+        group["fields"].update(ref.display.values())
+        for doc in docs:
+            value = doc.get(ref.field)
+            if ref.many:
+                group["ids"].update(v for v in value or [] if v)
+            elif value:
+                group["ids"].add(value)
+
+    async def fetch(group_key, group):
+        if not group["ids"]:
+            return group_key, {}
+        ref = group["ref"]
+        if ref.collection in MASTER_COLLECTIONS and not ref.query:
+            # Master tables are served from the in-process cache
+            index = await master_data_cache.index(ref.collection, ref.key, ref.live_only)
+            return group_key, {value: index[value] for value in group["ids"] if value in index}
+        query = {ref.key: {"$in": list(group["ids"])}, **ref.query}
+        if ref.live_only:
+            query["is_deleted"] = False
+        rows = await db[ref.collection].find(query, {"_id": 0, **{f: 1 for f in group["fields"]}}).to_list(None)
+        found = {}
+        for row in rows:
+            # Keep the first match, as find_one would
+            found.setdefault(row[ref.key], row)
+        return group_key, found
+
+    resolved = dict(await asyncio.gather(*(fetch(k, g) for k, g in groups.items())))
+
+    for ref in refs:
+        lookup = resolved[ref.group_key()]
+        for doc in docs:
+            value = doc.get(ref.field)
+            if ref.many:
+                rows = [lookup[v] for v in value or [] if v in lookup]
+                for target, source in ref.display.items():
+                    doc[target] = [row.get(source) for row in rows]
+            elif not value:
+                doc.update(ref.empty)
+            else:
+                row = lookup.get(value)
+                for target, source in ref.display.items():
+                    doc[target] = row.get(source, ref.missing[target]) if row else ref.missing[target]
+    return docs
+
+async def count_by(collection: str, field: str, values) -> Dict[str, int]:
+    """Count live documents per value of field with a single aggregation"""
+    values = [value for value in set(values) if value]
+    if not values:
+        return {}
+    rows = await db[collection].aggregate([
+        {"$match": {field: {"$in": values}, "is_deleted": False}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    return {row["_id"]: row["count"] for row in rows}
+
+USER_NAME_REFS = [
+    ForeignKey("user_id", "users", display={"user_name": "name", "user_email": "email"},
+               missing={"user_name": "Unknown User", "user_email": "Unknown Email"})
+]
+
+# Permission resolution cache
+class PermissionCache:
+    """Compiled {menu_path: set(permission_names)} matrices keyed by role_id"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, role_id: str) -> Dict[str, Any]:
+        """Return {"is_admin": bool, "matrix": {menu_path: set}} for a role"""
+        entry = self._entries.get(role_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        generation = self._generation
+        entry = await self._compile(role_id)
+        # Don't store a matrix that was invalidated while it was being built
+        if generation == self._generation:
+            self._entries[role_id] = entry
+        return entry
+
+    async def _compile(self, role_id: str) -> Dict[str, Any]:
+        role = await db.roles.find_one({"id": role_id, "is_deleted": False})
+        role_permissions = await db.role_permissions.find(
+            {"role_id": role_id, "is_deleted": False}
+        ).to_list(1000)
+
+        menu_ids = {rp["menu_id"] for rp in role_permissions}
+        permission_ids = {perm_id for rp in role_permissions for perm_id in rp.get("permission_ids", [])}
+
+        menus = await db.menus.find({"id": {"$in": list(menu_ids)}, "is_deleted": False}).to_list(None)
+        permissions = await db.permissions.find({"id": {"$in": list(permission_ids)}}).to_list(None)
+        menu_paths = {menu["id"]: menu["path"] for menu in menus}
+        permission_names = {perm["id"]: perm["name"] for perm in permissions}
+
+        matrix: Dict[str, set] = {}
+        for rp in role_permissions:
+            path = menu_paths.get(rp["menu_id"])
+            if path is None:
+                continue
+            names = matrix.setdefault(path, set())
+            for perm_id in rp.get("permission_ids", []):
+                if perm_id in permission_names:
+                    names.add(permission_names[perm_id])
+
+        return {
+            "is_admin": bool(role and role["name"].lower() == "admin"),
+            "matrix": matrix
+        }
+
+    def invalidate(self, role_id: Optional[str] = None):
+        """Drop one role's matrix, or every matrix when role_id is None"""
+        self._generation += 1
+        self.invalidations += 1
+        if role_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(role_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached_roles": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+            "invalidations": self.invalidations
+        }
+
+permission_cache = PermissionCache()
+
+# Lead full-text search
+LEAD_SEARCH_WEIGHTS = {"project_title": 8, "lead_id": 8, "company_name": 4, "project_description": 3, "notes": 2}
+LEAD_SEARCH_BATCH = 1000
+LEAD_SEARCH_MIN_PREFIX = 2  # shorter terms only match whole words
+LEAD_SEARCH_SYNC_OVERLAP = timedelta(seconds=5)  # re-read this far behind the watermark to absorb clock skew
+SEARCH_TOKEN_PATTERN = re.compile(r"\w+(?:-\w+)*")
+
+def search_tokens(text: Optional[str]) -> List[str]:
+    """Lower-cased words of a piece of text, in order, without repeats; hyphenated words stay whole"""
+    return list(dict.fromkeys(SEARCH_TOKEN_PATTERN.findall(str(text or "").casefold())))
+
+class LeadSearchIndex:
+    """Weighted inverted index over the text of live leads, held in process
+
+    Postings are compact arrays of (document number, field weight). Re-indexing a lead
+    retires its old document number instead of editing every posting list; retired
+    numbers are compacted away once they outnumber the live ones. The index is built on
+    first use, and sync() then re-reads only the leads whose updated_at moved past the
+    newest one seen, which is how writes made by other workers get picked up. Company
+    names are resolved at index time; sync_companies() re-indexes the leads of renamed
+    companies.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.builds = 0
+        self.syncs = 0
+        self.searches = 0
+        self.compactions = 0
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, tuple] = {}  # token: (array of doc numbers, array of weights)
+        self._vocabulary: List[str] = []  # sorted tokens, for prefix expansion
+        self._vocabulary_stale = False
+        self._lead_ids: List[Optional[str]] = []  # doc number: lead id, None once retired
+        self._created: array = array("d")  # doc number: created_at timestamp, to order ties
+        self._numbers: Dict[str, int] = {}  # lead id: current doc number
+        self._retired = 0
+        self._watermark: Optional[datetime] = None
+        self._company_watermark: Optional[datetime] = None
+        self._built = False
+
+    def _index(self, lead: dict):
+        number = self._numbers.pop(lead["id"], None)
+        if number is not None:
+            self._lead_ids[number] = None
+            self._retired += 1
+        if lead.get("is_deleted") is not False:
+            return
+
+        weights: Dict[str, int] = {}
+        for field, weight in LEAD_SEARCH_WEIGHTS.items():
+            tokens = set(search_tokens(lead.get(field)))
+            if field != "lead_id":
+                # Hyphenated words can also be found by their parts; lead codes only as a whole
+                tokens.update(part for token in list(tokens) if "-" in token for part in token.split("-"))
+            for token in tokens:
+                weights[token] = weights.get(token, 0) + weight
+        number = len(self._lead_ids)
+        self._lead_ids.append(lead["id"])
+        created_at = lead.get("created_at")
+        self._created.append(as_utc(created_at).timestamp() if isinstance(created_at, datetime) else 0.0)
+        self._numbers[lead["id"]] = number
+        for token, weight in weights.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = (array("I"), array("B"))
+                self._vocabulary_stale = True
+            posting[0].append(number)
+            posting[1].append(weight)
+
+    def _compact(self):
+        for token in list(self._postings):
+            numbers, weights = self._postings[token]
+            kept = [(n, w) for n, w in zip(numbers, weights) if self._lead_ids[n] is not None]
+            if kept:
+                self._postings[token] = (array("I", [n for n, _ in kept]), array("B", [w for _, w in kept]))
+            else:
+                del self._postings[token]
+                self._vocabulary_stale = True
+        self._retired = 0
+        self.compactions += 1
+
+    async def _index_batch(self, leads: List[dict]):
+        await resolve_foreign_keys(leads, [LEAD_COMPANY_REF])
+        for lead in leads:
+            self._index(lead)
+            updated_at = lead.get("updated_at")
+            if isinstance(updated_at, datetime) and (self._watermark is None or as_utc(updated_at) > self._watermark):
+                self._watermark = as_utc(updated_at)
+
+    async def _load(self, query: dict):
+        projection = {"_id": 0, "id": 1, "is_deleted": 1, "company_id": 1, "created_at": 1, "updated_at": 1,
+                      **{field: 1 for field in LEAD_SEARCH_WEIGHTS}}
+        batch = []
+        async for lead in db.leads.find(query, projection):
+            batch.append(lead)
+            if len(batch) == LEAD_SEARCH_BATCH:
+                await self._index_batch(batch)
+                batch = []
+        if batch:
+            await self._index_batch(batch)
+        if self._retired > max(len(self._numbers), 1000):
+            self._compact()
+
+    async def ensure_built(self):
+        if self._built:
+            return
+        async with self._lock:
+            if self._built:
+                return
+            started = datetime.now(timezone.utc)
+            self._reset()
+            await self._load({"is_deleted": False})
+            # Catch up on leads written while the collection was being read
+            self._watermark = self._company_watermark = started
+            await self._load({"updated_at": {"$gte": started - LEAD_SEARCH_SYNC_OVERLAP}})
+            self._built = True
+            self.builds += 1
+
+    async def sync(self):
+        """Re-index the leads written since the last build or sync"""
+        if not self._built:
+            return
+        async with self._lock:
+            await self._load({"updated_at": {"$gte": self._watermark - LEAD_SEARCH_SYNC_OVERLAP}})
+            self.syncs += 1
+
+    async def sync_companies(self):
+        """Re-index the leads of companies updated since the last build or company sync"""
+        if not self._built:
+            return
+        async with self._lock:
+            started = datetime.now(timezone.utc)
+            company_ids = await db.companies.distinct(
+                "company_id", {"updated_at": {"$gte": self._company_watermark - LEAD_SEARCH_SYNC_OVERLAP}}
+            )
+            if company_ids:
+                await self._load({"company_id": {"$in": company_ids}, "is_deleted": False})
+            self._company_watermark = started
+            self.syncs += 1
+
+    def _expand(self, term: str) -> List[str]:
+        if len(term) < LEAD_SEARCH_MIN_PREFIX:
+            return [term] if term in self._postings else []
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_stale = False
+        start = bisect.bisect_left(self._vocabulary, term)
+        end = bisect.bisect_left(self._vocabulary, term + "\U0010ffff")
+        return self._vocabulary[start:end]
+
+    async def search(self, q: str, top: Optional[int] = None):
+        """Return (ranked, total) for leads matching every term of q
+
+        ranked is [(lead id, score)] best first, cut to the first top entries when given.
+        A term matches words it is a prefix of; whole-word matches score double. Scores
+        add up field weight times inverse document frequency over the terms.
+        """
+        await self.ensure_built()
+        self.searches += 1
+        live = max(len(self._numbers), 1)
+        scores: Optional[Dict[int, float]] = None
+        for term in search_tokens(q):
+            term_scores: Dict[int, float] = {}
+            for token in self._expand(term):
+                numbers, weights = self._postings[token]
+                idf = math.log(1 + live / len(numbers))
+                factor = idf if token == term else idf / 2
+                token_scores = {number: weight * factor for number, weight in zip(numbers, weights)}
+                if term_scores:
+                    # A lead matching several expansions of a term counts its best one
+                    for number, score in token_scores.items():
+                        if score > term_scores.get(number, 0):
+                            term_scores[number] = score
+                else:
+                    term_scores = token_scores
+            if scores is not None:
+                term_scores = {n: score + scores[n] for n, score in term_scores.items() if n in scores}
+            scores = term_scores
+            if not scores:
+                return [], 0
+
+        lead_ids, created = self._lead_ids, self._created
+        live_scores = [(n, score) for n, score in (scores or {}).items() if lead_ids[n] is not None]
+        key = lambda item: (-item[1], -created[item[0]])
+        ranked = heapq.nsmallest(top, live_scores, key=key) if top is not None else sorted(live_scores, key=key)
+        return [(lead_ids[n], round(score, 4)) for n, score in ranked], len(live_scores)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "built": self._built,
+            "indexed_leads": len(self._numbers),
+            "tokens": len(self._postings),
+            "postings": sum(len(numbers) for numbers, _ in self._postings.values()),
+            "retired": self._retired,
+            "watermark": self._watermark,
+            "builds": self.builds,
+            "syncs": self.syncs,
+            "searches": self.searches,
+            "compactions": self.compactions
+        }
+
+lead_search_index = LeadSearchIndex()
+
+# Cross-worker cache invalidation
+CACHE_INVALIDATION_MODE = os.environ.get('CACHE_INVALIDATION_MODE', 'auto')  # auto | change_stream | polling | off
+CACHE_VERSION_POLL_SECONDS = float(os.environ.get('CACHE_VERSION_POLL_SECONDS', '2'))
+PERMISSION_COLLECTIONS = ("roles", "role_permissions", "menus", "permissions")
+
+def as_utc(value: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+class CacheInvalidationBus:
+    """Keeps the in-process caches of every worker in step with writes made by any worker
+
+    Each cache scope ("permissions", "auth", "leads" and one per master table) has a version in
+    cache_versions that writers bump through publish(). Workers tail a change stream on the
+    cached collections and evict what changed; where change streams are unavailable
+    (a standalone mongod) they poll cache_versions instead.
+    """
+
+    def __init__(self, master_cache: MasterDataCache, permissions: PermissionCache, auth: AuthStateMap,
+                 mode: str = CACHE_INVALIDATION_MODE, poll_interval: float = CACHE_VERSION_POLL_SECONDS,
+                 lead_search: Optional[LeadSearchIndex] = None):
+        self.master_cache = master_cache
+        self.permissions = permissions
+        self.auth = auth
+        self.lead_search = lead_search
+        self.requested_mode = mode
+        self.poll_interval = poll_interval
+        self.mode = "off"
+        self.versions: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+        self._synced = False
+        self.events = 0
+        self.evictions: Dict[str, int] = {}
+        self.errors = 0
+        self.last_event_at: Optional[datetime] = None
+        self.last_poll_at: Optional[datetime] = None
+        self.lag_last_ms: Optional[float] = None
+        self.lag_max_ms = 0.0
+        self._lag_total_ms = 0.0
+        self._lag_samples = 0
+
+    @staticmethod
+    def scope_for(collection: str) -> Optional[str]:
+        if collection in PERMISSION_COLLECTIONS:
+            return "permissions"
+        if collection == "users":
+            return "auth"
+        if collection == "leads":
+            return "leads"
+        if collection in MASTER_COLLECTIONS:
+            return collection
+        return None
+
+    async def publish(self, scope: str, key: Optional[str] = None):
+        """Bump a scope's shared version after a write and evict it locally"""
+        doc = await db.cache_versions.find_one_and_update(
+            {"id": scope},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        await self.evict(scope, key, doc["version"] if doc else None)
+
+    async def evict(self, scope: str, key: Optional[str] = None, version: Optional[int] = None):
+        """Drop one key (or everything) of a scope from this worker's caches"""
+        if version is not None:
+            self.versions[scope] = max(version, self.versions.get(scope, 0))
+        if scope == "permissions":
+            self.permissions.invalidate(key)
+        elif scope == "auth":
+            if STATELESS_AUTH:
+                if key:
+                    await self.auth.refresh(key)
+                else:
+                    await self.auth.load()
+        elif scope in MASTER_COLLECTIONS:
+            self.master_cache.invalidate(scope, version)
+        elif scope == "leads":
+            # The search index catches up on whatever changed rather than being dropped
+            if self.lead_search:
+                await self.lead_search.sync()
+        elif scope == "companies":
+            # Leads are searchable by company name
+            if self.lead_search:
+                await self.lead_search.sync_companies()
+        else:
+            return
+        self.evictions[scope] = self.evictions.get(scope, 0) + 1
+
+    async def evict_all(self):
+        """Used when events may have been missed"""
+        await self.evict("permissions")
+        await self.evict("auth")
+        await self.evict("leads")
+        await self.evict("companies")
+        for collection in MASTER_COLLECTIONS:
+            await self.evict(collection)
+
+    def _record_lag(self, occurred_at: Optional[datetime]):
+        if occurred_at is None:
+            return
+        lag_ms = max(0.0, (datetime.now(timezone.utc) - as_utc(occurred_at)).total_seconds() * 1000)
+        self.lag_last_ms = lag_ms
+        self.lag_max_ms = max(self.lag_max_ms, lag_ms)
+        self._lag_total_ms += lag_ms
+        self._lag_samples += 1
+
+    async def handle_event(self, event: dict):
+        """Apply one change stream event"""
+        self.events += 1
+        self.last_event_at = datetime.now(timezone.utc)
+        occurred_at = event.get("wallTime")
+        if occurred_at is None and event.get("clusterTime") is not None:
+            occurred_at = datetime.fromtimestamp(event["clusterTime"].time, timezone.utc)
+        self._record_lag(occurred_at)
+
+        collection = event.get("ns", {}).get("coll")
+        document = event.get("fullDocument") or {}
+        if collection == "cache_versions":
+            # The data change itself has already been evicted; just track the version
+            scope, version = document.get("id"), document.get("version")
+            if scope and version is not None and version > self.versions.get(scope, 0):
+                self.versions[scope] = version
+                if scope in MASTER_COLLECTIONS:
+                    self.master_cache.invalidate(scope, version)
+            return
+
+        scope = self.scope_for(collection)
+        if scope is None:
+            return
+        key = None
+        if collection == "role_permissions":
+            key = document.get("role_id")
+        elif collection in ("roles", "users"):
+            # Deletes carry no fullDocument, so those fall back to evicting the whole scope
+            key = document.get("id")
+        await self.evict(scope, key)
+
+    async def poll_once(self):
+        """Evict every scope whose shared version moved since the last poll"""
+        docs = await db.cache_versions.find({}, {"_id": 0}).to_list(None)
+        self.last_poll_at = datetime.now(timezone.utc)
+        for doc in docs:
+            scope, version = doc["id"], doc.get("version", 0)
+            if version > self.versions.get(scope, 0):
+                if self._synced:
+                    self.events += 1
+                    self.last_event_at = self.last_poll_at
+                    self._record_lag(doc.get("updated_at"))
+                await self.evict(scope, None, version)
+        self._synced = True
+
+    async def _watch(self) -> bool:
+        """Tail the change stream; returns False if change streams are unavailable"""
+        watched = [*PERMISSION_COLLECTIONS, "users", "leads", "cache_versions", *MASTER_COLLECTIONS]
+        pipeline = [{"$match": {"ns.coll": {"$in": watched}}}]
+        opened = False
+        while True:
+            try:
+                async with db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+                    if opened and self._resume_token is None:
+                        # Reopened without a position: anything could have changed meanwhile
+                        await self.evict_all()
+                    opened = True
+                    self.mode = "change_stream"
+                    async for event in stream:
+                        await self.handle_event(event)
+                        self._resume_token = stream.resume_token
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not opened and self.requested_mode == "auto":
+                    logger.warning("Change streams unavailable (%s); polling cache versions instead", e)
+                    return False
+                self.errors += 1
+                logger.exception("Cache invalidation change stream failed; reopening")
+                if isinstance(e, OperationFailure) and e.code == 286:
+                    # ChangeStreamHistoryLost: the resume token is too old to use
+                    self._resume_token = None
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        self.mode = "polling"
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                logger.exception("Cache version poll failed")
+
+    async def _run(self):
+        if self.requested_mode in ("auto", "change_stream") and await self._watch():
+            return
+        await self._poll()
+
+    async def start(self):
+        if self.requested_mode == "off" or self._task is not None:
+            return
+        await self.poll_once()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.mode = "off"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "requested_mode": self.requested_mode,
+            "poll_interval_seconds": self.poll_interval,
+            "events": self.events,
+            "evictions": dict(self.evictions),
+            "errors": self.errors,
+            "versions": dict(self.versions),
+            "last_event_at": self.last_event_at,
+            "last_poll_at": self.last_poll_at,
+            "lag_ms": {
+                "last": round(self.lag_last_ms, 1) if self.lag_last_ms is not None else None,
+                "max": round(self.lag_max_ms, 1),
+                "avg": round(self._lag_total_ms / self._lag_samples, 1) if self._lag_samples else None,
+                "samples": self._lag_samples
+            }
+        }
+
+cache_bus = CacheInvalidationBus(master_data_cache, permission_cache, auth_state, lead_search=lead_search_index)
 
 # Permission checking utilities
 async def get_user_permissions(user_id: str, menu_path: str = None) -> Dict[str, List[str]]:
@@ -553,48 +1689,21 @@ async def get_user_permissions(user_id: str, menu_path: str = None) -> Dict[str,
     user = await db.users.find_one({"id": user_id, "is_deleted": False})
     if not user:
         return {}
-    
-    # Get role permissions
-    query = {"role_id": user["role_id"], "is_deleted": False}
+
+    matrix = (await permission_cache.get(user["role_id"]))["matrix"]
     if menu_path:
-        # Find menu by path
-        menu = await db.menus.find_one({"path": menu_path, "is_deleted": False})
-        if menu:
-            query["menu_id"] = menu["id"]
-    
-    role_permissions = await db.role_permissions.find(query).to_list(1000)
-    
-    # Group permissions by menu path
-    permissions_by_menu = {}
-    for rp in role_permissions:
-        menu = await db.menus.find_one({"id": rp["menu_id"], "is_deleted": False})
-        if menu:
-            menu_path = menu["path"]
-            if menu_path not in permissions_by_menu:
-                permissions_by_menu[menu_path] = []
-            
-            # Get permission names
-            for perm_id in rp["permission_ids"]:
-                permission = await db.permissions.find_one({"id": perm_id})
-                if permission:
-                    permissions_by_menu[menu_path].append(permission["name"])
-    
-    return permissions_by_menu
+        return {menu_path: sorted(matrix[menu_path])} if menu_path in matrix else {}
+    return {path: sorted(names) for path, names in matrix.items()}
 
 async def check_permission(user: User, menu_path: str, permission_name: str) -> bool:
     """Check if user has specific permission for a menu"""
-    # Get user's role to check if they're an admin
-    user_doc = await db.users.find_one({"id": user.id, "is_deleted": False})
-    if user_doc:
-        role = await db.roles.find_one({"id": user_doc["role_id"], "is_deleted": False})
-        if role and role["name"].lower() == "admin":
-            # Admin role bypasses all permission checks
-            return True
-    
+    entry = await permission_cache.get(user.role_id)
+    if entry["is_admin"]:
+        # Admin role bypasses all permission checks
+        return True
+
     # For non-admin users, check permissions normally
-    user_permissions = await get_user_permissions(user.id, menu_path)
-    menu_permissions = user_permissions.get(menu_path, [])
-    return permission_name in menu_permissions
+    return permission_name in entry["matrix"].get(menu_path, ())
 
 def require_permission(menu_path: str, permission_name: str):
     """Decorator to check if user has required permission"""
@@ -641,7 +1750,7 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="Role not found")
     
     # Hash password and create user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_dict = user.dict()
     user_dict.pop("password")
     
@@ -655,7 +1764,7 @@ async def register(user: UserCreate):
 @api_router.post("/auth/login", response_model=APIResponse)
 async def login(login_data: LoginRequest):
     user = await db.users.find_one({"email": login_data.email, "is_deleted": False})
-    if not user or not verify_password(login_data.password, user["password"]):
+    if not user or not await verify_password_async(login_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
     if not user["is_active"]:
@@ -664,13 +1773,13 @@ async def login(login_data: LoginRequest):
     # Create tokens
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["id"]}, expires_delta=access_token_expires
+        data=build_access_claims(user), expires_delta=access_token_expires
     )
-    refresh_token = create_refresh_token(data={"sub": user["id"]})
+    refresh_token = await refresh_tokens.issue(user["id"])
     
     # Log the login
     login_log = LoginLog(user_id=user["id"])
-    await db.login_logs.insert_one(login_log.dict())
+    login_log_writer.write(login_log.dict())
     
     return APIResponse(
         success=True, 
@@ -688,8 +1797,53 @@ async def login(login_data: LoginRequest):
         }
     )
 
+@api_router.post("/auth/refresh", response_model=APIResponse)
+async def refresh_access_token(refresh_data: RefreshRequest):
+    try:
+        claims = jwt.decode(refresh_data.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    if claims.get("type") != "refresh" or not claims.get("jti") or not claims.get("fam"):
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    
+    token = await refresh_tokens.consume(claims)
+    if not token:
+        raise HTTPException(status_code=401, detail="Refresh token has been revoked")
+    
+    user = await db.users.find_one(
+        {"id": token["user_id"], "is_deleted": False},
+        {"_id": 0, "password": 0}
+    )
+    if not user or not user["is_active"]:
+        await refresh_tokens.revoke_family(token["family_id"])
+        raise HTTPException(status_code=401, detail="Account is inactive")
+    
+    # Rotate: the new refresh token continues the same family
+    access_token = create_access_token(
+        data=build_access_claims(user), expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    refresh_token = await refresh_tokens.issue(user["id"], token["family_id"])
+    
+    return APIResponse(
+        success=True,
+        message="Token refreshed",
+        data={
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "bearer"
+        }
+    )
+
 @api_router.get("/auth/me", response_model=APIResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
+    # Claims-based users only carry the token fields; load the full profile
+    if STATELESS_AUTH:
+        user = await db.users.find_one({"id": current_user.id, "is_deleted": False})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        current_user = User(**user)
+
     # Get user's role name
     user_data = current_user.dict()
     role = await db.roles.find_one({"id": current_user.role_id, "is_deleted": False})
@@ -706,6 +1860,26 @@ async def get_current_user_permissions(current_user: User = Depends(get_current_
     permissions = await get_user_permissions(current_user.id)
     return APIResponse(success=True, message="User permissions retrieved", data=permissions)
 
+@api_router.get("/system/cache-stats", response_model=APIResponse)
+@require_permission("/system", "view")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    """Get hit/miss statistics for the in-process caches"""
+    return APIResponse(success=True, message="Cache statistics retrieved", data={
+        "permissions": permission_cache.stats(),
+        "master_data": master_data_cache.stats(),
+        "lead_search": lead_search_index.stats(),
+        "invalidation": cache_bus.stats()
+    })
+
+@api_router.get("/system/log-writer-stats", response_model=APIResponse)
+@require_permission("/system", "view")
+async def get_log_writer_stats(current_user: User = Depends(get_current_user)):
+    """Get queue depth and dropped/written counters for the buffered log writers"""
+    return APIResponse(success=True, message="Log writer statistics retrieved", data={
+        "activity_logs": activity_log_writer.stats(),
+        "login_logs": login_log_writer.stats()
+    })
+
 # User management endpoints
 @api_router.get("/users", response_model=APIResponse)
 @require_permission("/users", "view")
@@ -715,34 +1889,16 @@ async def get_users(current_user: User = Depends(get_current_user)):
     for user in users:
         user_data = User(**user).dict()
         user_data.pop("password", None)  # Don't send password
-        
-        # Get role name
-        role = await db.roles.find_one({"id": user["role_id"], "is_deleted": False})
-        user_data["role_name"] = role["name"] if role else "Unknown"
-        
-        # Get department name
-        if user.get("department_id"):
-            dept = await db.departments.find_one({"id": user["department_id"], "is_deleted": False})
-            user_data["department_name"] = dept["name"] if dept else "Unknown"
-        else:
-            user_data["department_name"] = "Not assigned"
-        
-        # Get sub-department name
-        if user.get("sub_department_id"):
-            sub_dept = await db.sub_departments.find_one({"id": user["sub_department_id"], "is_deleted": False})
-            user_data["sub_department_name"] = sub_dept["name"] if sub_dept else "Unknown"
-        else:
-            user_data["sub_department_name"] = "Not assigned"
-        
-        # Get reporting to user name
-        if user.get("reporting_to"):
-            reporting_user = await db.users.find_one({"id": user["reporting_to"], "is_deleted": False})
-            user_data["reporting_to_name"] = reporting_user["name"] if reporting_user else "Unknown"
-        else:
-            user_data["reporting_to_name"] = "None"
-            
         users_data.append(user_data)
     
+    # Resolve role, department, sub-department and manager names in one query per collection
+    await resolve_foreign_keys(users_data, [
+        ForeignKey("role_id", "roles", empty="Unknown"),
+        ForeignKey("department_id", "departments", empty="Not assigned"),
+        ForeignKey("sub_department_id", "sub_departments", empty="Not assigned"),
+        ForeignKey("reporting_to", "users", target="reporting_to_name", empty="None")
+    ])
+    
     return APIResponse(success=True, message="Users retrieved", data=users_data)
 
 @api_router.post("/users", response_model=APIResponse)
@@ -797,7 +1953,7 @@ async def create_user(user: UserCreate, current_user: User = Depends(get_current
                     raise HTTPException(status_code=400, detail=f"Business vertical {vertical_id} not found")
         
         # Hash password and create user
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
         user_dict = user.dict()
         user_dict.pop("password")
         
@@ -817,8 +1973,8 @@ async def create_user(user: UserCreate, current_user: User = Depends(get_current
         await db.users.insert_one(user_data)
         
         # Log activity
-        activity_log = ActivityLog(user_id=current_user.id, action=f"Created user: {new_user.name}")
-        await db.activity_logs.insert_one(activity_log.dict())
+        activity_log = ActivityLog(user_id=current_user.id, action=f"Created user: {new_user.name}", entity_type="user", entity_id=new_user.id, verb="create")
+        await log_activity(activity_log)
         
         return APIResponse(success=True, message="User created successfully", data={"user_id": new_user.id})
         
@@ -976,14 +2132,23 @@ async def update_user(user_id: str, user_data: dict, current_user: User = Depend
     
     # Update password if provided
     if user_data.get("password"):
-        update_data["password"] = get_password_hash(user_data["password"])
+        update_data["password"] = await get_password_hash_async(user_data["password"])
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
     
+    # Tokens carry role, name and email claims; revoke them if any of those (or the password) changed
+    if "password" in update_data or any(
+        field in update_data and update_data[field] != existing_user.get(field)
+        for field in ("role_id", "name", "email")
+    ):
+        await auth_state.bump(user_id)
+    if "password" in update_data:
+        await refresh_tokens.revoke_user(user_id)
+    
     # Log activity
     user_name = user_data.get("name") or existing_user["name"]
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated user: {user_name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated user: {user_name}", entity_type="user", entity_id=user_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="User updated successfully")
 
@@ -1008,10 +2173,12 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
     }
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await auth_state.bump(user_id)
+    await refresh_tokens.revoke_user(user_id)
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted user: {user['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted user: {user['name']}", entity_type="user", entity_id=user_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="User deleted successfully")
 
@@ -1036,11 +2203,12 @@ async def toggle_user_status(user_id: str, current_user: User = Depends(get_curr
     }
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    await auth_state.bump(user_id)
     
     # Log activity
     status_text = "activated" if new_status else "deactivated"
-    activity_log = ActivityLog(user_id=current_user.id, action=f"User {user['name']} {status_text}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"User {user['name']} {status_text}", entity_type="user", entity_id=user_id, verb="activate" if new_status else "deactivate")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message=f"User {status_text} successfully")
 
@@ -1086,10 +2254,11 @@ async def create_permission(permission_data: dict, current_user: User = Depends(
     )
     
     await db.permissions.insert_one(permission.dict())
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created permission: {permission.name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created permission: {permission.name}", entity_type="permission", entity_id=permission.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Permission created successfully", data={"permission_id": permission.id})
 
@@ -1128,10 +2297,11 @@ async def update_permission(permission_id: str, permission_data: dict, current_u
     }
     
     await db.permissions.update_one({"id": permission_id}, {"$set": update_data})
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated permission: {permission_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated permission: {permission_data['name']}", entity_type="permission", entity_id=permission_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Permission updated successfully")
 
@@ -1149,10 +2319,11 @@ async def delete_permission(permission_id: str, current_user: User = Depends(get
     
     # Delete the permission (hard delete for permissions as they're system-level)
     await db.permissions.delete_one({"id": permission_id})
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted permission: {permission['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted permission: {permission['name']}", entity_type="permission", entity_id=permission_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Permission deleted successfully")
 
@@ -1163,20 +2334,14 @@ async def get_menus(current_user: User = Depends(get_current_user)):
     menus_data = []
     
     for menu in menus:
-        menu_data = Menu(**menu).dict()
-        
-        # Get parent menu name if exists
-        if menu.get("parent_id"):
-            parent = await db.menus.find_one({"id": menu["parent_id"], "is_deleted": False})
-            menu_data["parent_name"] = parent["name"] if parent else "Unknown"
-        else:
-            menu_data["parent_name"] = None
-            
-        # Count child menus
-        child_count = await db.menus.count_documents({"parent_id": menu["id"], "is_deleted": False})
-        menu_data["child_count"] = child_count
-        
-        menus_data.append(menu_data)
+        menus_data.append(Menu(**menu).dict())
+    
+    await resolve_foreign_keys(menus_data, [ForeignKey("parent_id", "menus", target="parent_name")])
+    
+    # Count child menus
+    child_counts = await count_by("menus", "parent_id", [menu["id"] for menu in menus_data])
+    for menu_data in menus_data:
+        menu_data["child_count"] = child_counts.get(menu_data["id"], 0)
     
     return APIResponse(success=True, message="Menus retrieved", data=menus_data)
 
@@ -1208,10 +2373,11 @@ async def create_menu(menu_data: dict, current_user: User = Depends(get_current_
     )
     
     await db.menus.insert_one(menu.dict())
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created menu: {menu.name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created menu: {menu.name}", entity_type="menu", entity_id=menu.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Menu created successfully", data={"menu_id": menu.id})
 
@@ -1271,10 +2437,11 @@ async def update_menu(menu_id: str, menu_data: dict, current_user: User = Depend
     }
     
     await db.menus.update_one({"id": menu_id}, {"$set": update_data})
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated menu: {menu_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated menu: {menu_data['name']}", entity_type="menu", entity_id=menu_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Menu updated successfully")
 
@@ -1303,10 +2470,11 @@ async def delete_menu(menu_id: str, current_user: User = Depends(get_current_use
     }
     
     await db.menus.update_one({"id": menu_id}, {"$set": update_data})
+    await cache_bus.publish("permissions")
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted menu: {menu['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted menu: {menu['name']}", entity_type="menu", entity_id=menu_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Menu deleted successfully")
 
@@ -1338,10 +2506,11 @@ async def create_role(role_data: dict, current_user: User = Depends(get_current_
     )
     
     await db.roles.insert_one(role.dict())
+    await cache_bus.publish("permissions", role.id)
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created role: {role.name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created role: {role.name}", entity_type="role", entity_id=role.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role created successfully", data={"role_id": role.id})
 
@@ -1385,10 +2554,11 @@ async def update_role(role_id: str, role_data: dict, current_user: User = Depend
     }
     
     await db.roles.update_one({"id": role_id}, {"$set": update_data})
+    await cache_bus.publish("permissions", role_id)
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated role: {role_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated role: {role_data['name']}", entity_type="role", entity_id=role_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role updated successfully")
 
@@ -1413,10 +2583,11 @@ async def delete_role(role_id: str, current_user: User = Depends(get_current_use
     }
     
     await db.roles.update_one({"id": role_id}, {"$set": update_data})
+    await cache_bus.publish("permissions", role_id)
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted role: {role['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted role: {role['name']}", entity_type="role", entity_id=role_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role deleted successfully")
 
@@ -1438,11 +2609,11 @@ async def get_departments(current_user: User = Depends(get_current_user)):
     departments = await db.departments.find({"is_deleted": False}).to_list(1000)
     departments_data = []
     
+    # Get sub-departments counts
+    sub_dept_counts = await count_by("sub_departments", "department_id", [dept["id"] for dept in departments])
     for dept in departments:
         dept_data = Department(**dept).dict()
-        # Get sub-departments count
-        sub_dept_count = await db.sub_departments.count_documents({"department_id": dept["id"], "is_deleted": False})
-        dept_data["sub_departments_count"] = sub_dept_count
+        dept_data["sub_departments_count"] = sub_dept_counts.get(dept["id"], 0)
         departments_data.append(dept_data)
     
     return APIResponse(success=True, message="Departments retrieved", data=departments_data)
@@ -1468,8 +2639,8 @@ async def create_department(department_data: dict, current_user: User = Depends(
     await db.departments.insert_one(department.dict())
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created department: {department.name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created department: {department.name}", entity_type="department", entity_id=department.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Department created successfully", data={"department_id": department.id})
 
@@ -1518,8 +2689,8 @@ async def update_department(department_id: str, department_data: dict, current_u
     await db.departments.update_one({"id": department_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated department: {department_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated department: {department_data['name']}", entity_type="department", entity_id=department_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Department updated successfully")
 
@@ -1550,8 +2721,8 @@ async def delete_department(department_id: str, current_user: User = Depends(get
     await db.departments.update_one({"id": department_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted department: {dept['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted department: {dept['name']}", entity_type="department", entity_id=department_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Department deleted successfully")
 
@@ -1599,8 +2770,8 @@ async def create_sub_department(department_id: str, sub_dept_data: dict, current
     await db.sub_departments.insert_one(sub_department.dict())
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created sub-department: {sub_department.name} under {department['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created sub-department: {sub_department.name} under {department['name']}", entity_type="sub_department", entity_id=sub_department.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Sub-department created successfully", data={"sub_department_id": sub_department.id})
 
@@ -1636,8 +2807,8 @@ async def update_sub_department(sub_dept_id: str, sub_dept_data: dict, current_u
     await db.sub_departments.update_one({"id": sub_dept_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated sub-department: {sub_dept_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated sub-department: {sub_dept_data['name']}", entity_type="sub_department", entity_id=sub_dept_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Sub-department updated successfully")
 
@@ -1658,8 +2829,8 @@ async def delete_sub_department(sub_dept_id: str, current_user: User = Depends(g
     await db.sub_departments.update_one({"id": sub_dept_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted sub-department: {sub_dept['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted sub-department: {sub_dept['name']}", entity_type="sub_department", entity_id=sub_dept_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Sub-department deleted successfully")
 
@@ -1690,8 +2861,8 @@ async def create_business_vertical(vertical_data: dict, current_user: User = Dep
     await db.business_verticals.insert_one(vertical.dict())
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Created business vertical: {vertical.name}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Created business vertical: {vertical.name}", entity_type="business_vertical", entity_id=vertical.id, verb="create")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Business vertical created successfully", data={"vertical_id": vertical.id})
 
@@ -1725,8 +2896,8 @@ async def update_business_vertical(vertical_id: str, vertical_data: dict, curren
     await db.business_verticals.update_one({"id": vertical_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated business vertical: {vertical_data['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Updated business vertical: {vertical_data['name']}", entity_type="business_vertical", entity_id=vertical_id, verb="update")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Business vertical updated successfully")
 
@@ -1747,8 +2918,8 @@ async def delete_business_vertical(vertical_id: str, current_user: User = Depend
     await db.business_verticals.update_one({"id": vertical_id}, {"$set": update_data})
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted business vertical: {vertical['name']}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Deleted business vertical: {vertical['name']}", entity_type="business_vertical", entity_id=vertical_id, verb="delete")
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Business vertical deleted successfully")
 
@@ -1782,8 +2953,8 @@ async def upload_profile_photo(file: UploadFile = File(...), current_user: User
     relative_path = f"/uploads/profile_photos/{unique_filename}"
     
     # Log activity
-    activity_log = ActivityLog(user_id=current_user.id, action=f"Uploaded profile photo: {unique_filename}")
-    await db.activity_logs.insert_one(activity_log.dict())
+    activity_log = ActivityLog(user_id=current_user.id, action=f"Uploaded profile photo: {unique_filename}", entity_type="user", entity_id=current_user.id, verb="upload")
+    await log_activity(activity_log)
     
     return APIResponse(
         success=True, 
@@ -1796,26 +2967,16 @@ async def upload_profile_photo(file: UploadFile = File(...), current_user: User
 async def get_role_permissions(current_user: User = Depends(get_current_user)):
     role_permissions = await db.role_permissions.find({"is_deleted": False}).to_list(1000)
     
-    # Enrich with role and menu names
+    # Remove MongoDB _id field to avoid serialization issues
     for rp in role_permissions:
-        # Remove MongoDB _id field to avoid serialization issues
         rp.pop("_id", None)
-        
-        # Get role name
-        role = await db.roles.find_one({"id": rp["role_id"], "is_deleted": False})
-        rp["role_name"] = role["name"] if role else "Unknown"
-        
-        # Get menu name
-        menu = await db.menus.find_one({"id": rp["menu_id"], "is_deleted": False})
-        rp["menu_name"] = menu["name"] if menu else "Unknown"
-        
-        # Get permission names
-        permission_names = []
-        for perm_id in rp["permission_ids"]:
-            perm = await db.permissions.find_one({"id": perm_id})
-            if perm:
-                permission_names.append(perm["name"])
-        rp["permission_names"] = permission_names
+    
+    # Enrich with role, menu and permission names
+    await resolve_foreign_keys(role_permissions, [
+        ForeignKey("role_id", "roles", empty="Unknown"),
+        ForeignKey("menu_id", "menus", empty="Unknown"),
+        ForeignKey("permission_ids", "permissions", target="permission_names", many=True, live_only=False)
+    ])
     
     return APIResponse(success=True, message="Role permissions retrieved", data=role_permissions)
 
@@ -1828,13 +2989,25 @@ async def get_role_permissions_by_role(role_id: str, current_user: User = Depend
     
     role_permissions = await db.role_permissions.find({"role_id": role_id, "is_deleted": False}).to_list(1000)
     
+    # Load the referenced menus and permissions up front
+    menus_by_id = {
+        menu["id"]: menu for menu in await db.menus.find(
+            {"id": {"$in": list({rp["menu_id"] for rp in role_permissions})}, "is_deleted": False}
+        ).to_list(None)
+    }
+    permissions_by_id = {
+        perm["id"]: perm for perm in await db.permissions.find(
+            {"id": {"$in": list({perm_id for rp in role_permissions for perm_id in rp["permission_ids"]})}}
+        ).to_list(None)
+    }
+    
     # Group by menu and enrich with names
     grouped_permissions = {}
     for rp in role_permissions:
         menu_id = rp["menu_id"]
         
         # Get menu details
-        menu = await db.menus.find_one({"id": menu_id, "is_deleted": False})
+        menu = menus_by_id.get(menu_id)
         if not menu:
             continue
             
@@ -1849,7 +3022,7 @@ async def get_role_permissions_by_role(role_id: str, current_user: User = Depend
         
         # Get permission details
         for perm_id in rp["permission_ids"]:
-            perm = await db.permissions.find_one({"id": perm_id})
+            perm = permissions_by_id.get(perm_id)
             if perm:
                 grouped_permissions[menu_id]["permissions"].append({
                     "id": perm["id"],
@@ -1911,13 +3084,17 @@ async def create_role_permission(
             "updated_by": current_user.id
         }
         await db.role_permissions.update_one({"id": existing["id"]}, {"$set": update_data})
+        await cache_bus.publish("permissions", role_id)
         
         # Log activity
         activity_log = ActivityLog(
             user_id=current_user.id, 
-            action=f"Updated role-permission mapping for role '{role['name']}' and menu '{menu['name']}'"
+            action=f"Updated role-permission mapping for role '{role['name']}' and menu '{menu['name']}'",
+            entity_type="role_permission",
+            entity_id=existing["id"],
+            verb="update"
         )
-        await db.activity_logs.insert_one(activity_log.dict())
+        await log_activity(activity_log)
         
         return APIResponse(success=True, message="Role-permission mapping updated successfully")
     else:
@@ -1931,13 +3108,17 @@ async def create_role_permission(
         )
         
         await db.role_permissions.insert_one(new_role_permission.dict())
+        await cache_bus.publish("permissions", role_id)
         
         # Log activity
         activity_log = ActivityLog(
             user_id=current_user.id, 
-            action=f"Created role-permission mapping for role '{role['name']}' and menu '{menu['name']}'"
+            action=f"Created role-permission mapping for role '{role['name']}' and menu '{menu['name']}'",
+            entity_type="role_permission",
+            entity_id=new_role_permission.id,
+            verb="create"
         )
-        await db.activity_logs.insert_one(activity_log.dict())
+        await log_activity(activity_log)
         
         return APIResponse(success=True, message="Role-permission mapping created successfully")
 
@@ -1968,6 +3149,7 @@ async def update_role_permission(
     }
     
     await db.role_permissions.update_one({"id": mapping_id}, {"$set": update_data})
+    await cache_bus.publish("permissions", existing["role_id"])
     
     # Get role and menu names for logging
     role = await db.roles.find_one({"id": existing["role_id"], "is_deleted": False})
@@ -1976,9 +3158,12 @@ async def update_role_permission(
     # Log activity
     activity_log = ActivityLog(
         user_id=current_user.id, 
-        action=f"Updated role-permission mapping for role '{role['name'] if role else 'Unknown'}' and menu '{menu['name'] if menu else 'Unknown'}'"
+        action=f"Updated role-permission mapping for role '{role['name'] if role else 'Unknown'}' and menu '{menu['name'] if menu else 'Unknown'}'",
+        entity_type="role_permission",
+        entity_id=mapping_id,
+        verb="update"
     )
-    await db.activity_logs.insert_one(activity_log.dict())
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role-permission mapping updated successfully")
 
@@ -1997,6 +3182,7 @@ async def delete_role_permission(mapping_id: str, current_user: User = Depends(g
     }
     
     await db.role_permissions.update_one({"id": mapping_id}, {"$set": update_data})
+    await cache_bus.publish("permissions", existing["role_id"])
     
     # Get role and menu names for logging
     role = await db.roles.find_one({"id": existing["role_id"], "is_deleted": False})
@@ -2005,9 +3191,12 @@ async def delete_role_permission(mapping_id: str, current_user: User = Depends(g
     # Log activity
     activity_log = ActivityLog(
         user_id=current_user.id, 
-        action=f"Deleted role-permission mapping for role '{role['name'] if role else 'Unknown'}' and menu '{menu['name'] if menu else 'Unknown'}'"
+        action=f"Deleted role-permission mapping for role '{role['name'] if role else 'Unknown'}' and menu '{menu['name'] if menu else 'Unknown'}'",
+        entity_type="role_permission",
+        entity_id=mapping_id,
+        verb="delete"
     )
-    await db.activity_logs.insert_one(activity_log.dict())
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role-permission mapping deleted successfully")
 
@@ -2035,6 +3224,7 @@ async def delete_role_permission_by_role_menu(
     }
     
     await db.role_permissions.update_one({"id": existing["id"]}, {"$set": update_data})
+    await cache_bus.publish("permissions", role_id)
     
     # Get role and menu names for logging
     role = await db.roles.find_one({"id": role_id, "is_deleted": False})
@@ -2043,27 +3233,406 @@ async def delete_role_permission_by_role_menu(
     # Log activity
     activity_log = ActivityLog(
         user_id=current_user.id, 
-        action=f"Removed permissions for role '{role['name'] if role else 'Unknown'}' from menu '{menu['name'] if menu else 'Unknown'}'"
+        action=f"Removed permissions for role '{role['name'] if role else 'Unknown'}' from menu '{menu['name'] if menu else 'Unknown'}'",
+        entity_type="role_permission",
+        entity_id=existing["id"],
+        verb="remove"
     )
-    await db.activity_logs.insert_one(activity_log.dict())
+    await log_activity(activity_log)
     
     return APIResponse(success=True, message="Role-permission mapping removed successfully")
 
+# Structured activity log backfill
+ACTIVITY_VERBS = {
+    "Created": "create", "Updated": "update", "Deleted": "delete", "Added": "add",
+    "Uploaded": "upload", "Removed": "remove", "Imported": "import", "Approved": "approve",
+    "Rejected": "reject", "Transitioned": "transition"
+}
+# Entities whose older log lines carry a name rather than an id
+ACTIVITY_NAME_COLLECTIONS = {
+    "user": "users", "permission": "permissions", "menu": "menus", "role": "roles",
+    "department": "departments", "sub_department": "sub_departments",
+    "business_vertical": "business_verticals"
+}
+OPPORTUNITY_CODE_RE = re.compile(r"\bOPP-[A-Z0-9]+\b")
+LEAD_CODE_RE = re.compile(r"\bLEAD-[A-Z0-9]+\b")
+UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+def parse_activity_action(log: dict) -> Dict[str, Any]:
+    """Derive entity_type/verb and a raw entity reference from a legacy action string"""
+    action = log.get("action", "")
+    verb = ACTIVITY_VERBS.get(action.split(" ", 1)[0], "other")
+    parsed = {"entity_type": None, "verb": verb, "ref": None, "ref_kind": None}
+
+    if action.startswith("Manual auto-conversion"):
+        parsed.update(entity_type="opportunity", verb="convert")
+    elif action.startswith("Executive override"):
+        parsed.update(entity_type="opportunity", verb="override")
+    elif action.startswith("Digital signature"):
+        parsed.update(entity_type="opportunity", verb="sign")
+
+    if re.search(r"\bopportunity\b", action):
+        parsed["entity_type"] = "opportunity"
+        code = OPPORTUNITY_CODE_RE.search(action)
+        uuid_match = UUID_RE.search(action)
+        if code:
+            parsed.update(ref=code.group(0), ref_kind="opportunity_code")
+        elif uuid_match:
+            parsed.update(ref=uuid_match.group(0), ref_kind="id")
+        return parsed
+
+    if re.search(r"\bleads?\b", action.split(":", 1)[0], re.IGNORECASE):
+        parsed["entity_type"] = "lead"
+        code = LEAD_CODE_RE.search(action)
+        if code:
+            parsed.update(ref=code.group(0), ref_kind="lead_code")
+        return parsed
+
+    company = re.search(r"(?:for company|company and related data): (\S+)$", action)
+    if company:
+        parsed.update(entity_type="company", ref=company.group(1), ref_kind="id")
+        return parsed
+
+    if "role-permission mapping" in action or action.startswith("Removed permissions for role"):
+        parsed["entity_type"] = "role_permission"
+        return parsed
+
+    if action.startswith("Uploaded profile photo"):
+        parsed.update(entity_type="user", ref=log.get("user_id"), ref_kind="id")
+        return parsed
+
+    status = re.match(r"^User (.+) (activated|deactivated)$", action)
+    if status:
+        parsed.update(entity_type="user", verb=status.group(2)[:-1], ref=status.group(1), ref_kind="name")
+        return parsed
+
+    generic = re.match(r"^(?:Created|Updated|Deleted) ([A-Za-z_ -]+?): (.+)$", action)
+    if generic:
+        entity_type = generic.group(1).lower().replace("-", "_").replace(" ", "_")
+        value = generic.group(2)
+        if entity_type == "sub_department":
+            value = value.split(" under ", 1)[0]
+        parsed["entity_type"] = entity_type
+        if entity_type in ACTIVITY_NAME_COLLECTIONS:
+            parsed.update(ref=value, ref_kind="name")
+        elif verb == "delete" or (verb == "update" and entity_type in ("partner", "company")):
+            # These lines log the record id; the rest log a display value
+            parsed.update(ref=value, ref_kind="id")
+    return parsed
+
+async def backfill_activity_log_fields(batch_size: int = 500) -> int:
+    """Populate entity_type/entity_id/verb on legacy activity logs; safe to stop and re-run"""
+    name_maps: Dict[str, Dict[str, Optional[str]]] = {}
+
+    async def resolve_name(entity_type: str, name: str) -> Optional[str]:
+        if entity_type not in name_maps:
+            names: Dict[str, Optional[str]] = {}
+            async for doc in db[ACTIVITY_NAME_COLLECTIONS[entity_type]].find({}, {"_id": 0, "id": 1, "name": 1}):
+                # Ambiguous names resolve to nothing rather than to the wrong record
+                names[doc.get("name")] = None if doc.get("name") in names else doc.get("id")
+            name_maps[entity_type] = names
+        return name_maps[entity_type].get(name)
+
+    updated = 0
+    first_timestamp: Optional[datetime] = None
+    while True:
+        # Every processed entry gets a verb, so re-running picks up where the last run stopped
+        batch = await db.activity_logs.find(
+            {"verb": {"$exists": False}}, {"_id": 1, "user_id": 1, "action": 1, "timestamp": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        timestamps = [log["timestamp"] for log in batch if log.get("timestamp")]
+        if timestamps:
+            first_timestamp = min([first_timestamp, *timestamps] if first_timestamp else timestamps)
+
+        parsed_batch = [(log, parse_activity_action(log)) for log in batch]
+        opportunity_codes = {p["ref"] for _, p in parsed_batch if p["ref_kind"] == "opportunity_code"}
+        lead_codes = {p["ref"] for _, p in parsed_batch if p["ref_kind"] == "lead_code"}
+        opportunity_ids = {}
+        if opportunity_codes:
+            async for opp in db.opportunities.find(
+                {"opportunity_id": {"$in": list(opportunity_codes)}}, {"_id": 0, "id": 1, "opportunity_id": 1}
+            ):
+                opportunity_ids[opp["opportunity_id"]] = opp["id"]
+        lead_ids = {}
+        if lead_codes:
+            async for lead in db.leads.find(
+                {"lead_id": {"$in": list(lead_codes)}}, {"_id": 0, "id": 1, "lead_id": 1}
+            ):
+                lead_ids[lead["lead_id"]] = lead["id"]
+
+        operations = []
+        for log, parsed in parsed_batch:
+            ref, ref_kind = parsed["ref"], parsed["ref_kind"]
+            if ref_kind == "opportunity_code":
+                entity_id = opportunity_ids.get(ref)
+            elif ref_kind == "lead_code":
+                entity_id = lead_ids.get(ref)
+            elif ref_kind == "name":
+                entity_id = await resolve_name(parsed["entity_type"], ref)
+            else:
+                entity_id = ref
+            operations.append(UpdateOne({"_id": log["_id"]}, {"$set": {
+                "entity_type": parsed["entity_type"],
+                "entity_id": entity_id,
+                "verb": parsed["verb"]
+            }}))
+
+        await db.activity_logs.bulk_write(operations, ordered=False)
+        updated += len(operations)
+        logger.info("Backfilled %d activity log entries", updated)
+
+    if first_timestamp:
+        # Days already rolled up counted these entries as "Other"; have the rollup job redo them
+        await log_rollup_job.rewind(first_timestamp)
+    return updated
+
+# Daily log rollups
+LOG_ROLLUP_SOURCES = {
+    "activity": ("activity_logs", "timestamp"),
+    "login": ("login_logs", "login_time")
+}
+LOG_ROLLUP_INTERVAL_SECONDS = int(os.environ.get('LOG_ROLLUP_INTERVAL_SECONDS', '900'))
+# Leave buffered writers time to flush the previous day before it is closed
+LOG_ROLLUP_GRACE = timedelta(minutes=5)
+
+def utc_day_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day, tzinfo=timezone.utc)
+
+async def aggregate_log_counts(kind: str, start: datetime, end: datetime) -> List[dict]:
+    """Count log entries in [start, end) by day, user and action type"""
+    collection, time_field = LOG_ROLLUP_SOURCES[kind]
+    if kind == "activity":
+        action_type = {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$verb", "create"]}, "then": "Created"},
+                {"case": {"$eq": ["$verb", "update"]}, "then": "Updated"},
+                {"case": {"$eq": ["$verb", "delete"]}, "then": "Deleted"}
+            ],
+            "default": "Other"
+        }}
+    else:
+        action_type = "Login"
+    pipeline = [
+        {"$match": {"is_active": True, time_field: {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": f"${time_field}"}},
+                "user_id": "$user_id",
+                "action_type": action_type
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    rows = await db[collection].aggregate(pipeline).to_list(None)
+    return [{**row["_id"], "count": row["count"]} for row in rows]
+
+class LogRollupJob:
+    """Rolls closed days of activity/login logs into log_daily_rollups"""
+
+    def __init__(self, interval_seconds: int = LOG_ROLLUP_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def rolled_until(self) -> Optional[datetime]:
+        """First day that has not been rolled up yet (None before the first run)"""
+        state = await db.log_rollup_state.find_one({"id": "daily"})
+        if not state:
+            return None
+        return datetime.strptime(state["rolled_until"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+    async def _first_log_day(self) -> datetime:
+        first_days = []
+        for collection, time_field in LOG_ROLLUP_SOURCES.values():
+            first = await db[collection].find_one({}, {"_id": 0, time_field: 1}, sort=[(time_field, 1)])
+            if first and first.get(time_field):
+                first_days.append(utc_day_start(first[time_field]))
+        return min(first_days) if first_days else utc_day_start(datetime.now(timezone.utc))
+
+    async def rewind(self, moment: datetime):
+        """Move the watermark back so the day of moment and every later day are rolled up again"""
+        day = utc_day_start(moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc))
+        await db.log_rollup_state.update_one(
+            {"id": "daily"},
+            {"$min": {"rolled_until": day.strftime("%Y-%m-%d")}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        )
+
+    async def run_once(self) -> int:
+        """Roll up every closed day since the last run; returns the number of days rolled"""
+        now = datetime.now(timezone.utc)
+        day = await self.rolled_until()
+        first_run = day is None
+        if first_run:
+            day = await self._first_log_day()
+        rolled = 0
+        while day + timedelta(days=1) + LOG_ROLLUP_GRACE <= now:
+            next_day = day + timedelta(days=1)
+            day_key = day.strftime("%Y-%m-%d")
+            for kind in LOG_ROLLUP_SOURCES:
+                rows = await aggregate_log_counts(kind, day, next_day)
+                if rows:
+                    # $set rather than $inc so re-running a day (or two workers racing) is harmless
+                    await db.log_daily_rollups.bulk_write([
+                        UpdateOne(
+                            {"kind": kind, "day": row["day"], "user_id": row["user_id"], "action_type": row["action_type"]},
+                            {"$set": {"count": row["count"], "rolled_at": now}},
+                            upsert=True
+                        )
+                        for row in rows
+                    ], ordered=False)
+                # A re-rolled day can lose rows, e.g. "Other" counts once a backfill sets verbs
+                await db.log_daily_rollups.delete_many({"kind": kind, "day": day_key, "rolled_at": {"$not": {"$gte": now}}})
+            # Only advance from the day just rolled; if a backfill rewound the watermark (or
+            # another worker moved it) meanwhile, leave it there for the next run
+            advance = {"rolled_until": next_day.strftime("%Y-%m-%d"), "updated_at": now}
+            try:
+                if first_run:
+                    result = await db.log_rollup_state.update_one({"id": "daily"}, {"$setOnInsert": advance}, upsert=True)
+                    advanced = result.upserted_id is not None
+                    first_run = False
+                else:
+                    result = await db.log_rollup_state.update_one({"id": "daily", "rolled_until": day_key}, {"$set": advance})
+                    advanced = result.modified_count > 0
+            except DuplicateKeyError:
+                advanced = False
+            if not advanced:
+                break
+            day = next_day
+            rolled += 1
+        return rolled
+
+    async def _run(self):
+        while True:
+            try:
+                rolled = await self.run_once()
+                if rolled:
+                    logger.info("Rolled up %d day(s) of logs", rolled)
+            except Exception:
+                logger.exception("Log rollup failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+log_rollup_job = LogRollupJob()
+
+async def summarize_log_counts(kind: str, start: datetime, end: datetime, rolled_until: Optional[datetime]) -> Dict[str, Dict[str, int]]:
+    """Counts by day, action type and user: closed days from rollups, the rest live"""
+    by_day: Dict[str, int] = {}
+    by_action: Dict[str, int] = {}
+    by_user: Dict[str, int] = {}
+
+    live_start = start
+    if rolled_until and rolled_until > start:
+        live_start = rolled_until
+        facets = await db.log_daily_rollups.aggregate([
+            {"$match": {
+                "kind": kind,
+                "day": {"$gte": start.strftime("%Y-%m-%d"), "$lt": rolled_until.strftime("%Y-%m-%d")}
+            }},
+            {"$facet": {
+                "by_day": [{"$group": {"_id": "$day", "count": {"$sum": "$count"}}}],
+                "by_action": [{"$group": {"_id": "$action_type", "count": {"$sum": "$count"}}}],
+                "by_user": [{"$group": {"_id": "$user_id", "count": {"$sum": "$count"}}}]
+            }}
+        ]).to_list(1)
+        if facets:
+            for name, target in (("by_day", by_day), ("by_action", by_action), ("by_user", by_user)):
+                for row in facets[0][name]:
+                    target[row["_id"]] = row["count"]
+
+    for row in await aggregate_log_counts(kind, live_start, end):
+        by_day[row["day"]] = by_day.get(row["day"], 0) + row["count"]
+        by_action[row["action_type"]] = by_action.get(row["action_type"], 0) + row["count"]
+        by_user[row["user_id"]] = by_user.get(row["user_id"], 0) + row["count"]
+
+    return {"by_day": by_day, "by_action": by_action, "by_user": by_user}
+
 # Activity and Login Logs Reporting endpoints
-@api_router.get("/logs/activity", response_model=APIResponse)
-async def get_activity_logs(
-    page: int = 1,
-    limit: int = 50,
+LOG_COUNT_ESTIMATE_CAP = 10000
+
+def encode_log_cursor(moment: datetime, log_id: str) -> str:
+    """Opaque continuation token for (time, id) keyset pagination"""
+    raw = json.dumps({"t": moment.isoformat(), "id": log_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_log_cursor(token: str):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return datetime.fromisoformat(raw["t"]), raw["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def paginate_logs(
+    collection: str,
+    time_field: str,
+    filter_query: dict,
+    page: int,
+    limit: int,
+    cursor: Optional[str],
+    count: Optional[str]
+):
+    """Page through a log collection newest first, by page number or by keyset cursor"""
+    count_mode = count or ("none" if cursor else "exact")
+    if count_mode not in ("exact", "estimated", "none"):
+        raise HTTPException(status_code=400, detail="count must be exact, estimated or none")
+    
+    find = db[collection].find
+    sort = [(time_field, -1), ("id", -1)]
+    if cursor:
+        moment, log_id = decode_log_cursor(cursor)
+        keyset_query = {"$and": [filter_query, {"$or": [
+            {time_field: {"$lt": moment}},
+            {time_field: moment, "id": {"$lt": log_id}}
+        ]}]}
+        logs = await find(keyset_query).sort(sort).limit(limit + 1).to_list(limit + 1)
+    else:
+        logs = await find(filter_query).sort(sort).skip((page - 1) * limit).limit(limit + 1).to_list(limit + 1)
+    
+    # The extra row only tells us whether another page exists
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    pagination = {
+        "current_page": None if cursor else page,
+        "items_per_page": limit,
+        "next_cursor": encode_log_cursor(logs[-1][time_field], logs[-1]["id"]) if has_more else None
+    }
+    
+    total_count = None
+    is_estimate = False
+    if count_mode == "exact":
+        total_count = await db[collection].count_documents(filter_query)
+    elif count_mode == "estimated":
+        if filter_query == {"is_active": True}:
+            total_count = await db[collection].estimated_document_count()
+            is_estimate = True
+        else:
+            total_count = await db[collection].count_documents(filter_query, limit=LOG_COUNT_ESTIMATE_CAP)
+            is_estimate = total_count >= LOG_COUNT_ESTIMATE_CAP
+    if total_count is not None:
+        pagination.update({
+            "total_pages": (total_count + limit - 1) // limit,
+            "total_items": total_count,
+            "total_is_estimate": is_estimate
+        })
+    
+    return logs, pagination
+
+def build_activity_log_filter(
     user_id: Optional[str] = None,
     action_filter: Optional[str] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Get activity logs with filtering and pagination"""
-    skip = (page - 1) * limit
-    
-    # Build filter query
+    end_date: Optional[str] = None
+) -> dict:
+    """Mongo filter shared by the activity log listing and export endpoints"""
     filter_query = {"is_active": True}
     
     if user_id:
@@ -2089,32 +3658,36 @@ async def get_activity_logs(
         if date_filter:
             filter_query["timestamp"] = date_filter
     
-    # Get total count for pagination
-    total_count = await db.activity_logs.count_documents(filter_query)
+    return filter_query
+
+@api_router.get("/logs/activity", response_model=APIResponse)
+async def get_activity_logs(
+    page: int = 1,
+    limit: int = 50,
+    user_id: Optional[str] = None,
+    action_filter: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get activity logs with filtering and pagination (page number or continuation cursor)"""
+    filter_query = build_activity_log_filter(user_id, action_filter, start_date, end_date)
     
-    # Get logs with pagination
-    logs = await db.activity_logs.find(filter_query).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
+    logs, pagination = await paginate_logs(
+        "activity_logs", "timestamp", filter_query, page, limit, cursor, count
+    )
     
     # Enrich with user information
-    enriched_logs = []
-    for log in logs:
-        user = await db.users.find_one({"id": log["user_id"], "is_deleted": False})
-        log_data = ActivityLog(**log).dict()
-        log_data["user_name"] = user["name"] if user else "Unknown User"
-        log_data["user_email"] = user["email"] if user else "Unknown Email"
-        enriched_logs.append(log_data)
+    enriched_logs = await resolve_foreign_keys([ActivityLog(**log).dict() for log in logs], USER_NAME_REFS)
     
     return APIResponse(
         success=True, 
         message="Activity logs retrieved", 
         data={
             "logs": enriched_logs,
-            "pagination": {
-                "current_page": page,
-                "total_pages": (total_count + limit - 1) // limit,
-                "total_items": total_count,
-                "items_per_page": limit
-            }
+            "pagination": pagination
         }
     )
 
@@ -2125,11 +3698,11 @@ async def get_login_logs(
     user_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Get login logs with filtering and pagination"""
-    skip = (page - 1) * limit
-    
+    """Get login logs with filtering and pagination (page number or continuation cursor)"""
     # Build filter query
     filter_query = {"is_active": True}
     
@@ -2153,32 +3726,19 @@ async def get_login_logs(
         if date_filter:
             filter_query["login_time"] = date_filter
     
-    # Get total count for pagination
-    total_count = await db.login_logs.count_documents(filter_query)
-    
-    # Get logs with pagination
-    logs = await db.login_logs.find(filter_query).sort("login_time", -1).skip(skip).limit(limit).to_list(limit)
+    logs, pagination = await paginate_logs(
+        "login_logs", "login_time", filter_query, page, limit, cursor, count
+    )
     
     # Enrich with user information
-    enriched_logs = []
-    for log in logs:
-        user = await db.users.find_one({"id": log["user_id"], "is_deleted": False})
-        log_data = LoginLog(**log).dict()
-        log_data["user_name"] = user["name"] if user else "Unknown User"
-        log_data["user_email"] = user["email"] if user else "Unknown Email"
-        enriched_logs.append(log_data)
+    enriched_logs = await resolve_foreign_keys([LoginLog(**log).dict() for log in logs], USER_NAME_REFS)
     
     return APIResponse(
         success=True, 
         message="Login logs retrieved", 
         data={
             "logs": enriched_logs,
-            "pagination": {
-                "current_page": page,
-                "total_pages": (total_count + limit - 1) // limit,
-                "total_items": total_count,
-                "items_per_page": limit
-            }
+            "pagination": pagination
         }
     )
 
@@ -2188,110 +3748,45 @@ async def get_logs_analytics(
     current_user: User = Depends(get_current_user)
 ):
     """Get analytics data for logs dashboard"""
-    from datetime import timedelta
-    
-    # Calculate date range
+    # Whole days from the one containing the start of the window up to now
     end_date = datetime.now(timezone.utc)
-    start_date = end_date - timedelta(days=days)
-    
-    # Activity logs analytics
-    activity_pipeline = [
-        {"$match": {
-            "is_active": True,
-            "timestamp": {"$gte": start_date, "$lte": end_date}
-        }},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    
-    activity_by_date = await db.activity_logs.aggregate(activity_pipeline).to_list(days)
-    
-    # Activity by action type
-    action_pipeline = [
-        {"$match": {
-            "is_active": True,
-            "timestamp": {"$gte": start_date, "$lte": end_date}
-        }},
-        {"$group": {
-            "_id": {"$regexFind": {"input": "$action", "regex": r"^(Created|Updated|Deleted)"}},
-            "count": {"$sum": 1}
-        }},
-        {"$project": {
-            "action_type": {"$ifNull": ["$_id.match", "Other"]},
-            "count": 1
-        }}
-    ]
+    start_date = utc_day_start(end_date - timedelta(days=days))
+    rolled_until = await log_rollup_job.rolled_until()
     
-    activity_by_action = await db.activity_logs.aggregate(action_pipeline).to_list(10)
+    activity = await summarize_log_counts("activity", start_date, end_date, rolled_until)
+    logins = await summarize_log_counts("login", start_date, end_date, rolled_until)
     
-    # Login logs analytics
-    login_pipeline = [
-        {"$match": {
-            "is_active": True,
-            "login_time": {"$gte": start_date, "$lte": end_date}
-        }},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$login_time"}},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
+    activity_by_date = [{"_id": day, "count": count} for day, count in sorted(activity["by_day"].items())]
+    activity_by_action = [
+        {"_id": action_type, "action_type": action_type, "count": count}
+        for action_type, count in activity["by_action"].items()
     ]
-    
-    logins_by_date = await db.login_logs.aggregate(login_pipeline).to_list(days)
-    
-    # Most active users
-    user_activity_pipeline = [
-        {"$match": {
-            "is_active": True,
-            "timestamp": {"$gte": start_date, "$lte": end_date}
-        }},
-        {"$group": {
-            "_id": "$user_id",
-            "activity_count": {"$sum": 1}
-        }},
-        {"$sort": {"activity_count": -1}},
-        {"$limit": 10}
+    logins_by_date = [{"_id": day, "count": count} for day, count in sorted(logins["by_day"].items())]
+    
+    # Most active users, enriched with one user query
+    top_users = sorted(activity["by_user"].items(), key=lambda item: item[1], reverse=True)[:10]
+    users = await db.users.find(
+        {"id": {"$in": [user_id for user_id, _ in top_users]}, "is_deleted": False},
+        {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    user_names = {user["id"]: user["name"] for user in users}
+    enriched_user_activities = [
+        {
+            "user_id": user_id,
+            "user_name": user_names.get(user_id, "Unknown User"),
+            "activity_count": count
+        }
+        for user_id, count in top_users
     ]
     
-    user_activities = await db.activity_logs.aggregate(user_activity_pipeline).to_list(10)
-    
-    # Enrich user activities with user names
-    enriched_user_activities = []
-    for activity in user_activities:
-        user = await db.users.find_one({"id": activity["_id"], "is_deleted": False})
-        enriched_user_activities.append({
-            "user_id": activity["_id"],
-            "user_name": user["name"] if user else "Unknown User",
-            "activity_count": activity["activity_count"]
-        })
-    
-    # Summary statistics
-    total_activities = await db.activity_logs.count_documents({
-        "is_active": True,
-        "timestamp": {"$gte": start_date, "$lte": end_date}
-    })
-    
-    total_logins = await db.login_logs.count_documents({
-        "is_active": True,
-        "login_time": {"$gte": start_date, "$lte": end_date}
-    })
-    
-    unique_active_users = len(await db.activity_logs.distinct("user_id", {
-        "is_active": True,
-        "timestamp": {"$gte": start_date, "$lte": end_date}
-    }))
-    
     return APIResponse(
         success=True,
         message="Analytics data retrieved",
         data={
             "summary": {
-                "total_activities": total_activities,
-                "total_logins": total_logins,
-                "unique_active_users": unique_active_users,
+                "total_activities": sum(activity["by_day"].values()),
+                "total_logins": sum(logins["by_day"].values()),
+                "unique_active_users": len(activity["by_user"]),
                 "date_range_days": days
             },
             "activity_by_date": activity_by_date,
@@ -2301,77 +3796,709 @@ async def get_logs_analytics(
         }
     )
 
-@api_router.get("/logs/export/activity", response_model=APIResponse)
+EXPORT_BATCH_SIZE = 1000
+EXPORT_USER_CACHE_LIMIT = 10000
+ACTIVITY_EXPORT_COLUMNS = ["Date", "Time", "User Name", "User Email", "Action"]
+
+async def iter_activity_export(filter_query: dict, export_format: str, compress: bool):
+    """Yield an activity log export chunk by chunk, one cursor batch at a time"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    users: Dict[str, Optional[dict]] = {}
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    async def render(batch: List[dict]):
+        missing = {log["user_id"] for log in batch if log.get("user_id") not in users}
+        if missing:
+            if len(users) > EXPORT_USER_CACHE_LIMIT:
+                users.clear()
+            found = await db.users.find(
+                {"id": {"$in": list(missing)}, "is_deleted": False},
+                {"_id": 0, "id": 1, "name": 1, "email": 1}
+            ).to_list(None)
+            users.update({user_id: None for user_id in missing})
+            users.update({user["id"]: user for user in found})
+
+        for log in batch:
+            user = users.get(log.get("user_id"))
+            user_name = user["name"] if user else "Unknown User"
+            user_email = user["email"] if user else "Unknown Email"
+            timestamp = log["timestamp"]
+            if export_format == "csv":
+                writer.writerow([
+                    timestamp.strftime("%Y-%m-%d"), timestamp.strftime("%H:%M:%S"),
+                    user_name, user_email, log["action"]
+                ])
+            else:
+                buffer.write(json.dumps({
+                    "id": log.get("id"),
+                    "timestamp": timestamp.isoformat(),
+                    "user_id": log.get("user_id"),
+                    "user_name": user_name,
+                    "user_email": user_email,
+                    "action": log["action"],
+                    "entity_type": log.get("entity_type"),
+                    "entity_id": log.get("entity_id"),
+                    "verb": log.get("verb")
+                }) + "\n")
+
+    if export_format == "csv":
+        writer.writerow(ACTIVITY_EXPORT_COLUMNS)
+
+    cursor = db.activity_logs.find(filter_query, {"_id": 0}).sort("timestamp", -1).batch_size(EXPORT_BATCH_SIZE)
+    batch = []
+    async for log in cursor:
+        batch.append(log)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            await render(batch)
+            batch = []
+            yield take()
+    if batch:
+        await render(batch)
+    yield take()
+    if compressor:
+        yield compressor.flush()
+
+@api_router.get("/logs/export/activity")
 async def export_activity_logs(
     format: str = "csv",
+    gzip: bool = False,
     user_id: Optional[str] = None,
     action_filter: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Export activity logs to CSV format"""
-    if format.lower() != "csv":
-        raise HTTPException(status_code=400, detail="Only CSV format is currently supported")
+    """Stream activity logs as CSV or NDJSON, optionally gzip-compressed (or write them in a background job)"""
+    export_format = format.lower()
+    if export_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Supported formats are csv and ndjson")
+    
+    filter_query = build_activity_log_filter(user_id, action_filter, start_date, end_date)
+    if background:
+        return await queue_job("activity_export", current_user, {
+            "format": export_format, "gzip": gzip, "user_id": user_id, "action_filter": action_filter,
+            "start_date": start_date, "end_date": end_date
+        })
     
-    # Build filter query (same as get_activity_logs)
-    filter_query = {"is_active": True}
+    filename = f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
     
-    if user_id:
-        filter_query["user_id"] = user_id
-        
-    if action_filter:
-        filter_query["action"] = {"$regex": action_filter, "$options": "i"}
-        
-    if start_date or end_date:
-        date_filter = {}
-        if start_date:
+    return StreamingResponse(
+        iter_activity_export(filter_query, export_format, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Background jobs
+JOB_DIR = Path(os.environ.get('JOB_DIR', 'job_files'))
+JOB_DIR.mkdir(exist_ok=True)
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '2'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+JOB_MAX_ATTEMPTS = 3
+JOB_PROGRESS_INTERVAL_SECONDS = 1.0
+JOB_PURGE_INTERVAL_SECONDS = 3600
+JOB_FINISHED_STATUSES = ["succeeded", "failed", "cancelled"]
+JOB_PUBLIC_FIELDS = [
+    "id", "type", "status", "params", "progress", "result", "result_file", "error", "attempts",
+    "cancel_requested", "created_by", "created_at", "started_at", "finished_at", "updated_at"
+]
+
+class JobType:
+    """A kind of background job: its handler, how many may run at once per worker and who may start it"""
+
+    def __init__(self, name: str, handler, concurrency: int = 1, menu_path: Optional[str] = None,
+                 permission: str = "view", api: bool = True, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.menu_path = menu_path  # None: any signed-in user
+        self.permission = permission
+        self.api = api  # False for jobs that need input only their own endpoint can supply
+        self.max_attempts = max_attempts  # 1 for handlers that cannot safely start over
+
+class JobContext:
+    """Handed to a job handler: its params, a directory for files and progress reporting"""
+
+    def __init__(self, job: dict):
+        self.id = job["id"]
+        self.params = job.get("params") or {}
+        self.user_id = job.get("created_by")
+        self.dir = JOB_DIR / job["id"]
+        self.result_file: Optional[Dict[str, str]] = None
+        self.last_progress: Optional[Dict[str, Any]] = None
+        self._reported_at = 0.0
+
+    def path(self, filename: str) -> Path:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        return self.dir / filename
+
+    def output(self, filename: str, media_type: str) -> Path:
+        """Path to write the job's downloadable result to"""
+        self.result_file = {"filename": filename, "media_type": media_type}
+        return self.path(filename)
+
+    async def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """Record progress (written at most once per JOB_PROGRESS_INTERVAL_SECONDS); stops the job if it was cancelled"""
+        self.last_progress = {"done": done, "total": total, "message": message}
+        loop_time = asyncio.get_running_loop().time()
+        if loop_time - self._reported_at < JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        self._reported_at = loop_time
+        job = await db.jobs.find_one_and_update(
+            {"id": self.id},
+            {"$set": {"progress": self.last_progress, "updated_at": datetime.now(timezone.utc)}},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if job and job.get("cancel_requested"):
+            raise asyncio.CancelledError()
+
+class JobRunner:
+    """Runs jobs queued in the jobs collection in the background
+
+    Every worker polls for queued jobs and claims one with an atomic update, taking up
+    to each job type's concurrency at a time. A claimed job holds a lease that the
+    worker extends while the handler runs. If the worker dies, the lease runs out and
+    another worker starts the job over, up to the type's max_attempts. On a clean
+    shutdown, running jobs go straight back to the queue, except those of types with a
+    single attempt, which fail instead.
+    """
+
+    def __init__(self, poll_interval: float = JOB_POLL_INTERVAL_SECONDS, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.types: Dict[str, JobType] = {}
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[str, tuple] = {}  # job id: (job type, task)
+        self._stopping = False
+        self._next_purge = 0.0
+        self.counts = {"started": 0, "resumed": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "requeued": 0}
+
+    def register(self, name: str, handler, **options):
+        self.types[name] = JobType(name, handler, **options)
+
+    async def enqueue(self, job_type: str, params: Optional[dict] = None, user_id: Optional[str] = None,
+                      inputs: Optional[Dict[str, bytes]] = None) -> dict:
+        """Queue a job; inputs are files written to the job's directory before it can be claimed"""
+        if job_type not in self.types:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = str(uuid.uuid4())
+        for filename, data in (inputs or {}).items():
+            (JOB_DIR / job_id).mkdir(parents=True, exist_ok=True)
+            async with aiofiles.open(JOB_DIR / job_id / filename, "wb") as f:
+                await f.write(data)
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": job_id, "type": job_type, "status": "queued", "params": params or {},
+            "progress": None, "result": None, "result_file": None, "error": None, "attempts": 0,
+            "cancel_requested": False, "created_by": user_id, "created_at": now,
+            "started_at": None, "finished_at": None, "updated_at": now
+        }
+        await db.jobs.insert_one(job)
+        job.pop("_id", None)
+        if self._wakeup:
+            self._wakeup.set()
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Cancel a queued job outright; ask the worker running a running one to stop it"""
+        now = datetime.now(timezone.utc)
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "finished_at": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            job = await db.jobs.find_one_and_update(
+                {"id": job_id, "status": "running"},
+                {"$set": {"cancel_requested": True, "updated_at": now}},
+                return_document=ReturnDocument.AFTER
+            )
+            if job and job_id in self._running:
+                self._running[job_id][1].cancel()
+        return job or await db.jobs.find_one({"id": job_id}, {"_id": 0})
+
+    def running(self, job_type: str) -> int:
+        return sum(1 for name, _ in self._running.values() if name == job_type)
+
+    async def _claim(self, job_type: str) -> Optional[dict]:
+        """Take the oldest queued job of a type, or one whose worker's lease has run out"""
+        now = datetime.now(timezone.utc)
+        job = await db.jobs.find_one_and_update(
+            {"type": job_type, "$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]},
+            {
+                "$set": {
+                    "status": "running", "worker": self.worker_id, "started_at": now,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)], return_document=ReturnDocument.AFTER
+        )
+        if job:
+            job.pop("_id", None)
+        return job
+
+    async def _finish(self, job_id: str, status: str, **fields):
+        now = datetime.now(timezone.utc)
+        await db.jobs.update_one(
+            {"id": job_id, "worker": self.worker_id},
+            {"$set": {"status": status, "finished_at": now, "updated_at": now, **fields}, "$unset": {"lease_until": ""}}
+        )
+        self.counts[status] += 1
+
+    async def _requeue(self, job_id: str):
+        """Hand a job interrupted by shutdown back to the queue without counting the attempt"""
+        await db.jobs.update_one(
+            {"id": job_id, "worker": self.worker_id},
+            {"$set": {"status": "queued", "worker": None, "updated_at": datetime.now(timezone.utc)},
+             "$unset": {"lease_until": ""}, "$inc": {"attempts": -1}}
+        )
+        self.counts["requeued"] += 1
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task):
+        """Extend the lease while the handler runs; stop the handler if the job was cancelled or taken over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            now = datetime.now(timezone.utc)
             try:
-                start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                date_filter["$gte"] = start_dt
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid start_date format")
-        if end_date:
+                job = await db.jobs.find_one_and_update(
+                    {"id": job_id, "worker": self.worker_id, "status": "running"},
+                    {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now}},
+                    projection={"cancel_requested": 1}, return_document=ReturnDocument.AFTER
+                )
+            except Exception:
+                logger.exception("Could not extend the lease of job %s", job_id)
+                continue
+            if job is None or job.get("cancel_requested"):
+                task.cancel()
+                return
+
+    async def _execute(self, job: dict):
+        if job.get("cancel_requested"):
+            await self._finish(job["id"], "cancelled")
+            return
+        max_attempts = self.types[job["type"]].max_attempts
+        if job["attempts"] > max_attempts:
+            if max_attempts == 1:
+                error = "Interrupted when its worker stopped; this job type is not retried"
+            else:
+                error = f"Gave up after {max_attempts} attempts"
+            await self._finish(job["id"], "failed", error=error)
+            return
+        self.counts["started"] += 1
+        if job["attempts"] > 1:
+            self.counts["resumed"] += 1
+
+        context = JobContext(job)
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job["id"], asyncio.current_task()))
+        try:
+            result = await self.types[job["type"]].handler(context)
+            await self._finish(job["id"], "succeeded", result=result, result_file=context.result_file,
+                               progress=context.last_progress)
+        except asyncio.CancelledError:
+            if self._stopping and max_attempts > 1:
+                await self._requeue(job["id"])
+            elif self._stopping:
+                await self._finish(job["id"], "failed", error="Interrupted by a worker shutdown; this job type is not retried",
+                                   progress=context.last_progress)
+            else:
+                await self._finish(job["id"], "cancelled", progress=context.last_progress)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job["id"], job["type"])
+            error = e.detail if isinstance(e, HTTPException) else str(e) or e.__class__.__name__
+            await self._finish(job["id"], "failed", error=error, progress=context.last_progress)
+        finally:
+            heartbeat.cancel()
+            if self._wakeup:
+                self._wakeup.set()
+
+    async def poll(self) -> int:
+        """Claim jobs for every free slot; returns how many were started"""
+        started = 0
+        loop = asyncio.get_running_loop()
+        for name, job_type in self.types.items():
+            while not self._stopping and self.running(name) < job_type.concurrency:
+                job = await self._claim(name)
+                if job is None:
+                    break
+                task = loop.create_task(self._execute(job))
+                self._running[job["id"]] = (name, task)
+                task.add_done_callback(lambda _, job_id=job["id"]: self._running.pop(job_id, None))
+                started += 1
+        return started
+
+    async def purge(self) -> int:
+        """Delete finished jobs older than JOB_RETENTION_DAYS together with their files"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=JOB_RETENTION_DAYS)
+        old = await db.jobs.find(
+            {"status": {"$in": JOB_FINISHED_STATUSES}, "finished_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        for job in old:
+            shutil.rmtree(JOB_DIR / job["id"], ignore_errors=True)
+        if old:
+            await db.jobs.delete_many({"id": {"$in": [job["id"] for job in old]}})
+        return len(old)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
             try:
-                end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                date_filter["$lte"] = end_dt
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid end_date format")
-        if date_filter:
-            filter_query["timestamp"] = date_filter
-    
-    # Get all matching logs (limit to 10000 for performance)
-    logs = await db.activity_logs.find(filter_query).sort("timestamp", -1).limit(10000).to_list(10000)
-    
-    # Create CSV content
-    csv_content = "Date,Time,User Name,User Email,Action\n"
-    
-    for log in logs:
-        user = await db.users.find_one({"id": log["user_id"], "is_deleted": False})
-        timestamp = log["timestamp"]
-        date_str = timestamp.strftime("%Y-%m-%d")
-        time_str = timestamp.strftime("%H:%M:%S")
-        user_name = user["name"] if user else "Unknown User"
-        user_email = user["email"] if user else "Unknown Email"
-        action = log["action"].replace('"', '""')  # Escape quotes for CSV
-        
-        csv_content += f'"{date_str}","{time_str}","{user_name}","{user_email}","{action}"\n'
-    
-    return APIResponse(
-        success=True,
-        message="Activity logs exported successfully",
-        data={
-            "filename": f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            "content": csv_content,
-            "total_records": len(logs)
+                await self.poll()
+                if loop.time() >= self._next_purge:
+                    self._next_purge = loop.time() + JOB_PURGE_INTERVAL_SECONDS
+                    await self.purge()
+            except Exception:
+                logger.exception("Job polling failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop claiming jobs and put the ones running in this worker back in the queue"""
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        tasks = [task for _, task in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": {name: self.running(name) for name in self.types},
+            **self.counts
         }
+
+job_runner = JobRunner()
+
+def job_view(job: dict) -> dict:
+    return {field: job.get(field) for field in JOB_PUBLIC_FIELDS}
+
+async def queue_job(job_type: str, current_user: Optional[User], params: Optional[dict] = None,
+                    inputs: Optional[Dict[str, bytes]] = None) -> APIResponse:
+    """Response for endpoints that hand their work to a background job"""
+    job = await job_runner.enqueue(job_type, params, current_user.id if current_user else None, inputs)
+    return APIResponse(success=True, message=f"Job queued; poll /api/jobs/{job['id']} for progress", data=job_view(job))
+
+async def get_visible_job(job_id: str, current_user: User) -> dict:
+    """A job its creator, or anyone with /system view access, may look at"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job or (job.get("created_by") != current_user.id and not await check_permission(current_user, "/system", "view")):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = {}
+
+async def run_activity_export_job(context: JobContext) -> dict:
+    """Write an activity log export (same formats as /logs/export/activity) to the job's result file"""
+    params = context.params
+    export_format = str(params.get("format", "csv")).lower()
+    if export_format not in ("csv", "ndjson"):
+        raise ValueError("Supported formats are csv and ndjson")
+    compress = bool(params.get("gzip"))
+    filter_query = build_activity_log_filter(
+        params.get("user_id"), params.get("action_filter"), params.get("start_date"), params.get("end_date")
     )
 
+    filename = f"activity_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    total = await db.activity_logs.count_documents(filter_query)
+    done = 0
+    async with aiofiles.open(context.output(filename, media_type), "wb") as f:
+        async for chunk in iter_activity_export(filter_query, export_format, compress):
+            await f.write(chunk)
+            done = min(total, done + EXPORT_BATCH_SIZE)
+            await context.progress(done, total)
+    return {"rows": total}
+
+job_runner.register("activity_export", run_activity_export_job, concurrency=2)
+
+@api_router.post("/jobs", response_model=APIResponse)
+async def create_job(job_request: JobCreate, current_user: User = Depends(get_current_user)):
+    """Queue a background job"""
+    job_type = job_runner.types.get(job_request.type)
+    if not job_type or not job_type.api:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_request.type}")
+    if job_type.menu_path and not await check_permission(current_user, job_type.menu_path, job_type.permission):
+        raise HTTPException(
+            status_code=403,
+            detail=f"Insufficient permissions. Required: {job_type.permission} access to {job_type.menu_path}"
+        )
+    return await queue_job(job_request.type, current_user, job_request.params)
+
+@api_router.get("/jobs", response_model=APIResponse)
+async def get_jobs(
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """List the current user's most recent jobs"""
+    filter_query: Dict[str, Any] = {"created_by": current_user.id}
+    if type:
+        filter_query["type"] = type
+    if status:
+        filter_query["status"] = status
+    jobs = await db.jobs.find(filter_query, {"_id": 0}).sort("created_at", -1).limit(max(1, min(limit, 200))).to_list(None)
+    return APIResponse(success=True, message="Jobs retrieved", data=[job_view(job) for job in jobs])
+
+@api_router.get("/jobs/{job_id}", response_model=APIResponse)
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Get a job's status and progress"""
+    job = await get_visible_job(job_id, current_user)
+    return APIResponse(success=True, message="Job retrieved", data=job_view(job))
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=APIResponse)
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel a queued or running job"""
+    await get_visible_job(job_id, current_user)
+    job = await job_runner.cancel(job_id)
+    message = "Cancellation requested" if job["status"] == "running" else f"Job is {job['status']}"
+    return APIResponse(success=True, message=message, data=job_view(job))
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, current_user: User = Depends(get_current_user)):
+    """Download a finished job's result file, or get its result data"""
+    job = await get_visible_job(job_id, current_user)
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    result_file = job.get("result_file")
+    if result_file:
+        path = JOB_DIR / job_id / result_file["filename"]
+        if not path.is_file():
+            raise HTTPException(status_code=410, detail="Result file is no longer available")
+        return FileResponse(path, media_type=result_file["media_type"], filename=result_file["filename"])
+    return APIResponse(success=True, message="Job result retrieved", data=job.get("result"))
+
+@api_router.get("/system/job-stats", response_model=APIResponse)
+@require_permission("/system", "view")
+async def get_job_stats(current_user: User = Depends(get_current_user)):
+    """Get this worker's background job counters"""
+    queued = await db.jobs.count_documents({"status": "queued"})
+    return APIResponse(success=True, message="Job statistics retrieved", data={**job_runner.stats(), "queued": queued})
+
+# Scheduled tasks
+SCHEDULE_POLL_SECONDS = float(os.environ.get('SCHEDULE_POLL_SECONDS', '5'))
+SCHEDULE_LEASE_SECONDS = 60
+
+class ScheduledTask:
+    """Runs func every interval_seconds, in one worker at a time
+
+    The schedules collection holds one document per task with the time of its next run
+    and a lease. Every worker checks it every few seconds. The worker whose atomic
+    update takes the lease on a due run leads that run: it keeps renewing the lease
+    until func returns, then releases it. trigger() makes the task due at once.
+    """
+
+    def __init__(self, name: str, func, interval_seconds: float, lease_seconds: int = SCHEDULE_LEASE_SECONDS,
+                 poll_interval: float = SCHEDULE_POLL_SECONDS):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._created = False
+        self.runs = 0
+        self.failures = 0
+        self.polls = 0
+        self.last_duration_ms: Optional[float] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+
+    async def _ensure(self):
+        """Create the schedule document on first use, due immediately"""
+        if self._created:
+            return
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        try:
+            await db.schedules.update_one(
+                {"id": self.name},
+                {"$setOnInsert": {"next_run_at": datetime.now(timezone.utc), "lease_until": epoch, "holder": None, "runs": 0}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # another worker created it at the same moment
+        self._created = True
+
+    async def _claim(self) -> bool:
+        now = datetime.now(timezone.utc)
+        state = await db.schedules.find_one_and_update(
+            {"id": self.name, "next_run_at": {"$lte": now}, "lease_until": {"$lt": now}},
+            {"$set": {
+                "holder": self.holder, "lease_until": now + timedelta(seconds=self.lease_seconds),
+                "next_run_at": now + timedelta(seconds=self.interval_seconds), "last_started_at": now
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        return state is not None
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await db.schedules.update_one(
+                    {"id": self.name, "holder": self.holder},
+                    {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+                )
+                if not renewed.matched_count:
+                    logger.warning("Lost the lease on scheduled task %s while running it", self.name)
+            except Exception:
+                logger.exception("Could not renew the lease on scheduled task %s", self.name)
+
+    async def run_once(self) -> bool:
+        """Run the task if it is due and no other worker is running it; returns whether it ran"""
+        await self._ensure()
+        self.polls += 1
+        if not await self._claim():
+            return False
+
+        loop = asyncio.get_running_loop()
+        renewal = loop.create_task(self._renew())
+        started = loop.time()
+        result, error = None, None
+        try:
+            result = await self.func()
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            logger.exception("Scheduled task %s failed", self.name)
+        finally:
+            renewal.cancel()
+        duration_ms = round((loop.time() - started) * 1000, 1)
+
+        self.runs += 1
+        self.failures += error is not None
+        self.last_duration_ms, self.last_result, self.last_error = duration_ms, result, error
+        now = datetime.now(timezone.utc)
+        await db.schedules.update_one(
+            {"id": self.name, "holder": self.holder},
+            {"$set": {
+                "holder": None, "lease_until": now, "last_finished_at": now, "last_duration_ms": duration_ms,
+                "last_result": result, "last_error": error
+            }, "$inc": {"runs": 1, "failures": int(error is not None)}}
+        )
+        logger.info("Scheduled task %s ran in %.0fms: %s", self.name, duration_ms, error or result)
+        return True
+
+    async def trigger(self, delay_seconds: float = 0) -> datetime:
+        """Make the task due now, or in delay_seconds unless it is due sooner; returns when it was requested
+
+        A delay lets a burst of triggers share one run.
+        """
+        await self._ensure()
+        now = datetime.now(timezone.utc)
+        await db.schedules.update_one(
+            {"id": self.name},
+            {"$min": {"next_run_at": now + timedelta(seconds=delay_seconds)}, "$set": {"triggered_at": now}}
+        )
+        if self._wakeup and not delay_seconds:
+            self._wakeup.set()
+        return now
+
+    async def wait_for_run(self, since: datetime, timeout: float) -> Optional[dict]:
+        """The schedule document once a run started after since has finished, or None on timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Stored times are naive UTC with millisecond precision
+        since = since.astimezone(timezone.utc).replace(tzinfo=None, microsecond=since.microsecond // 1000 * 1000)
+        while loop.time() < deadline:
+            state = await db.schedules.find_one({"id": self.name}, {"_id": 0})
+            finished_at = state and state.get("last_finished_at")
+            started_at = state and state.get("last_started_at")
+            if finished_at and started_at and started_at.replace(tzinfo=None) >= since and finished_at >= started_at:
+                return state
+            await asyncio.sleep(0.2)
+        return None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Scheduled task %s could not be checked", self.name)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def stats(self) -> Dict[str, Any]:
+        state = await db.schedules.find_one({"id": self.name}, {"_id": 0})
+        return {
+            "interval_seconds": self.interval_seconds,
+            "holder": self.holder,
+            "running": self._task is not None and not self._task.done(),
+            "polls": self.polls,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_duration_ms": self.last_duration_ms,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "schedule": state
+        }
+
+scheduled_tasks: List[ScheduledTask] = []
+
+@api_router.get("/system/scheduler-stats", response_model=APIResponse)
+@require_permission("/system", "view")
+async def get_scheduler_stats(current_user: User = Depends(get_current_user)):
+    """Get run counters of the scheduled tasks, this worker's and shared"""
+    return APIResponse(success=True, message="Scheduler statistics retrieved", data={
+        task.name: await task.stats() for task in scheduled_tasks
+    })
+
 # Initialize database with default data
 # Database initialization endpoint
 @api_router.post("/init-db", response_model=APIResponse)
-async def initialize_database():
+async def initialize_database(background: bool = False):
     """Initialize database with comprehensive default data"""
+    if background:
+        return await queue_job("init_db", None)
     try:
         # Initialize Business Verticals with enhanced default values
         default_verticals = [
@@ -2578,7 +4705,7 @@ async def initialize_database():
                 business_verticals=[]
             )
             admin_data = admin_user.dict()
-            admin_data["password"] = get_password_hash("admin123")
+            admin_data["password"] = await get_password_hash_async("admin123")
             await db.users.insert_one(admin_data)
         
         # Initialize Lead Management master data
@@ -2587,64 +4714,140 @@ async def initialize_database():
         # Initialize Opportunity Management system
         await initialize_opportunity_stages()
         await initialize_qualification_rules()
-        
+
+        # Default roles, menus, mappings and master rows may have changed
+        await cache_bus.publish("permissions")
+        for collection_name in MASTER_COLLECTIONS:
+            await cache_bus.publish(collection_name)
+
         return APIResponse(success=True, message="Database initialized successfully with comprehensive default data including Lead Management System, Opportunity Management System, and 38 Qualification Rules")
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database initialization failed: {str(e)}")
 
+async def run_init_db_job(context: JobContext) -> dict:
+    response = await initialize_database()
+    return {"message": response.message}
+
+job_runner.register("init_db", run_init_db_job, menu_path="/system", permission="edit")
 
 
 # ===== SALES MODULE API ENDPOINTS =====
 
 # 1️⃣ Generic Master Table CRUD Endpoints
-@api_router.get("/master/{table_name}", response_model=APIResponse)
+@api_router.get("/master/bulk", response_model=APIResponse)
 @require_permission("/master", "view")
-async def get_master_data(table_name: str, current_user: User = Depends(get_current_user)):
-    """Generic endpoint to get master table data"""
+async def get_master_data_bulk(
+    request: Request,
+    response: Response,
+    tables: str,
+    versions: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get several master tables in one request
+
+    Each table comes back with an opaque version (the value of its ETag). Pass
+    versions=countries:<version>,states:<version> for tables already held; those that
+    have not changed are returned with changed=False and no records.
+    """
     try:
-        # Map table names to collections
-        table_mapping = {
-            "job-functions": "job_function_master",
-            "partner-types": "partner_type_master", 
-            "company-types": "company_type_master",
-            "head-of-company": "head_of_company_master",
-            "product-service-interests": "product_service_interest",
-            "account-types": "master_account_types",
-            "regions": "master_account_regions",
-            "business-types": "master_business_types",
-            "industry-segments": "master_industry_segments",
-            "sub-industry-segments": "master_sub_industry_segments",
-            "address-types": "master_address_types",
-            "countries": "master_countries",
-            "states": "master_states",
-            "cities": "master_cities",
-            "document-types": "master_document_types",
-            "currencies": "master_currencies",
-            # Lead Management Master Tables
-            "lead-subtypes": "lead_subtype_master",
-            "tender-subtypes": "tender_subtype_master",
-            "submission-types": "submission_type_master",
-            "clauses": "clause_master",  
-            "competitors": "competitor_master",
-            "designations": "designation_master",
-            "billing-types": "billing_master",
-            "lead-sources": "lead_source_master"
-        }
+        table_names = list(dict.fromkeys(name.strip() for name in tables.split(",") if name.strip()))
+        unknown = [name for name in table_names if name not in MASTER_TABLE_COLLECTIONS]
+        if not table_names or unknown:
+            raise HTTPException(status_code=404, detail=f"Master table not found: {', '.join(unknown) or tables}")
+        
+        known_versions = {}
+        for item in (versions or "").split(","):
+            name, separator, version = item.strip().partition(":")
+            if separator:
+                known_versions[name] = version
+        
+        entries = await asyncio.gather(*(
+            master_data_cache.get(MASTER_TABLE_COLLECTIONS[name]) for name in table_names
+        ))
         
-        collection_name = table_mapping.get(table_name)
-        if not collection_name:
-            raise HTTPException(status_code=404, detail="Master table not found")
+        table_versions = [entry["etag"].strip('"') for entry in entries]
+        etag = '"%s"' % hashlib.sha1(
+            "|".join([*table_versions, versions or ""]).encode()
+        ).hexdigest()[:16]
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        data = {}
+        for name, entry, version in zip(table_names, entries, table_versions):
+            if known_versions.get(name) == version:
+                data[name] = {"version": version, "changed": False}
+            else:
+                data[name] = {"version": version, "changed": True, "records": entry["records"]}
         
-        collection = getattr(db, collection_name)
-        records = await collection.find({"is_deleted": False}).to_list(1000)
+        response.headers.update(headers)
+        return APIResponse(success=True, message="Master tables retrieved successfully", data=data)
         
-        # Remove MongoDB _id field to avoid serialization issues
-        for record in records:
-            record.pop("_id", None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/master/{table_name}", response_model=APIResponse)
+@require_permission("/master", "view")
+async def get_master_data(
+    table_name: str,
+    request: Request,
+    response: Response,
+    q: Optional[str] = None,
+    page: Optional[int] = None,
+    limit: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Generic endpoint to get master table data (supports If-None-Match revalidation)
+
+    Passing q (case-insensitive name prefix), page, limit or the table's parent field
+    (country_id for states, state_id for cities, industry_id for sub-industry segments)
+    returns one page of rows ordered by name as {"records", "pagination"}.
+    """
+    try:
+        collection_name = MASTER_TABLE_COLLECTIONS.get(table_name)
+        if not collection_name:
+            raise HTTPException(status_code=404, detail="Master table not found")
         
-        return APIResponse(success=True, message=f"{table_name} retrieved successfully", data=records)
+        parent_field = MASTER_PARENT_FIELDS.get(collection_name)
+        parent_value = request.query_params.get(parent_field) if parent_field else None
+        paged = any(value is not None for value in (q, page, limit, parent_value))
+        
+        entry = await master_data_cache.get(collection_name)
+        etag = entry["etag"]
+        if paged:
+            # One ETag per table version and query
+            etag = '"%s"' % hashlib.sha1(f"{etag}|{request.url.query}".encode()).hexdigest()[:16]
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        response.headers.update(headers)
+        if not paged:
+            return APIResponse(success=True, message=f"{table_name} retrieved successfully", data=entry["records"])
+        
+        page = max(page or 1, 1)
+        limit = min(max(limit or MASTER_PAGE_SIZE, 1), MASTER_PAGE_LIMIT)
+        records, total_count = await master_data_cache.search(
+            collection_name, MASTER_NAME_FIELDS[collection_name], q or "",
+            parent_field, parent_value, skip=(page - 1) * limit, limit=limit
+        )
+        pagination = {
+            "current_page": page,
+            "items_per_page": limit,
+            "total_pages": (total_count + limit - 1) // limit,
+            "total_items": total_count
+        }
+        return APIResponse(
+            success=True,
+            message=f"{table_name} retrieved successfully",
+            data={"records": records, "pagination": pagination}
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2700,9 +4903,10 @@ async def create_master_data(table_name: str, data: dict, current_user: User = D
         data["updated_by"] = current_user.id
         new_record = model_class(**data)
         await collection.insert_one(new_record.dict())
+        await cache_bus.publish(collection_name)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created {table_name}: {data.get(unique_field, 'N/A')}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created {table_name}: {data.get(unique_field, 'N/A')}", entity_type=table_name, entity_id=new_record.dict()[list(new_record.dict().keys())[0]], verb="create"))
         
         return APIResponse(success=True, message=f"{table_name} created successfully", data={"id": new_record.dict()[list(new_record.dict().keys())[0]]})
         
@@ -2767,9 +4971,10 @@ async def update_master_data(table_name: str, record_id: str, data: dict, curren
         data["updated_at"] = datetime.now(timezone.utc)
         
         await collection.update_one({id_field: record_id}, {"$set": data})
+        await cache_bus.publish(collection_name)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated {table_name}: {data.get(unique_field, record_id)}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated {table_name}: {data.get(unique_field, record_id)}", entity_type=table_name, entity_id=record_id, verb="update"))
         
         return APIResponse(success=True, message=f"{table_name} updated successfully")
         
@@ -2828,9 +5033,10 @@ async def delete_master_data(table_name: str, record_id: str, current_user: User
             {id_field: record_id},
             {"$set": {"is_deleted": True, "updated_by": current_user.id, "updated_at": datetime.now(timezone.utc)}}
         )
+        await cache_bus.publish(collection_name)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted {table_name}: {record_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted {table_name}: {record_id}", entity_type=table_name, entity_id=record_id, verb="delete"))
         
         return APIResponse(success=True, message=f"{table_name} deleted successfully")
         
@@ -2840,6 +5046,13 @@ async def delete_master_data(table_name: str, record_id: str, current_user: User
         raise HTTPException(status_code=500, detail=str(e))
 
 # 2️⃣ Partners CRUD Endpoints
+PARTNER_REFS = [
+    ForeignKey("job_function_id", "job_function_master", key="job_function_id", display="job_function_name", empty="Unknown"),
+    ForeignKey("company_type_id", "company_type_master", key="company_type_id", display="company_type_name"),
+    ForeignKey("partner_type_id", "partner_type_master", key="partner_type_id", display="partner_type_name"),
+    ForeignKey("head_of_company_id", "head_of_company_master", key="head_of_company_id", display="head_role_name")
+]
+
 @api_router.get("/partners", response_model=APIResponse)
 @require_permission("/partners", "view")
 async def get_partners(current_user: User = Depends(get_current_user)):
@@ -2850,34 +5063,9 @@ async def get_partners(current_user: User = Depends(get_current_user)):
         # Enrich with master data names
         enriched_partners = []
         for partner in partners:
-            partner_data = Partner(**partner).dict()
-            
-            # Enrich job function
-            job_function = await db.job_function_master.find_one({"job_function_id": partner["job_function_id"], "is_deleted": False})
-            partner_data["job_function_name"] = job_function["job_function_name"] if job_function else "Unknown"
-            
-            # Enrich company type
-            if partner.get("company_type_id"):
-                company_type = await db.company_type_master.find_one({"company_type_id": partner["company_type_id"], "is_deleted": False})
-                partner_data["company_type_name"] = company_type["company_type_name"] if company_type else "Unknown"
-            else:
-                partner_data["company_type_name"] = None
-            
-            # Enrich partner type
-            if partner.get("partner_type_id"):
-                partner_type = await db.partner_type_master.find_one({"partner_type_id": partner["partner_type_id"], "is_deleted": False})
-                partner_data["partner_type_name"] = partner_type["partner_type_name"] if partner_type else "Unknown"
-            else:
-                partner_data["partner_type_name"] = None
-            
-            # Enrich head of company
-            if partner.get("head_of_company_id"):
-                head_of_company = await db.head_of_company_master.find_one({"head_of_company_id": partner["head_of_company_id"], "is_deleted": False})
-                partner_data["head_of_company_name"] = head_of_company["head_role_name"] if head_of_company else "Unknown"
-            else:
-                partner_data["head_of_company_name"] = None
-            
-            enriched_partners.append(partner_data)
+            enriched_partners.append(Partner(**partner).dict())
+        
+        await resolve_foreign_keys(enriched_partners, PARTNER_REFS)
         
         return APIResponse(success=True, message="Partners retrieved successfully", data=enriched_partners)
         
@@ -2895,31 +5083,7 @@ async def get_partner(partner_id: str, current_user: User = Depends(get_current_
         
         # Enrich with master data names
         partner_data = Partner(**partner).dict()
-        
-        # Enrich job function
-        job_function = await db.job_function_master.find_one({"job_function_id": partner["job_function_id"], "is_deleted": False})
-        partner_data["job_function_name"] = job_function["job_function_name"] if job_function else "Unknown"
-        
-        # Enrich company type
-        if partner.get("company_type_id"):
-            company_type = await db.company_type_master.find_one({"company_type_id": partner["company_type_id"], "is_deleted": False})
-            partner_data["company_type_name"] = company_type["company_type_name"] if company_type else "Unknown"
-        else:
-            partner_data["company_type_name"] = None
-        
-        # Enrich partner type
-        if partner.get("partner_type_id"):
-            partner_type = await db.partner_type_master.find_one({"partner_type_id": partner["partner_type_id"], "is_deleted": False})
-            partner_data["partner_type_name"] = partner_type["partner_type_name"] if partner_type else "Unknown"
-        else:
-            partner_data["partner_type_name"] = None
-        
-        # Enrich head of company
-        if partner.get("head_of_company_id"):
-            head_of_company = await db.head_of_company_master.find_one({"head_of_company_id": partner["head_of_company_id"], "is_deleted": False})
-            partner_data["head_of_company_name"] = head_of_company["head_role_name"] if head_of_company else "Unknown"
-        else:
-            partner_data["head_of_company_name"] = None
+        await resolve_foreign_keys([partner_data], PARTNER_REFS)
         
         return APIResponse(success=True, message="Partner retrieved successfully", data=partner_data)
         
@@ -2995,7 +5159,7 @@ async def create_partner(partner_data: dict, current_user: User = Depends(get_cu
         await db.partners.insert_one(new_partner.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created partner: {partner_data['first_name']} {partner_data.get('last_name', '')} - {partner_data['company_name']}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created partner: {partner_data['first_name']} {partner_data.get('last_name', '')} - {partner_data['company_name']}", entity_type="partner", entity_id=new_partner.partner_id, verb="create"))
         
         return APIResponse(success=True, message="Partner created successfully", data={"partner_id": new_partner.partner_id})
         
@@ -3076,7 +5240,7 @@ async def update_partner(partner_id: str, partner_data: dict, current_user: User
         await db.partners.update_one({"partner_id": partner_id}, {"$set": partner_data})
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated partner: {partner_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated partner: {partner_id}", entity_type="partner", entity_id=partner_id, verb="update"))
         
         return APIResponse(success=True, message="Partner updated successfully")
         
@@ -3102,7 +5266,7 @@ async def delete_partner(partner_id: str, current_user: User = Depends(get_curre
         )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted partner: {partner_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted partner: {partner_id}", entity_type="partner", entity_id=partner_id, verb="delete"))
         
         return APIResponse(success=True, message="Partner deleted successfully")
         
@@ -3112,6 +5276,41 @@ async def delete_partner(partner_id: str, current_user: User = Depends(get_curre
         raise HTTPException(status_code=500, detail=str(e))
 
 # 3️⃣ Companies CRUD Endpoints
+COMPANY_REFS = [
+    ForeignKey("company_type_id", "company_type_master", key="company_type_id", display="company_type_name", empty="Unknown"),
+    ForeignKey("partner_type_id", "partner_type_master", key="partner_type_id", display="partner_type_name", empty="Unknown"),
+    ForeignKey("head_of_company_id", "head_of_company_master", key="head_of_company_id", display="head_role_name", empty="Unknown")
+]
+
+COMPANY_CHILD_COUNTS = [
+    ("addresses_count", "company_addresses"),
+    ("documents_count", "company_documents"),
+    ("financials_count", "company_financials"),
+    ("contacts_count", "contacts")
+]
+
+ADDRESS_REFS = [
+    ForeignKey("country_id", "master_countries", key="country_id", display="country_name", empty="Unknown"),
+    ForeignKey("state_id", "master_states", key="state_id", display="state_name", empty="Unknown"),
+    ForeignKey("city_id", "master_cities", key="city_id", display="city_name", empty="Unknown"),
+    ForeignKey("address_type_id", "master_address_types", key="address_type_id", display="address_type_name", empty="Unknown")
+]
+
+DOCUMENT_REFS = [
+    ForeignKey("document_type_id", "master_document_types", key="document_type_id", display="document_type_name", empty="Unknown")
+]
+
+FINANCIAL_REFS = [
+    ForeignKey("currency_id", "master_currencies", key="currency_id",
+               display={"currency_name": "currency_name", "currency_symbol": "symbol", "currency_code": "currency_code"},
+               missing={"currency_name": "Unknown", "currency_symbol": "", "currency_code": ""},
+               empty={"currency_name": "Unknown", "currency_symbol": "", "currency_code": ""})
+]
+
+CONTACT_REFS = [
+    ForeignKey("designation_id", "job_function_master", key="job_function_id", display="job_function_name", target="designation_name")
+]
+
 @api_router.get("/companies", response_model=APIResponse)
 @require_permission("/companies", "view")
 async def get_companies(current_user: User = Depends(get_current_user)):
@@ -3122,27 +5321,18 @@ async def get_companies(current_user: User = Depends(get_current_user)):
         # Enrich with master data names
         enriched_companies = []
         for company in companies:
-            company_data = Company(**company).dict()
-            
-            # Get company type name
-            company_type = await db.company_type_master.find_one({"company_type_id": company["company_type_id"], "is_deleted": False})
-            company_data["company_type_name"] = company_type["company_type_name"] if company_type else "Unknown"
-            
-            # Get partner type name
-            partner_type = await db.partner_type_master.find_one({"partner_type_id": company["partner_type_id"], "is_deleted": False})
-            company_data["partner_type_name"] = partner_type["partner_type_name"] if partner_type else "Unknown"
-            
-            # Get head of company name
-            head_of_company = await db.head_of_company_master.find_one({"head_of_company_id": company["head_of_company_id"], "is_deleted": False})
-            company_data["head_of_company_name"] = head_of_company["head_role_name"] if head_of_company else "Unknown"
-            
-            # Get counts of nested entities
-            company_data["addresses_count"] = await db.company_addresses.count_documents({"company_id": company["company_id"], "is_deleted": False})
-            company_data["documents_count"] = await db.company_documents.count_documents({"company_id": company["company_id"], "is_deleted": False})
-            company_data["financials_count"] = await db.company_financials.count_documents({"company_id": company["company_id"], "is_deleted": False})
-            company_data["contacts_count"] = await db.contacts.count_documents({"company_id": company["company_id"], "is_deleted": False})
-            
-            enriched_companies.append(company_data)
+            enriched_companies.append(Company(**company).dict())
+        
+        await resolve_foreign_keys(enriched_companies, COMPANY_REFS)
+        
+        # Get counts of nested entities
+        company_ids = [company["company_id"] for company in enriched_companies]
+        counts = await asyncio.gather(*(
+            count_by(collection, "company_id", company_ids) for _, collection in COMPANY_CHILD_COUNTS
+        ))
+        for company_data in enriched_companies:
+            for (count_field, _), counts_by_company in zip(COMPANY_CHILD_COUNTS, counts):
+                company_data[count_field] = counts_by_company.get(company_data["company_id"], 0)
         
         return APIResponse(success=True, message="Companies retrieved successfully", data=enriched_companies)
         
@@ -3192,7 +5382,7 @@ async def create_company(company_data: dict, current_user: User = Depends(get_cu
         await db.companies.insert_one(new_company.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created company: {company_data['company_name']}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created company: {company_data['company_name']}", entity_type="company", entity_id=new_company.company_id, verb="create"))
         
         return APIResponse(success=True, message="Company created successfully", data={"company_id": new_company.company_id})
         
@@ -3213,62 +5403,26 @@ async def get_company(company_id: str, current_user: User = Depends(get_current_
         # Enrich with master data names
         company_data = Company(**company).dict()
         
-        # Get company type name
-        company_type = await db.company_type_master.find_one({"company_type_id": company["company_type_id"], "is_deleted": False})
-        company_data["company_type_name"] = company_type["company_type_name"] if company_type else "Unknown"
-        
-        # Get partner type name
-        partner_type = await db.partner_type_master.find_one({"partner_type_id": company["partner_type_id"], "is_deleted": False})
-        company_data["partner_type_name"] = partner_type["partner_type_name"] if partner_type else "Unknown"
-        
-        # Get head of company name
-        head_of_company = await db.head_of_company_master.find_one({"head_of_company_id": company["head_of_company_id"], "is_deleted": False})
-        company_data["head_of_company_name"] = head_of_company["head_role_name"] if head_of_company else "Unknown"
-        
-        # Get related data with enrichment
-        addresses = await db.company_addresses.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_addresses = []
-        for addr in addresses:
-            addr_data = CompanyAddress(**addr).dict()
-            # Enrich with location names
-            country = await db.master_countries.find_one({"country_id": addr["country_id"], "is_deleted": False})
-            state = await db.master_states.find_one({"state_id": addr["state_id"], "is_deleted": False})
-            city = await db.master_cities.find_one({"city_id": addr["city_id"], "is_deleted": False})
-            addr_type = await db.master_address_types.find_one({"address_type_id": addr["address_type_id"], "is_deleted": False})
-            
-            addr_data["country_name"] = country["country_name"] if country else "Unknown"
-            addr_data["state_name"] = state["state_name"] if state else "Unknown"
-            addr_data["city_name"] = city["city_name"] if city else "Unknown"
-            addr_data["address_type_name"] = addr_type["address_type_name"] if addr_type else "Unknown"
-            enriched_addresses.append(addr_data)
-        
-        documents = await db.company_documents.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_documents = []
-        for doc in documents:
-            doc_data = CompanyDocument(**doc).dict()
-            doc_type = await db.master_document_types.find_one({"document_type_id": doc["document_type_id"], "is_deleted": False})
-            doc_data["document_type_name"] = doc_type["document_type_name"] if doc_type else "Unknown"
-            enriched_documents.append(doc_data)
-        
-        financials = await db.company_financials.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_financials = []
-        for fin in financials:
-            fin_data = CompanyFinancial(**fin).dict()
-            currency = await db.master_currencies.find_one({"currency_id": fin["currency_id"], "is_deleted": False})
-            fin_data["currency_name"] = currency["currency_name"] if currency else "Unknown"
-            fin_data["currency_symbol"] = currency["symbol"] if currency else ""
-            enriched_financials.append(fin_data)
-        
-        contacts = await db.contacts.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_contacts = []
-        for contact in contacts:
-            contact_data = Contact(**contact).dict()
-            if contact.get("designation_id"):
-                designation = await db.job_function_master.find_one({"job_function_id": contact["designation_id"], "is_deleted": False})
-                contact_data["designation_name"] = designation["job_function_name"] if designation else "Unknown"
-            else:
-                contact_data["designation_name"] = None
-            enriched_contacts.append(contact_data)
+        # Get related data
+        addresses, documents, financials, contacts = await asyncio.gather(
+            db.company_addresses.find({"company_id": company_id, "is_deleted": False}).to_list(100),
+            db.company_documents.find({"company_id": company_id, "is_deleted": False}).to_list(100),
+            db.company_financials.find({"company_id": company_id, "is_deleted": False}).to_list(100),
+            db.contacts.find({"company_id": company_id, "is_deleted": False}).to_list(100)
+        )
+        enriched_addresses = [CompanyAddress(**addr).dict() for addr in addresses]
+        enriched_documents = [CompanyDocument(**doc).dict() for doc in documents]
+        enriched_financials = [CompanyFinancial(**fin).dict() for fin in financials]
+        enriched_contacts = [Contact(**contact).dict() for contact in contacts]
+        
+        # Resolve every master-data name with one query per master table
+        await asyncio.gather(
+            resolve_foreign_keys([company_data], COMPANY_REFS),
+            resolve_foreign_keys(enriched_addresses, ADDRESS_REFS),
+            resolve_foreign_keys(enriched_documents, DOCUMENT_REFS),
+            resolve_foreign_keys(enriched_financials, FINANCIAL_REFS),
+            resolve_foreign_keys(enriched_contacts, CONTACT_REFS)
+        )
         
         company_data["addresses"] = enriched_addresses
         company_data["documents"] = enriched_documents
@@ -3322,9 +5476,11 @@ async def update_company(company_id: str, company_data: dict, current_user: User
         company_data["updated_at"] = datetime.now(timezone.utc)
         
         await db.companies.update_one({"company_id": company_id}, {"$set": company_data})
+        if "company_name" in company_data:
+            await cache_bus.publish("companies", company_id)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated company: {company_id}", entity_type="company", entity_id=company_id, verb="update"))
         
         return APIResponse(success=True, message="Company updated successfully")
         
@@ -3365,7 +5521,7 @@ async def delete_company(company_id: str, current_user: User = Depends(get_curre
             )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted company and related data: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted company and related data: {company_id}", entity_type="company", entity_id=company_id, verb="delete"))
         
         return APIResponse(success=True, message="Company and related data deleted successfully")
         
@@ -3386,21 +5542,10 @@ async def get_company_addresses(company_id: str, current_user: User = Depends(ge
             raise HTTPException(status_code=404, detail="Company not found")
         
         addresses = await db.company_addresses.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_addresses = []
-        
-        for addr in addresses:
-            addr_data = CompanyAddress(**addr).dict()
-            # Enrich with location names
-            country = await db.master_countries.find_one({"country_id": addr["country_id"], "is_deleted": False})
-            state = await db.master_states.find_one({"state_id": addr["state_id"], "is_deleted": False})
-            city = await db.master_cities.find_one({"city_id": addr["city_id"], "is_deleted": False})
-            addr_type = await db.master_address_types.find_one({"address_type_id": addr["address_type_id"], "is_deleted": False})
-            
-            addr_data["country_name"] = country["country_name"] if country else "Unknown"
-            addr_data["state_name"] = state["state_name"] if state else "Unknown"
-            addr_data["city_name"] = city["city_name"] if city else "Unknown"
-            addr_data["address_type_name"] = addr_type["address_type_name"] if addr_type else "Unknown"
-            enriched_addresses.append(addr_data)
+        enriched_addresses = [CompanyAddress(**addr).dict() for addr in addresses]
+        
+        # Enrich with location names
+        await resolve_foreign_keys(enriched_addresses, ADDRESS_REFS)
         
         return APIResponse(success=True, message="Company addresses retrieved successfully", data=enriched_addresses)
         
@@ -3446,7 +5591,7 @@ async def create_company_address(company_id: str, address_data: dict, current_us
         await db.company_addresses.insert_one(new_address.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created address for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created address for company: {company_id}", entity_type="company", entity_id=company_id, verb="create"))
         
         return APIResponse(success=True, message="Company address created successfully", data={"address_id": new_address.address_id})
         
@@ -3486,7 +5631,7 @@ async def update_company_address(company_id: str, address_id: str, address_data:
         await db.company_addresses.update_one({"address_id": address_id}, {"$set": address_data})
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated address for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated address for company: {company_id}", entity_type="company", entity_id=company_id, verb="update"))
         
         return APIResponse(success=True, message="Company address updated successfully")
         
@@ -3512,7 +5657,7 @@ async def delete_company_address(company_id: str, address_id: str, current_user:
         )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted address for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted address for company: {company_id}", entity_type="company", entity_id=company_id, verb="delete"))
         
         return APIResponse(success=True, message="Company address deleted successfully")
         
@@ -3533,13 +5678,8 @@ async def get_company_documents(company_id: str, current_user: User = Depends(ge
             raise HTTPException(status_code=404, detail="Company not found")
         
         documents = await db.company_documents.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_documents = []
-        
-        for doc in documents:
-            doc_data = CompanyDocument(**doc).dict()
-            doc_type = await db.master_document_types.find_one({"document_type_id": doc["document_type_id"], "is_deleted": False})
-            doc_data["document_type_name"] = doc_type["document_type_name"] if doc_type else "Unknown"
-            enriched_documents.append(doc_data)
+        enriched_documents = [CompanyDocument(**doc).dict() for doc in documents]
+        await resolve_foreign_keys(enriched_documents, DOCUMENT_REFS)
         
         return APIResponse(success=True, message="Company documents retrieved successfully", data=enriched_documents)
         
@@ -3577,7 +5717,7 @@ async def create_company_document(company_id: str, document_data: dict, current_
         await db.company_documents.insert_one(new_document.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added document for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added document for company: {company_id}", entity_type="company", entity_id=company_id, verb="add"))
         
         return APIResponse(success=True, message="Company document created successfully", data={"document_id": new_document.document_id})
         
@@ -3609,7 +5749,7 @@ async def update_company_document(company_id: str, document_id: str, document_da
         await db.company_documents.update_one({"document_id": document_id}, {"$set": document_data})
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated document for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated document for company: {company_id}", entity_type="company", entity_id=company_id, verb="update"))
         
         return APIResponse(success=True, message="Company document updated successfully")
         
@@ -3635,7 +5775,7 @@ async def delete_company_document(company_id: str, document_id: str, current_use
         )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted document for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted document for company: {company_id}", entity_type="company", entity_id=company_id, verb="delete"))
         
         return APIResponse(success=True, message="Company document deleted successfully")
         
@@ -3656,15 +5796,8 @@ async def get_company_financials(company_id: str, current_user: User = Depends(g
             raise HTTPException(status_code=404, detail="Company not found")
         
         financials = await db.company_financials.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_financials = []
-        
-        for fin in financials:
-            fin_data = CompanyFinancial(**fin).dict()
-            currency = await db.master_currencies.find_one({"currency_id": fin["currency_id"], "is_deleted": False})
-            fin_data["currency_name"] = currency["currency_name"] if currency else "Unknown"
-            fin_data["currency_symbol"] = currency["symbol"] if currency else ""
-            fin_data["currency_code"] = currency["currency_code"] if currency else ""
-            enriched_financials.append(fin_data)
+        enriched_financials = [CompanyFinancial(**fin).dict() for fin in financials]
+        await resolve_foreign_keys(enriched_financials, FINANCIAL_REFS)
         
         return APIResponse(success=True, message="Company financials retrieved successfully", data=enriched_financials)
         
@@ -3726,7 +5859,7 @@ async def create_company_financial(company_id: str, financial_data: dict, curren
         await db.company_financials.insert_one(new_financial.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added financial record for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added financial record for company: {company_id}", entity_type="company", entity_id=company_id, verb="add"))
         
         return APIResponse(success=True, message="Company financial record created successfully", data={"financial_id": new_financial.financial_id})
         
@@ -3785,7 +5918,7 @@ async def update_company_financial(company_id: str, financial_id: str, financial
         await db.company_financials.update_one({"financial_id": financial_id}, {"$set": financial_data})
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated financial record for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated financial record for company: {company_id}", entity_type="company", entity_id=company_id, verb="update"))
         
         return APIResponse(success=True, message="Company financial record updated successfully")
         
@@ -3811,7 +5944,7 @@ async def delete_company_financial(company_id: str, financial_id: str, current_u
         )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted financial record for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted financial record for company: {company_id}", entity_type="company", entity_id=company_id, verb="delete"))
         
         return APIResponse(success=True, message="Company financial record deleted successfully")
         
@@ -3832,16 +5965,8 @@ async def get_company_contacts(company_id: str, current_user: User = Depends(get
             raise HTTPException(status_code=404, detail="Company not found")
         
         contacts = await db.contacts.find({"company_id": company_id, "is_deleted": False}).to_list(100)
-        enriched_contacts = []
-        
-        for contact in contacts:
-            contact_data = Contact(**contact).dict()
-            if contact.get("designation_id"):
-                designation = await db.job_function_master.find_one({"job_function_id": contact["designation_id"], "is_deleted": False})
-                contact_data["designation_name"] = designation["job_function_name"] if designation else "Unknown"
-            else:
-                contact_data["designation_name"] = None
-            enriched_contacts.append(contact_data)
+        enriched_contacts = [Contact(**contact).dict() for contact in contacts]
+        await resolve_foreign_keys(enriched_contacts, CONTACT_REFS)
         
         return APIResponse(success=True, message="Company contacts retrieved successfully", data=enriched_contacts)
         
@@ -3903,7 +6028,7 @@ async def create_company_contact(company_id: str, contact_data: dict, current_us
         await db.contacts.insert_one(new_contact.dict())
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added contact for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Added contact for company: {company_id}", entity_type="company", entity_id=company_id, verb="add"))
         
         return APIResponse(success=True, message="Company contact created successfully", data={"contact_id": new_contact.contact_id})
         
@@ -3954,7 +6079,7 @@ async def update_company_contact(company_id: str, contact_id: str, contact_data:
         await db.contacts.update_one({"contact_id": contact_id}, {"$set": contact_data})
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated contact for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated contact for company: {company_id}", entity_type="company", entity_id=company_id, verb="update"))
         
         return APIResponse(success=True, message="Company contact updated successfully")
         
@@ -3980,7 +6105,7 @@ async def delete_company_contact(company_id: str, contact_id: str, current_user:
         )
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted contact for company: {company_id}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted contact for company: {company_id}", entity_type="company", entity_id=company_id, verb="delete"))
         
         return APIResponse(success=True, message="Company contact deleted successfully")
         
@@ -4098,6 +6223,7 @@ class OpportunityKPI(BaseModel):
     measurement_period: str  # daily, weekly, monthly, quarterly, yearly
     target_value: float
     actual_value: float
+    unit: Optional[str] = None  # %, INR, days
     variance: float = 0.0  # actual - target
     variance_percentage: float = 0.0  # (actual - target) / target * 100
     
@@ -4129,6 +6255,17 @@ class OpportunityKPI(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# One stored set of KPIs per period, period start and owner (opportunity_kpis collection)
+class OpportunityKPISnapshot(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    measurement_period: str  # daily, weekly, monthly, quarterly, yearly
+    period_start: datetime
+    period_end: datetime  # when the snapshot was taken, while the period is still running
+    owner_id: Optional[str] = None  # None for the whole team
+    metrics: Dict[str, Any]  # the analytics the KPIs were derived from
+    kpis: List[OpportunityKPI]
+    calculated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 # Compliance Monitoring
 class OpportunityCompliance(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -4890,6 +7027,7 @@ class Lead(BaseModel):
     # Additional Fields
     decision_maker_percentage: Optional[int] = None  # 1-100
     notes: Optional[str] = None
+    auto_converted_at: Optional[datetime] = None  # Set by the auto-conversion run
     
     # Audit Fields
     is_active: bool = True
@@ -5038,47 +7176,406 @@ class LeadDocument(BaseModel):
 
 # ===== LEAD CRUD API ENDPOINTS =====
 
+# Sequential ID allocation
+ID_SEQUENCES = {
+    # counter: (collection, field, code prefix; None for plain numbers)
+    "lead_id": ("leads", "lead_id", "LEAD-"),
+    "opportunity_id": ("opportunities", "opportunity_id", "OPP-"),
+    "sr_no": ("opportunities", "sr_no", None)
+}
+ID_CODE_DIGITS = 7
+
+class IdAllocator:
+    """Hands out numbers from per-sequence counters in the counters collection
+
+    Each counter document holds the last number issued. An atomic $inc means
+    concurrent requests and workers never receive the same number, and take(name, n)
+    reserves a block of n numbers in a single round trip. Numbers of a block that end
+    up unused are simply skipped.
+    """
+
+    def __init__(self):
+        self._seeded = set()
+        self.round_trips = 0
+        self.issued: Dict[str, int] = {}
+
+    async def _seed(self, name: str):
+        """Start a new counter above anything already stored, once per process"""
+        if name in self._seeded:
+            return
+        collection, field, prefix = ID_SEQUENCES[name]
+        if prefix:
+            # Older records used random codes; only ones in the sequential format count
+            query = {field: {"$regex": f"^{re.escape(prefix)}\\d{{{ID_CODE_DIGITS}}}$"}}
+        else:
+            query = {field: {"$type": "number"}}
+        latest = await db[collection].find(query, {"_id": 0, field: 1}).sort(field, -1).limit(1).to_list(1)
+        floor = 0
+        if latest:
+            floor = int(latest[0][field][len(prefix):]) if prefix else int(latest[0][field])
+        try:
+            await db.counters.update_one({"id": name}, {"$max": {"value": floor}}, upsert=True)
+        except DuplicateKeyError:
+            # Another worker created the counter at the same moment; $max again on the existing one
+            await db.counters.update_one({"id": name}, {"$max": {"value": floor}})
+        self._seeded.add(name)
+
+    async def take(self, name: str, count: int = 1) -> List[int]:
+        """Reserve count consecutive numbers of a sequence"""
+        if count < 1:
+            return []
+        await self._seed(name)
+        doc = await db.counters.find_one_and_update(
+            {"id": name},
+            {"$inc": {"value": count}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            return_document=ReturnDocument.AFTER
+        )
+        self.round_trips += 1
+        self.issued[name] = self.issued.get(name, 0) + count
+        last = doc["value"]
+        return list(range(last - count + 1, last + 1))
+
+    async def codes(self, name: str, count: int = 1) -> List[str]:
+        """Reserve count formatted codes (LEAD-0000042) of a sequence"""
+        prefix = ID_SEQUENCES[name][2]
+        return [f"{prefix}{number:0{ID_CODE_DIGITS}d}" for number in await self.take(name, count)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"round_trips": self.round_trips, "issued": dict(self.issued)}
+
+id_allocator = IdAllocator()
+
 # Helper function to generate Lead ID
 async def generate_lead_id():
-    """Generate unique LEAD-XXXXXXX format ID"""
-    while True:
-        # Generate random 6-character alphanumeric string
-        import random
-        import string
-        random_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        lead_id = f"LEAD-{random_id}"
-        
-        # Check if this ID already exists
-        existing = await db.leads.find_one({"lead_id": lead_id, "is_deleted": False})
-        if not existing:
-            return lead_id
+    """Allocate the next LEAD-XXXXXXX code"""
+    return (await id_allocator.codes("lead_id"))[0]
+
+# Master data names shown on leads and opportunities; like the $lookups they replace,
+# these also resolve rows that have since been soft-deleted
+REVENUE_CURRENCY_REF = ForeignKey(
+    "revenue_currency_id", "master_currencies", key="currency_id",
+    display={"currency_code": "currency_code", "currency_symbol": "symbol"}, live_only=False, missing=None
+)
+
+# Stage names come from the in-process stage catalog rather than a $lookup per row
+CURRENT_STAGE_REF = ForeignKey("current_stage_id", "opportunity_stages",
+                               display={"current_stage_name": "stage_name", "current_stage_code": "stage_code"},
+                               live_only=False, missing=None)
+SL_STAGE_REF = ForeignKey("stage_id", "opportunity_stages", display={"stage_name": "stage_name", "stage_code": "stage_code"},
+                          live_only=False, missing=None)
+
+LEAD_REFS = [
+    ForeignKey("lead_subtype_id", "lead_subtype_master", display="lead_subtype_name", live_only=False, missing=None),
+    ForeignKey("lead_source_id", "lead_source_master", display="lead_source_name", live_only=False, missing=None),
+    REVENUE_CURRENCY_REF
+]
+
+LEAD_TENDER_REFS = [
+    ForeignKey("tender_subtype_id", "tender_subtype_master", display="tender_subtype_name", live_only=False, missing=None),
+    ForeignKey("submission_type_id", "submission_type_master", display="submission_type_name", live_only=False, missing=None),
+    ForeignKey("tender_currency_id", "master_currencies", key="currency_id",
+               display={"currency_code": "currency_code", "currency_symbol": "symbol"}, live_only=False, missing=None)
+]
+
+DOCUMENT_TYPE_REF = ForeignKey(
+    "document_type_id", "master_document_types", key="document_type_id",
+    display="document_type_name", live_only=False, missing=None
+)
+
+# Company and assigned user names shown in lead listings
+LEAD_COMPANY_REF = ForeignKey("company_id", "companies", key="company_id", display="company_name", live_only=False, missing=None)
+LEAD_LIST_REFS = [
+    LEAD_COMPANY_REF,
+    ForeignKey("assigned_to_user_id", "users", display={"assigned_user_name": "name"}, live_only=False, missing=None),
+    *LEAD_REFS
+]
+
+# Lead listing
+LEAD_SORT_FIELDS = {"created_at", "updated_at", "expected_revenue", "convert_to_opportunity_date", "project_title", "lead_id"}
+LEAD_PAGE_LIMIT = 200
+
+def build_lead_filter(
+    status: Optional[str] = None,
+    subtype_id: Optional[str] = None,
+    source_id: Optional[str] = None,
+    company_id: Optional[str] = None,
+    assigned_to: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_revenue: Optional[float] = None,
+    max_revenue: Optional[float] = None
+) -> dict:
+    """Mongo filter on the leads' own fields, shared by the listing and search endpoints"""
+    filter_query = {"is_deleted": False}
+    
+    if status:
+        filter_query["approval_status"] = status
+    if subtype_id:
+        filter_query["lead_subtype_id"] = subtype_id
+    if source_id:
+        filter_query["lead_source_id"] = source_id
+    if company_id:
+        filter_query["company_id"] = company_id
+    if assigned_to:
+        filter_query["assigned_to_user_id"] = assigned_to
+    
+    if date_from or date_to:
+        date_filter = {}
+        try:
+            if date_from:
+                date_filter["$gte"] = datetime.fromisoformat(date_from)
+            if date_to:
+                date_filter["$lte"] = datetime.fromisoformat(date_to)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="date_from and date_to must be ISO dates")
+        filter_query["created_at"] = date_filter
+    
+    if min_revenue is not None or max_revenue is not None:
+        revenue_filter = {}
+        if min_revenue is not None:
+            revenue_filter["$gte"] = min_revenue
+        if max_revenue is not None:
+            revenue_filter["$lte"] = max_revenue
+        filter_query["expected_revenue"] = revenue_filter
+    
+    return filter_query
+
+def encode_sort_cursor(sort: str, value: Any, doc_id: str) -> str:
+    """Opaque continuation token for (sort field, id) keyset pagination"""
+    is_date = isinstance(value, datetime)
+    raw = json.dumps({"s": sort, "v": value.isoformat() if is_date else value, "d": is_date, "id": doc_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_sort_cursor(token: str, sort: str):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        value = datetime.fromisoformat(raw["v"]) if raw["d"] else raw["v"]
+        if raw["s"] != sort:
+            raise ValueError("cursor was issued for another sort")
+        return value, raw["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # Lead CRUD Endpoints
 @api_router.get("/leads", response_model=APIResponse)
 @require_permission("/leads", "view")
-async def get_leads(current_user: User = Depends(get_current_user)):
-    """Get all leads with enriched data"""
+async def get_leads(
+    page: int = 1,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "desc",
+    status: Optional[str] = None,
+    subtype_id: Optional[str] = None,
+    source_id: Optional[str] = None,
+    company_id: Optional[str] = None,
+    assigned_to: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_revenue: Optional[float] = None,
+    max_revenue: Optional[float] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get leads one page at a time (page number or continuation cursor) with enriched data
+
+    Leads are filtered, sorted and limited on their own indexed fields first; company,
+    user and master names are then resolved for the page only.
+    """
+    try:
+        if sort not in LEAD_SORT_FIELDS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(sorted(LEAD_SORT_FIELDS))}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="order must be asc or desc")
+        page = max(page, 1)
+        limit = min(max(limit, 1), LEAD_PAGE_LIMIT)
+        direction = 1 if order == "asc" else -1
+        
+        filter_query = build_lead_filter(
+            status, subtype_id, source_id, company_id, assigned_to, date_from, date_to, min_revenue, max_revenue
+        )
+        query = filter_query
+        if cursor:
+            value, lead_id = decode_sort_cursor(cursor, sort)
+            beyond = "$gt" if direction == 1 else "$lt"
+            query = {"$and": [filter_query, {"$or": [
+                {sort: {beyond: value}},
+                {sort: value, "id": {beyond: lead_id}}
+            ]}]}
+        
+        # Ties on the sort field are broken by id so every lead has a stable position
+        find = db.leads.find(query, {"_id": 0}).sort([(sort, direction), ("id", direction)])
+        if not cursor:
+            find = find.skip((page - 1) * limit)
+        leads = await find.limit(limit + 1).to_list(limit + 1)
+        
+        # The extra row only tells us whether another page exists
+        has_more = len(leads) > limit
+        leads = leads[:limit]
+        pagination = {
+            "current_page": None if cursor else page,
+            "items_per_page": limit,
+            "next_cursor": encode_sort_cursor(sort, leads[-1][sort], leads[-1]["id"]) if has_more else None
+        }
+        if not cursor:
+            total_count = await db.leads.count_documents(filter_query)
+            pagination.update({
+                "total_pages": (total_count + limit - 1) // limit,
+                "total_items": total_count
+            })
+        
+        await resolve_foreign_keys(leads, LEAD_LIST_REFS)
+        
+        return APIResponse(
+            success=True,
+            message="Leads retrieved successfully",
+            data={"leads": leads, "pagination": pagination}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Lead Search and Filtering
+# Static /leads/... GET routes have to be registered before /leads/{lead_id}
+LEAD_SEARCH_IN_LIMIT = 5000  # above this many text matches, filters are applied by intersecting id sets
+
+@api_router.get("/leads/search", response_model=APIResponse)
+@require_permission("/leads", "view")
+async def search_leads(
+    q: str = None,  # Search query
+    status: str = None,  # approval_status filter
+    subtype_id: str = None,  # lead_subtype_id filter
+    source_id: str = None,  # lead_source_id filter
+    company_id: str = None,  # company_id filter
+    assigned_to: str = None,  # assigned_to_user_id filter
+    date_from: str = None,  # created_at >= date_from
+    date_to: str = None,  # created_at <= date_to
+    min_revenue: float = None,  # expected_revenue >= min_revenue
+    max_revenue: float = None,  # expected_revenue <= max_revenue
+    limit: int = 50,  # Maximum results to return
+    offset: int = 0,  # Pagination offset
+    current_user: User = Depends(get_current_user)
+):
+    """Advanced search and filtering for leads
+
+    q is matched against the title, lead ID, description and notes through the lead
+    search index: every word must match, the last letters of a word may be left off,
+    and results come back best match first with a search_score. Without q, leads are
+    listed newest first. Filters are applied to the leads themselves before any names
+    are resolved.
+    """
+    try:
+        limit = min(max(limit, 1), LEAD_PAGE_LIMIT)
+        offset = max(offset, 0)
+        match_criteria = build_lead_filter(
+            status, subtype_id, source_id, company_id, assigned_to, date_from, date_to, min_revenue, max_revenue
+        )
+        
+        if search_tokens(q):
+            filtered = len(match_criteria) > 1
+            ranked, total_count = await lead_search_index.search(q, None if filtered else offset + limit)
+            if filtered and ranked:
+                if len(ranked) <= LEAD_SEARCH_IN_LIMIT:
+                    id_query = {**match_criteria, "id": {"$in": [lead_id for lead_id, _ in ranked]}}
+                else:
+                    id_query = match_criteria
+                rows = await db.leads.find(id_query, {"_id": 0, "id": 1}).to_list(None)
+                allowed = {row["id"] for row in rows}
+                ranked = [item for item in ranked if item[0] in allowed]
+                total_count = len(ranked)
+            
+            page = ranked[offset:offset + limit]
+            rows = await db.leads.find(
+                {"id": {"$in": [lead_id for lead_id, _ in page]}, "is_deleted": False}, {"_id": 0}
+            ).to_list(None)
+            by_id = {row["id"]: row for row in rows}
+            leads = []
+            for lead_id, score in page:
+                # A lead deleted since the index last synced is simply left out
+                if lead_id in by_id:
+                    leads.append({**by_id[lead_id], "search_score": score})
+        else:
+            leads = await db.leads.find(match_criteria, {"_id": 0}).sort(
+                [("created_at", -1), ("id", -1)]
+            ).skip(offset).limit(limit).to_list(limit)
+            total_count = await db.leads.count_documents(match_criteria)
+        
+        await resolve_foreign_keys(leads, LEAD_LIST_REFS)
+        
+        result = {
+            "leads": leads,
+            "total_count": total_count,
+            "limit": limit,
+            "offset": offset,
+            "has_more": (offset + limit) < total_count
+        }
+        
+        return APIResponse(success=True, message="Lead search completed successfully", data=result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Lead export
+LEAD_EXPORT_COLUMNS = [
+    "lead_id", "project_title", "lead_subtype_name", "lead_source_name", "currency_code", "company_name",
+    "expected_revenue", "convert_to_opportunity_date", "assigned_user_name", "approval_status",
+    "project_description", "decision_maker_percentage", "notes", "created_at", "updated_at"
+]
+
+def format_lead_export_dates(lead: dict) -> dict:
+    if lead.get("created_at"):
+        lead["created_at"] = lead["created_at"].strftime("%Y-%m-%d %H:%M:%S")
+    if lead.get("updated_at"):
+        lead["updated_at"] = lead["updated_at"].strftime("%Y-%m-%d %H:%M:%S")
+    if lead.get("convert_to_opportunity_date"):
+        lead["convert_to_opportunity_date"] = lead["convert_to_opportunity_date"].strftime("%Y-%m-%d")
+    return lead
+
+async def run_lead_export_job(context: JobContext) -> dict:
+    """Write every live lead to a CSV result file, one cursor batch at a time"""
+    filter_query = {"is_deleted": False}
+    total = await db.leads.count_documents(filter_query)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=LEAD_EXPORT_COLUMNS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    done = 0
+
+    async with aiofiles.open(context.output(f"leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", "text/csv"), "w", encoding="utf-8") as f:
+        async def write(batch: List[dict]):
+            await resolve_foreign_keys(batch, LEAD_LIST_REFS)
+            writer.writerows(format_lead_export_dates(lead) for lead in batch)
+            await f.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+
+        cursor = db.leads.find(filter_query, {"_id": 0}).sort("created_at", -1).batch_size(EXPORT_BATCH_SIZE)
+        batch = []
+        async for lead in cursor:
+            batch.append(lead)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                await write(batch)
+                done += len(batch)
+                batch = []
+                await context.progress(done, total)
+        await write(batch)
+    return {"rows": done + len(batch)}
+
+job_runner.register("lead_export", run_lead_export_job, concurrency=2, menu_path="/leads")
+
+@api_router.get("/leads/export", response_model=APIResponse)
+@require_permission("/leads", "view")
+async def export_leads(background: bool = False, current_user: User = Depends(get_current_user)):
+    """Export leads to CSV format (the first 1000 inline, or all of them as a background job's CSV file)"""
+    if background:
+        return await queue_job("lead_export", current_user)
     try:
-        # Get leads with enriched master data
+        # Get leads with enriched data for export
         pipeline = [
             {"$match": {"is_deleted": False}},
-            # Lookup lead subtype
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            # Lookup lead source
-            {"$lookup": {
-                "from": "lead_source_master",
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            # Lookup company
+            # Add all the lookups from get_leads
             {"$lookup": {
                 "from": "companies",
                 "localField": "company_id",
@@ -5086,15 +7583,6 @@ async def get_leads(current_user: User = Depends(get_current_user)):
                 "as": "company"
             }},
             {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            # Lookup currency
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            # Lookup assigned user
             {"$lookup": {
                 "from": "users",
                 "localField": "assigned_to_user_id",
@@ -5102,32 +7590,39 @@ async def get_leads(current_user: User = Depends(get_current_user)):
                 "as": "assigned_user"
             }},
             {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            # Add enriched fields
-            {"$addFields": {
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
+            # Project fields for export
+            {"$project": {
+                "_id": 0,
+                "lead_id": 1,
+                "project_title": 1,
+                "lead_subtype_id": 1,
+                "lead_source_id": 1,
+                "revenue_currency_id": 1,
                 "company_name": "$company.company_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "assigned_user_name": "$assigned_user.name"
+                "expected_revenue": 1,
+                "convert_to_opportunity_date": 1,
+                "assigned_user_name": "$assigned_user.name",
+                "approval_status": 1,
+                "project_description": 1,
+                "decision_maker_percentage": 1,
+                "notes": 1,
+                "created_at": 1,
+                "updated_at": 1
             }},
             {"$sort": {"created_at": -1}}
         ]
         
         leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(1000)
+        leads = await leads_cursor.to_list(1000)  # Limit to 1000 records for export
+        await resolve_foreign_keys(leads, LEAD_REFS)
         
-        # Remove MongoDB _id field
+        # Format dates for CSV
         for lead in leads:
-            lead.pop("_id", None)
-            # Remove nested objects to avoid duplication
-            lead.pop("lead_subtype", None)
-            lead.pop("lead_source", None)
-            lead.pop("company", None)
-            lead.pop("currency", None)
-            lead.pop("assigned_user", None)
+            for field in ("lead_subtype_id", "lead_source_id", "revenue_currency_id", "currency_symbol"):
+                lead.pop(field, None)
+            format_lead_export_dates(lead)
         
-        return APIResponse(success=True, message="Leads retrieved successfully", data=leads)
+        return APIResponse(success=True, message="Leads exported successfully", data=leads)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -5174,9 +7669,10 @@ async def create_lead(lead_data: dict, current_user: User = Depends(get_current_
         
         # Insert lead
         await db.leads.insert_one(lead.dict())
+        await cache_bus.publish("leads", lead.id)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created lead: {lead.project_title} ({lead_id})"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created lead: {lead.project_title} ({lead_id})", entity_type="lead", entity_id=lead.id, verb="create"))
         
         return APIResponse(success=True, message="Lead created successfully", data={"lead_id": lead_id})
         
@@ -5194,20 +7690,6 @@ async def get_lead(lead_id: str, current_user: User = Depends(get_current_user))
         pipeline = [
             {"$match": {"id": lead_id, "is_deleted": False}},
             # Add all the lookups from get_leads
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "lead_source_master",
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "companies",
                 "localField": "company_id",
@@ -5215,13 +7697,6 @@ async def get_lead(lead_id: str, current_user: User = Depends(get_current_user))
                 "as": "company"
             }},
             {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "users", 
                 "localField": "assigned_to_user_id",
@@ -5230,11 +7705,7 @@ async def get_lead(lead_id: str, current_user: User = Depends(get_current_user))
             }},
             {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
             {"$addFields": {
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
                 "company_name": "$company.company_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
                 "assigned_user_name": "$assigned_user.name"
             }}
         ]
@@ -5247,11 +7718,9 @@ async def get_lead(lead_id: str, current_user: User = Depends(get_current_user))
         
         lead = leads[0]
         lead.pop("_id", None)
-        lead.pop("lead_subtype", None)
-        lead.pop("lead_source", None)
         lead.pop("company", None)
-        lead.pop("currency", None)
         lead.pop("assigned_user", None)
+        await resolve_foreign_keys([lead], LEAD_REFS)
         
         return APIResponse(success=True, message="Lead retrieved successfully", data=lead)
         
@@ -5306,9 +7775,10 @@ async def update_lead(lead_id: str, lead_data: dict, current_user: User = Depend
         
         # Update lead
         await db.leads.update_one({"id": lead_id}, {"$set": lead_data})
+        await cache_bus.publish("leads", lead_id)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated lead: {existing_lead.get('project_title', lead_id)}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Updated lead: {existing_lead.get('project_title', lead_id)}", entity_type="lead", entity_id=lead_id, verb="update"))
         
         return APIResponse(success=True, message="Lead updated successfully")
         
@@ -5336,9 +7806,10 @@ async def delete_lead(lead_id: str, current_user: User = Depends(get_current_use
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
+        await cache_bus.publish("leads", lead_id)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted lead: {existing_lead.get('project_title', lead_id)}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Deleted lead: {existing_lead.get('project_title', lead_id)}", entity_type="lead", entity_id=lead_id, verb="delete"))
         
         return APIResponse(success=True, message="Lead deleted successfully")
         
@@ -5374,9 +7845,10 @@ async def approve_lead(lead_id: str, approval_data: dict, current_user: User = D
         }
         
         await db.leads.update_one({"id": lead_id}, {"$set": update_data})
+        await cache_bus.publish("leads", lead_id)
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"{approval_status.title()} lead: {existing_lead.get('project_title', lead_id)}"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"{approval_status.title()} lead: {existing_lead.get('project_title', lead_id)}", entity_type="lead", entity_id=lead_id, verb="approve" if approval_status == "approved" else "reject"))
         
         return APIResponse(success=True, message=f"Lead {approval_status} successfully")
         
@@ -5401,16 +7873,6 @@ async def get_lead_contacts(lead_id: str, current_user: User = Depends(get_curre
         # Get contacts with enriched data
         pipeline = [
             {"$match": {"lead_id": lead_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "designation_master",
-                "localField": "designation_id", 
-                "foreignField": "id",
-                "as": "designation"
-            }},
-            {"$unwind": {"path": "$designation", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "designation_name": "$designation.designation_name"
-            }},
             {"$sort": {"is_primary": -1, "created_at": 1}}
         ]
         
@@ -5419,7 +7881,10 @@ async def get_lead_contacts(lead_id: str, current_user: User = Depends(get_curre
         
         for contact in contacts:
             contact.pop("_id", None)
-            contact.pop("designation", None)
+        
+        await resolve_foreign_keys(contacts, [
+            ForeignKey("designation_id", "designation_master", display="designation_name", live_only=False, missing=None)
+        ])
         
         return APIResponse(success=True, message="Lead contacts retrieved successfully", data=contacts)
         
@@ -5569,46 +8034,10 @@ async def get_lead_tender(lead_id: str, current_user: User = Depends(get_current
             raise HTTPException(status_code=404, detail="Lead not found")
         
         # Get tender with enriched data
-        pipeline = [
-            {"$match": {"lead_id": lead_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "tender_subtype_master",
-                "localField": "tender_subtype_id", 
-                "foreignField": "id",
-                "as": "tender_subtype"
-            }},
-            {"$unwind": {"path": "$tender_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "submission_type_master",
-                "localField": "submission_type_id",
-                "foreignField": "id", 
-                "as": "submission_type"
-            }},
-            {"$unwind": {"path": "$submission_type", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "tender_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "tender_subtype_name": "$tender_subtype.tender_subtype_name",
-                "submission_type_name": "$submission_type.submission_type_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol"
-            }}
-        ]
-        
-        tender_cursor = db.lead_tenders.aggregate(pipeline)
-        tenders = await tender_cursor.to_list(1)
-        
-        tender = tenders[0] if tenders else None
+        tender = await db.lead_tenders.find_one({"lead_id": lead_id, "is_deleted": False})
         if tender:
             tender.pop("_id", None)
-            tender.pop("tender_subtype", None)
-            tender.pop("submission_type", None)
-            tender.pop("currency", None)
+            await resolve_foreign_keys([tender], LEAD_TENDER_REFS)
         
         return APIResponse(success=True, message="Lead tender retrieved successfully", data=tender)
         
@@ -5666,17 +8095,6 @@ async def get_lead_competitors(lead_id: str, current_user: User = Depends(get_cu
         # Get competitors with enriched data
         pipeline = [
             {"$match": {"lead_id": lead_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "competitor_master",
-                "localField": "competitor_id",
-                "foreignField": "id",
-                "as": "competitor"
-            }},
-            {"$unwind": {"path": "$competitor", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "competitor_name": "$competitor.competitor_name",
-                "competitor_description": "$competitor.competitor_description"
-            }},
             {"$sort": {"created_at": 1}}
         ]
         
@@ -5685,7 +8103,12 @@ async def get_lead_competitors(lead_id: str, current_user: User = Depends(get_cu
         
         for competitor in competitors:
             competitor.pop("_id", None)
-            competitor.pop("competitor", None)
+        
+        await resolve_foreign_keys(competitors, [
+            ForeignKey("competitor_id", "competitor_master", live_only=False,
+                       display={"competitor_name": "competitor_name", "competitor_description": "competitor_description"},
+                       missing=None)
+        ])
         
         return APIResponse(success=True, message="Lead competitors retrieved successfully", data=competitors)
         
@@ -5731,377 +8154,260 @@ async def create_lead_competitor(lead_id: str, competitor_data: dict, current_us
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-# Lead Documents CRUD
-@api_router.get("/leads/{lead_id}/documents", response_model=APIResponse)
-@require_permission("/leads", "view")
-async def get_lead_documents(lead_id: str, current_user: User = Depends(get_current_user)):
-    """Get all documents for a specific lead"""
-    try:
-        # Verify lead exists
-        lead = await db.leads.find_one({"id": lead_id, "is_deleted": False})
-        if not lead:
-            raise HTTPException(status_code=404, detail="Lead not found")
-        
-        # Get documents with enriched data
-        pipeline = [
-            {"$match": {"lead_id": lead_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "master_document_types",
-                "localField": "document_type_id",
-                "foreignField": "document_type_id",
-                "as": "document_type"
-            }},
-            {"$unwind": {"path": "$document_type", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "document_type_name": "$document_type.document_type_name"
-            }},
-            {"$sort": {"upload_date": -1}}
-        ]
-        
-        documents_cursor = db.lead_documents.aggregate(pipeline)
-        documents = await documents_cursor.to_list(100)
-        
-        for document in documents:
-            document.pop("_id", None)
-            document.pop("document_type", None)
-        
-        return APIResponse(success=True, message="Lead documents retrieved successfully", data=documents)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@api_router.post("/leads/{lead_id}/documents", response_model=APIResponse)
-@require_permission("/leads", "edit")
-async def create_lead_document(lead_id: str, document_data: dict, current_user: User = Depends(get_current_user)):
-    """Create a new document for a lead"""
-    try:
-        # Verify lead exists and is not approved
-        lead = await db.leads.find_one({"id": lead_id, "is_deleted": False})
-        if not lead:
-            raise HTTPException(status_code=404, detail="Lead not found")
-        
-        if lead.get("approval_status") == "approved":
-            raise HTTPException(status_code=400, detail="Cannot modify approved lead")
-        
-        document_data["lead_id"] = lead_id
-        document_data["created_by"] = current_user.id
-        document_data["updated_by"] = current_user.id
-        
-        # Validate document data
-        document = LeadDocument(**document_data)
-        
-        # Insert document
-        await db.lead_documents.insert_one(document.dict())
-        
-        return APIResponse(success=True, message="Lead document created successfully", data={"document_id": document.id})
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-# ===== LEAD BULK OPERATIONS =====
-
-@api_router.get("/leads/export", response_model=APIResponse)
-@require_permission("/leads", "view")
-async def export_leads(current_user: User = Depends(get_current_user)):
-    """Export leads to CSV format"""
-    try:
-        # Get leads with enriched data for export
-        pipeline = [
-            {"$match": {"is_deleted": False}},
-            # Add all the lookups from get_leads
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "lead_source_master",
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "assigned_to_user_id",
-                "foreignField": "id",
-                "as": "assigned_user"
-            }},
-            {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            # Project fields for export
-            {"$project": {
-                "lead_id": 1,
-                "project_title": 1,
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
-                "company_name": "$company.company_name",
-                "expected_revenue": 1,
-                "currency_code": "$currency.currency_code",
-                "convert_to_opportunity_date": 1,
-                "assigned_user_name": "$assigned_user.name",
-                "approval_status": 1,
-                "project_description": 1,
-                "decision_maker_percentage": 1,
-                "notes": 1,
-                "created_at": 1,
-                "updated_at": 1
-            }},
-            {"$sort": {"created_at": -1}}
-        ]
-        
-        leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(1000)  # Limit to 1000 records for export
-        
-        # Format dates for CSV
-        for lead in leads:
-            if lead.get("created_at"):
-                lead["created_at"] = lead["created_at"].strftime("%Y-%m-%d %H:%M:%S")
-            if lead.get("updated_at"):
-                lead["updated_at"] = lead["updated_at"].strftime("%Y-%m-%d %H:%M:%S")
-            if lead.get("convert_to_opportunity_date"):
-                lead["convert_to_opportunity_date"] = lead["convert_to_opportunity_date"].strftime("%Y-%m-%d")
-        
-        return APIResponse(success=True, message="Leads exported successfully", data=leads)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@api_router.post("/leads/import", response_model=APIResponse)
-@require_permission("/leads", "create")
-async def import_leads(leads_data: list, current_user: User = Depends(get_current_user)):
-    """Import leads from CSV data"""
-    try:
-        imported_count = 0
-        errors = []
-        
-        for index, lead_data in enumerate(leads_data):
-            try:
-                # Generate Lead ID
-                lead_id = await generate_lead_id()
-                lead_data["lead_id"] = lead_id
-                lead_data["created_by"] = current_user.id
-                lead_data["updated_by"] = current_user.id
-                
-                # Validate required fields
-                required_fields = ["project_title", "lead_subtype_id", "lead_source_id", "company_id", 
-                                 "expected_revenue", "revenue_currency_id", "convert_to_opportunity_date", "assigned_to_user_id"]
-                
-                for field in required_fields:
-                    if not lead_data.get(field):
-                        raise ValueError(f"Missing required field: {field}")
-                
-                # Convert string dates to datetime if needed
-                if isinstance(lead_data.get("convert_to_opportunity_date"), str):
-                    lead_data["convert_to_opportunity_date"] = datetime.fromisoformat(lead_data["convert_to_opportunity_date"])
-                
-                # Validate lead data
-                lead = Lead(**lead_data)
-                
-                # Check if lead with same project title already exists
-                existing_lead = await db.leads.find_one({
-                    "project_title": lead.project_title,
-                    "company_id": lead.company_id,
-                    "is_deleted": False
-                })
-                if existing_lead:
-                    raise ValueError(f"Lead with project title '{lead.project_title}' already exists for this company")
-                
-                # Insert lead
-                await db.leads.insert_one(lead.dict())
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Row {index + 1}: {str(e)}")
-        
-        # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Imported {imported_count} leads"))
-        
-        result = {
-            "imported_count": imported_count,
-            "total_count": len(leads_data),
-            "errors": errors
-        }
-        
-        return APIResponse(success=True, message=f"Import completed. {imported_count}/{len(leads_data)} leads imported successfully.", data=result)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-# Lead Search and Filtering
-@api_router.get("/leads/search", response_model=APIResponse)
-@require_permission("/leads", "view")
-async def search_leads(
-    q: str = None,  # Search query
-    status: str = None,  # approval_status filter
-    subtype_id: str = None,  # lead_subtype_id filter
-    source_id: str = None,  # lead_source_id filter
-    company_id: str = None,  # company_id filter
-    assigned_to: str = None,  # assigned_to_user_id filter
-    date_from: str = None,  # created_at >= date_from
-    date_to: str = None,  # created_at <= date_to
-    min_revenue: float = None,  # expected_revenue >= min_revenue
-    max_revenue: float = None,  # expected_revenue <= max_revenue
-    limit: int = 50,  # Maximum results to return
-    offset: int = 0,  # Pagination offset
-    current_user: User = Depends(get_current_user)
-):
-    """Advanced search and filtering for leads"""
-    try:
-        # Build match criteria
-        match_criteria = {"is_deleted": False}
-        
-        # Text search on project title, notes, and project description
-        if q:
-            match_criteria["$or"] = [
-                {"project_title": {"$regex": q, "$options": "i"}},
-                {"notes": {"$regex": q, "$options": "i"}},
-                {"project_description": {"$regex": q, "$options": "i"}}
-            ]
-        
-        # Status filter
-        if status:
-            match_criteria["approval_status"] = status
-        
-        # Subtype filter
-        if subtype_id:
-            match_criteria["lead_subtype_id"] = subtype_id
-        
-        # Source filter
-        if source_id:
-            match_criteria["lead_source_id"] = source_id
-        
-        # Company filter
-        if company_id:
-            match_criteria["company_id"] = company_id
-        
-        # Assigned user filter
-        if assigned_to:
-            match_criteria["assigned_to_user_id"] = assigned_to
-        
-        # Date range filter
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_criteria["created_at"] = date_filter
-        
-        # Revenue range filter
-        if min_revenue is not None or max_revenue is not None:
-            revenue_filter = {}
-            if min_revenue is not None:
-                revenue_filter["$gte"] = min_revenue
-            if max_revenue is not None:
-                revenue_filter["$lte"] = max_revenue
-            match_criteria["expected_revenue"] = revenue_filter
-        
-        # Build aggregation pipeline
-        pipeline = [
-            {"$match": match_criteria},
-            # Add enrichment lookups (same as get_leads)
-            {"$lookup": {
-                "from": "lead_subtype_master",
-                "localField": "lead_subtype_id",
-                "foreignField": "id",
-                "as": "lead_subtype"
-            }},
-            {"$unwind": {"path": "$lead_subtype", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "lead_source_master", 
-                "localField": "lead_source_id",
-                "foreignField": "id",
-                "as": "lead_source"
-            }},
-            {"$unwind": {"path": "$lead_source", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "companies",
-                "localField": "company_id",
-                "foreignField": "company_id",
-                "as": "company"
-            }},
-            {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "users",
-                "localField": "assigned_to_user_id",
-                "foreignField": "id",
-                "as": "assigned_user"
-            }},
-            {"$unwind": {"path": "$assigned_user", "preserveNullAndEmptyArrays": True}},
-            {"$addFields": {
-                "lead_subtype_name": "$lead_subtype.lead_subtype_name",
-                "lead_source_name": "$lead_source.lead_source_name",
-                "company_name": "$company.company_name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
-                "assigned_user_name": "$assigned_user.name"
-            }},
-            {"$sort": {"created_at": -1}},
-            {"$skip": offset},
-            {"$limit": limit}
-        ]
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Lead Documents CRUD
+@api_router.get("/leads/{lead_id}/documents", response_model=APIResponse)
+@require_permission("/leads", "view")
+async def get_lead_documents(lead_id: str, current_user: User = Depends(get_current_user)):
+    """Get all documents for a specific lead"""
+    try:
+        # Verify lead exists
+        lead = await db.leads.find_one({"id": lead_id, "is_deleted": False})
+        if not lead:
+            raise HTTPException(status_code=404, detail="Lead not found")
         
-        # Get total count for pagination
-        count_pipeline = [
-            {"$match": match_criteria},
-            {"$count": "total"}
+        # Get documents with enriched data
+        pipeline = [
+            {"$match": {"lead_id": lead_id, "is_deleted": False}},
+            {"$sort": {"upload_date": -1}}
         ]
         
-        # Execute queries
-        leads_cursor = db.leads.aggregate(pipeline)
-        leads = await leads_cursor.to_list(limit)
+        documents_cursor = db.lead_documents.aggregate(pipeline)
+        documents = await documents_cursor.to_list(100)
         
-        count_cursor = db.leads.aggregate(count_pipeline)
-        count_result = await count_cursor.to_list(1)
-        total_count = count_result[0]["total"] if count_result else 0
+        for document in documents:
+            document.pop("_id", None)
         
-        # Clean up results
-        for lead in leads:
-            lead.pop("_id", None)
-            lead.pop("lead_subtype", None)
-            lead.pop("lead_source", None)
-            lead.pop("company", None)
-            lead.pop("currency", None)
-            lead.pop("assigned_user", None)
+        await resolve_foreign_keys(documents, [DOCUMENT_TYPE_REF])
         
-        result = {
-            "leads": leads,
-            "total_count": total_count,
-            "limit": limit,
-            "offset": offset,
-            "has_more": (offset + limit) < total_count
-        }
+        return APIResponse(success=True, message="Lead documents retrieved successfully", data=documents)
         
-        return APIResponse(success=True, message="Lead search completed successfully", data=result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/leads/{lead_id}/documents", response_model=APIResponse)
+@require_permission("/leads", "edit")
+async def create_lead_document(lead_id: str, document_data: dict, current_user: User = Depends(get_current_user)):
+    """Create a new document for a lead"""
+    try:
+        # Verify lead exists and is not approved
+        lead = await db.leads.find_one({"id": lead_id, "is_deleted": False})
+        if not lead:
+            raise HTTPException(status_code=404, detail="Lead not found")
+        
+        if lead.get("approval_status") == "approved":
+            raise HTTPException(status_code=400, detail="Cannot modify approved lead")
+        
+        document_data["lead_id"] = lead_id
+        document_data["created_by"] = current_user.id
+        document_data["updated_by"] = current_user.id
+        
+        # Validate document data
+        document = LeadDocument(**document_data)
+        
+        # Insert document
+        await db.lead_documents.insert_one(document.dict())
+        
+        return APIResponse(success=True, message="Lead document created successfully", data={"document_id": document.id})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ===== LEAD BULK OPERATIONS =====
+
+# Lead import
+LEAD_IMPORT_REQUIRED = ["project_title", "lead_subtype_id", "lead_source_id", "company_id",
+                        "expected_revenue", "revenue_currency_id", "convert_to_opportunity_date", "assigned_to_user_id"]
+LEAD_IMPORT_OPTIONAL = ["project_description", "project_start_date", "project_end_date", "decision_maker_percentage", "notes"]
+LEAD_IMPORT_DATES = ["convert_to_opportunity_date", "project_start_date", "project_end_date"]
+LEAD_IMPORT_NUMBERS = ["expected_revenue", "decision_maker_percentage"]
+LEAD_IMPORT_REFS = [
+    # (field, collection, key, label)
+    ("lead_subtype_id", "lead_subtype_master", "id", "Lead subtype"),
+    ("lead_source_id", "lead_source_master", "id", "Lead source"),
+    ("revenue_currency_id", "master_currencies", "currency_id", "Currency"),
+    ("company_id", "companies", "company_id", "Company"),
+    ("assigned_to_user_id", "users", "id", "Assigned user")
+]
+LEAD_IMPORT_CHUNK = 1000
+LEAD_IMPORT_ERROR_LIMIT = 1000  # errors kept in the job result; the full list goes to its result file
+
+class LeadImport:
+    """Validates imported lead rows as a DataFrame and inserts the valid ones in chunks
+
+    Every check runs over whole columns: required fields, numbers, dates, references
+    (against id sets loaded once per import) and duplicate titles, both within the file
+    and against stored leads with a single query. Rows that pass get lead codes from one
+    block reservation and are written with unordered insert_many, so a failing row never
+    stops the rest of its chunk.
+    """
+
+    def __init__(self, rows: List[dict], user_id: str, progress=None):
+        self.total = len(rows)
+        self.user_id = user_id
+        self.progress = progress  # optional async progress(done, total, message) callback
+        self.errors: Dict[int, List[str]] = {}
+        self.frame = pd.DataFrame(rows, columns=LEAD_IMPORT_REQUIRED + LEAD_IMPORT_OPTIONAL)
+
+    def flag(self, mask, message):
+        """Record message (a string, or a Series of per-row strings) for every row in mask"""
+        for row in np.flatnonzero(mask.fillna(False).to_numpy(dtype=bool)):
+            self.errors.setdefault(row, []).append(message if isinstance(message, str) else message.iloc[row])
+
+    def normalize(self):
+        """Trim text, treat blanks as missing and parse numbers and dates"""
+        frame = self.frame
+        for column in frame.columns:
+            values = frame[column].astype("string").str.strip()
+            frame[column] = values.mask(values.eq("").fillna(False))
+        self.missing = frame.isna()
+        for column in LEAD_IMPORT_NUMBERS:
+            parsed = pd.to_numeric(frame[column], errors="coerce")
+            self.flag(frame[column].notna() & parsed.isna(), f"Invalid number in {column}")
+            frame[column] = parsed
+        for column in LEAD_IMPORT_DATES:
+            parsed = pd.to_datetime(frame[column], errors="coerce", utc=True, format="ISO8601")
+            self.flag(frame[column].notna() & parsed.isna(), f"Invalid date in {column}")
+            frame[column] = parsed
+
+    def check_fields(self):
+        frame = self.frame
+        for column in LEAD_IMPORT_REQUIRED:
+            self.flag(self.missing[column], f"Missing required field: {column}")
+        self.flag(frame["expected_revenue"] <= 0, "Expected revenue must be positive")
+        percentage = frame["decision_maker_percentage"]
+        self.flag(percentage.notna() & ((percentage < 1) | (percentage > 100) | (percentage % 1 != 0)),
+                  "Decision maker percentage must be a whole number between 1 and 100")
+
+    async def check_references(self):
+        """Reference ids must exist; master tables come from the cache, the rest from one $in query each"""
+        async def known_ids(field, collection, key):
+            if collection in MASTER_COLLECTIONS:
+                return set(await master_data_cache.index(collection, key))
+            values = self.frame[field].dropna().unique().tolist()
+            if not values:
+                return set()
+            rows = await db[collection].find({key: {"$in": values}, "is_deleted": False}, {"_id": 0, key: 1}).to_list(None)
+            return {row[key] for row in rows}
+
+        id_sets = await asyncio.gather(*(known_ids(field, collection, key) for field, collection, key, _ in LEAD_IMPORT_REFS))
+        for (field, _, _, label), ids in zip(LEAD_IMPORT_REFS, id_sets):
+            column = self.frame[field]
+            self.flag(column.notna() & ~column.isin(ids), f"{label} not found")
+
+    async def check_duplicates(self):
+        """A project title may appear once per company, counting stored leads and earlier rows"""
+        frame = self.frame
+        keys = ["company_id", "project_title"]
+        keyed = frame[keys].notna().all(axis=1)
+        if not keyed.any():
+            return
+
+        first_row = frame.index.to_series().groupby([frame["company_id"], frame["project_title"]]).transform("min")
+        repeated = keyed & frame.duplicated(keys, keep="first")
+        self.flag(repeated, "Duplicate of row " + (first_row.fillna(-1).astype(int) + 1).astype(str) + " in this file")
+
+        stored = await db.leads.find({
+            "company_id": {"$in": frame.loc[keyed, "company_id"].unique().tolist()},
+            "project_title": {"$in": frame.loc[keyed, "project_title"].unique().tolist()},
+            "is_deleted": False
+        }, {"_id": 0, "company_id": 1, "project_title": 1}).to_list(None)
+        if stored:
+            existing = pd.MultiIndex.from_tuples([(row["company_id"], row["project_title"]) for row in stored])
+            clash = keyed & pd.MultiIndex.from_frame(frame[keys].astype(object)).isin(existing)
+            self.flag(clash, "Lead with project title '" + frame["project_title"].fillna("") + "' already exists for this company")
+
+    def valid_records(self) -> List[tuple]:
+        """(row, record) pairs for rows without errors, with missing values as None"""
+        frame = self.frame.astype(object)
+        for column in LEAD_IMPORT_DATES:
+            frame[column] = pd.Series(self.frame[column].dt.to_pydatetime(), index=frame.index, dtype=object)
+        frame = frame.where(self.frame.notna(), None)
+        rows = [row for row in range(self.total) if row not in self.errors]
+        return list(zip(rows, frame.iloc[rows].to_dict("records")))
+
+    async def insert(self, records: List[tuple]) -> int:
+        """Write the rows in unordered chunks; returns how many were inserted"""
+        codes = await id_allocator.codes("lead_id", len(records))
+        docs, doc_rows = [], []
+        for (row, record), code in zip(records, codes):
+            try:
+                lead = Lead(**record, lead_id=code, created_by=self.user_id, updated_by=self.user_id)
+            except ValueError as e:
+                self.errors.setdefault(row, []).append(str(e))
+                continue
+            docs.append(lead.dict())
+            doc_rows.append(row)
+
+        inserted = 0
+        for start in range(0, len(docs), LEAD_IMPORT_CHUNK):
+            chunk = docs[start:start + LEAD_IMPORT_CHUNK]
+            try:
+                result = await db.leads.insert_many(chunk, ordered=False)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                inserted += e.details.get("nInserted", 0)
+                for failure in e.details.get("writeErrors", []):
+                    row = doc_rows[start + failure["index"]]
+                    self.errors.setdefault(row, []).append(failure.get("errmsg", "Insert failed"))
+            if self.progress:
+                await self.progress(start + len(chunk), len(docs), "Inserting leads")
+        return inserted
+
+    async def run(self) -> Dict[str, Any]:
+        imported_count = 0
+        if self.total:
+            self.normalize()
+            self.check_fields()
+            await self.check_references()
+            await self.check_duplicates()
+            records = self.valid_records()
+            if self.progress:
+                await self.progress(0, len(records), f"Validated {self.total} rows")
+            if records:
+                imported_count = await self.insert(records)
+        return {
+            "imported_count": imported_count,
+            "total_count": self.total,
+            "errors": [f"Row {row + 1}: {'; '.join(messages)}" for row, messages in sorted(self.errors.items())]
+        }
+
+async def run_lead_import_job(context: JobContext) -> dict:
+    """Import the rows the /leads/import request left in the job's directory"""
+    async with aiofiles.open(context.path("rows.json"), "rb") as f:
+        rows = json.loads(await f.read())
+    result = await LeadImport(rows, context.user_id, progress=context.progress).run()
+    imported_count = result["imported_count"]
+    
+    if imported_count:
+        await cache_bus.publish("leads")
+    
+    # Log activity
+    await log_activity(ActivityLog(user_id=context.user_id, action=f"Imported {imported_count} leads", entity_type="lead", verb="import"))
+    
+    if len(result["errors"]) > LEAD_IMPORT_ERROR_LIMIT:
+        async with aiofiles.open(context.output("import_errors.txt", "text/plain"), "w", encoding="utf-8") as f:
+            await f.write("\n".join(result["errors"]) + "\n")
+        result["error_count"] = len(result["errors"])
+        result["errors"] = result["errors"][:LEAD_IMPORT_ERROR_LIMIT]
+    return result
+
+# Not retried: a second run would report the first run's rows as duplicates
+job_runner.register("lead_import", run_lead_import_job, menu_path="/leads", permission="create", api=False,
+                    max_attempts=1)
+
+@api_router.post("/leads/import", response_model=APIResponse)
+@require_permission("/leads", "create")
+async def import_leads(leads_data: List[Dict[str, Any]], current_user: User = Depends(get_current_user)):
+    """Queue an import of leads from CSV data; the job's result has the per-row errors"""
+    try:
+        rows = json.dumps(leads_data, default=str).encode("utf-8")
+        return await queue_job("lead_import", current_user, {"row_count": len(leads_data)}, inputs={"rows.json": rows})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -6110,145 +8416,191 @@ async def search_leads(
 
 # Helper function to generate Opportunity ID
 async def generate_opportunity_id():
-    """Generate unique OPP-XXXXXXX format ID (7-digit padded)"""
-    while True:
-        # Generate random 7-character alphanumeric string
-        import random
-        import string
-        random_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-        opportunity_id = f"OPP-{random_id}"
-        
-        # Check if this ID already exists
-        existing = await db.opportunities.find_one({"opportunity_id": opportunity_id, "is_deleted": False})
-        if not existing:
-            return opportunity_id
+    """Allocate the next OPP-XXXXXXX code"""
+    return (await id_allocator.codes("opportunity_id"))[0]
 
 # Helper function to get next serial number
 async def get_next_sr_no():
-    """Get next sequential serial number for opportunities"""
-    try:
-        # Get the highest sr_no
-        pipeline = [
-            {"$match": {"is_deleted": False, "sr_no": {"$exists": True, "$ne": None}}},
-            {"$sort": {"sr_no": -1}},
-            {"$limit": 1}
+    """Allocate the next opportunity serial number"""
+    return (await id_allocator.take("sr_no"))[0]
+
+# Auto-conversion of leads approved more than 4 weeks ago
+AUTO_CONVERT_AGE = timedelta(weeks=4)
+AUTO_CONVERT_BATCH = 1000
+AUTO_CONVERT_REASON = "Auto-converted after 4 weeks in approved status"
+# Auto-converted opportunities get an id derived from their lead's, so the unique id
+# index turns a second conversion of the same lead (by a concurrent run) into a no-op
+AUTO_CONVERT_NAMESPACE = uuid.UUID("5b0c7a51-2f4e-4d8a-9a51-8f1c0c4e7d21")
+
+def auto_converted_opportunity_id(lead_id: str) -> str:
+    return str(uuid.uuid5(AUTO_CONVERT_NAMESPACE, lead_id))
+
+async def initial_opportunity_stages() -> Dict[str, dict]:
+    """{opportunity_type: its first stage} from the stage catalog, seeding stages if missing"""
+    if not await stage_catalog.at("Tender", 1) or not await stage_catalog.at("Non-Tender", 1):
+        # Create default stages if they don't exist
+        await initialize_opportunity_stages()
+    stages = {}
+    for opportunity_type in ("Tender", "Non-Tender"):
+        stage = await stage_catalog.at(opportunity_type, 1)
+        if stage:
+            stages[opportunity_type] = stage
+    return stages
+
+class LeadAutoConversion:
+    """Converts every approved lead older than AUTO_CONVERT_AGE that has no opportunity yet
+
+    Eligible leads come from one anti-join aggregation and are written in batches: one
+    insert_many for the opportunities, one for their stage history and one bulk_write for
+    the lead notes. Safe to run concurrently; a lead another run converted first is skipped.
+    """
+
+    def __init__(self, now: Optional[datetime] = None, batch_size: int = AUTO_CONVERT_BATCH):
+        self.now = now or datetime.now(timezone.utc)
+        self.batch_size = batch_size
+        self.converted = 0
+        self.skipped = 0  # converted by another run meanwhile
+        self.errors: List[str] = []
+
+    def pipeline(self) -> List[dict]:
+        return [
+            {"$match": {
+                "approval_status": "approved",
+                "approved_at": {"$lte": self.now - AUTO_CONVERT_AGE},
+                "is_deleted": False,
+                "is_active": True,
+                # Leads converted by an earlier run never reach the anti-join again
+                "auto_converted_at": None
+            }},
+            {"$lookup": {"from": "opportunities", "localField": "id", "foreignField": "lead_id", "as": "opportunities"}},
+            # A deleted auto-converted opportunity is not recreated; a deleted manual one is
+            {"$match": {"opportunities": {"$not": {"$elemMatch": {"$or": [{"is_deleted": False}, {"auto_converted": True}]}}}}},
+            {"$project": {"_id": 0, "opportunities": 0}}
         ]
-        result = await db.opportunities.aggregate(pipeline).to_list(1)
-        return (result[0]["sr_no"] + 1) if result else 1
-    except:
-        return 1
 
-# Auto-conversion function for leads older than 4 weeks
+    def build(self, lead: dict, opportunity_type: str, stage: Optional[dict], opp_id: str, sr_no: int) -> dict:
+        return Opportunity(
+            id=auto_converted_opportunity_id(lead["id"]),
+            opportunity_id=opp_id,
+            sr_no=sr_no,
+            opportunity_title=lead.get("project_title", "Auto-converted Opportunity"),
+            company_id=lead.get("company_id"),
+            current_stage_id=stage["id"] if stage else None,
+            opportunity_owner_id=lead.get("assigned_to_user_id"),
+            opportunity_type=opportunity_type,
+            lead_id=lead["id"],
+            project_title=lead.get("project_title"),
+            project_description=lead.get("project_description"),
+            project_start_date=lead.get("project_start_date"),
+            project_end_date=lead.get("project_end_date"),
+            expected_revenue=lead.get("expected_revenue"),
+            revenue_currency_id=lead.get("revenue_currency_id"),
+            lead_source_id=lead.get("lead_source_id"),
+            decision_maker_percentage=lead.get("decision_maker_percentage"),
+            auto_converted=True,
+            auto_conversion_reason=AUTO_CONVERT_REASON,
+            created_at=self.now,
+            updated_at=self.now,
+            created_by="system",
+            updated_by="system"
+        ).dict()
+
+    async def convert(self, leads: List[dict], subtypes: Dict[str, dict], stages: Dict[str, dict]):
+        """Convert one batch of eligible leads"""
+        opp_codes = await id_allocator.codes("opportunity_id", len(leads))
+        sr_numbers = await id_allocator.take("sr_no", len(leads))
+
+        docs, doc_leads = [], []
+        for lead, opp_id, sr_no in zip(leads, opp_codes, sr_numbers):
+            # Determine opportunity type based on lead subtype
+            lead_subtype = subtypes.get(lead.get("lead_subtype_id"))
+            opportunity_type = "Non-Tender"
+            if lead_subtype and lead_subtype.get("lead_subtype_name") in ["Tender", "Pretender"]:
+                opportunity_type = "Tender"
+            try:
+                docs.append(self.build(lead, opportunity_type, stages.get(opportunity_type), opp_id, sr_no))
+            except ValueError as e:
+                self.errors.append(f"{lead.get('lead_id') or lead['id']}: {e}")
+                continue
+            doc_leads.append(lead)
+        if not docs:
+            return
+
+        # Leads converted meanwhile by another run collide on the opportunity id
+        failed = set()
+        try:
+            await db.opportunities.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for failure in e.details.get("writeErrors", []):
+                if failure.get("code") != 11000:
+                    raise
+                failed.add(failure["index"])
+        self.skipped += len(failed)
+
+        history, lead_updates = [], []
+        for index, (doc, lead) in enumerate(zip(docs, doc_leads)):
+            if index in failed:
+                continue
+            stage = stages.get(doc["opportunity_type"])
+            if stage:
+                history.append(OpportunityStageHistory(
+                    opportunity_id=doc["id"],
+                    to_stage_id=stage["id"],
+                    stage_name=stage["stage_name"],
+                    transition_date=self.now,
+                    transitioned_by="system",
+                    created_at=self.now
+                ).dict())
+            # Mark lead as converted (optional - keep it active for reference)
+            lead_updates.append(UpdateOne({"id": lead["id"]}, {"$set": {
+                "notes": f"{lead.get('notes') or ''} [Auto-converted to Opportunity {doc['opportunity_id']}]".strip(),
+                "auto_converted_at": self.now,
+                "updated_by": "system",
+                "updated_at": self.now
+            }}))
+        if history:
+            await db.opportunity_stage_history.insert_many(history, ordered=False)
+        if lead_updates:
+            await db.leads.bulk_write(lead_updates, ordered=False)
+        self.converted += len(lead_updates)
+
+    async def run(self) -> int:
+        subtypes = await master_data_cache.index("lead_subtype_master", "id")
+        stages = await initial_opportunity_stages()
+        batch = []
+        async for lead in db.leads.aggregate(self.pipeline(), allowDiskUse=True):
+            batch.append(lead)
+            if len(batch) == self.batch_size:
+                await self.convert(batch, subtypes, stages)
+                batch = []
+        if batch:
+            await self.convert(batch, subtypes, stages)
+        return self.converted
+
 async def check_and_convert_old_leads():
     """Auto-convert approved leads older than 4 weeks to opportunities"""
     try:
-        four_weeks_ago = datetime.now(timezone.utc) - timedelta(weeks=4)
-        
-        # Find approved leads older than 4 weeks without linked opportunities
-        old_leads_cursor = db.leads.find({
-            "approval_status": "approved",
-            "approved_at": {"$lte": four_weeks_ago},
-            "is_deleted": False,
-            "is_active": True
-        })
-        
-        old_leads = await old_leads_cursor.to_list(100)  # Limit to 100 at a time
-        converted_count = 0
-        
-        for lead in old_leads:
-            # Check if opportunity already exists for this lead
-            existing_opp = await db.opportunities.find_one({
-                "lead_id": lead["id"],
-                "is_deleted": False
-            })
-            
-            if not existing_opp:
-                # Auto-convert to opportunity
-                opp_id = await generate_opportunity_id()
-                sr_no = await get_next_sr_no()
-                
-                # Determine opportunity type based on lead subtype
-                lead_subtype = await db.lead_subtype_master.find_one({
-                    "id": lead.get("lead_subtype_id"),
-                    "is_deleted": False
-                })
-                
-                opportunity_type = "Non-Tender"
-                if lead_subtype and lead_subtype.get("lead_subtype_name") in ["Tender", "Pretender"]:
-                    opportunity_type = "Tender"
-                
-                # Get initial stage for this opportunity type
-                initial_stage = await db.opportunity_stages.find_one({
-                    "opportunity_type": opportunity_type,
-                    "sequence_order": 1,
-                    "is_deleted": False
-                })
-                
-                if not initial_stage:
-                    # Create default stages if they don't exist
-                    await initialize_opportunity_stages()
-                    initial_stage = await db.opportunity_stages.find_one({
-                        "opportunity_type": opportunity_type,
-                        "sequence_order": 1,
-                        "is_deleted": False
-                    })
-                
-                opportunity_data = Opportunity(
-                    opportunity_id=opp_id,
-                    sr_no=sr_no,
-                    opportunity_title=lead.get("project_title", "Auto-converted Opportunity"),
-                    company_id=lead.get("company_id"),
-                    current_stage_id=initial_stage["id"] if initial_stage else None,
-                    opportunity_owner_id=lead.get("assigned_to_user_id"),
-                    opportunity_type=opportunity_type,
-                    lead_id=lead["id"],
-                    project_title=lead.get("project_title"),
-                    project_description=lead.get("project_description"),
-                    project_start_date=lead.get("project_start_date"),
-                    project_end_date=lead.get("project_end_date"),
-                    expected_revenue=lead.get("expected_revenue"),
-                    revenue_currency_id=lead.get("revenue_currency_id"),
-                    lead_source_id=lead.get("lead_source_id"),
-                    decision_maker_percentage=lead.get("decision_maker_percentage"),
-                    auto_converted=True,
-                    auto_conversion_reason="Auto-converted after 4 weeks in approved status",
-                    created_by="system",
-                    updated_by="system"
-                )
-                
-                # Insert opportunity
-                await db.opportunities.insert_one(opportunity_data.dict())
-                
-                # Create stage history entry
-                if initial_stage:
-                    stage_history = OpportunityStageHistory(
-                        opportunity_id=opportunity_data.id,
-                        to_stage_id=initial_stage["id"],
-                        stage_name=initial_stage["stage_name"],
-                        transitioned_by="system"
-                    )
-                    await db.opportunity_stage_history.insert_one(stage_history.dict())
-                
-                # Mark lead as converted (optional - keep it active for reference)
-                await db.leads.update_one(
-                    {"id": lead["id"]},
-                    {"$set": {
-                        "notes": f"{lead.get('notes', '')} [Auto-converted to Opportunity {opp_id}]".strip(),
-                        "updated_by": "system",
-                        "updated_at": datetime.now(timezone.utc)
-                    }}
-                )
-                
-                converted_count += 1
+        conversion = LeadAutoConversion()
+        converted_count = await conversion.run()
         
         if converted_count > 0:
+            await cache_bus.publish("leads")
+            await request_kpi_refresh()
             print(f"Auto-converted {converted_count} old approved leads to opportunities")
+        if conversion.errors:
+            print(f"Skipped {len(conversion.errors)} leads that could not be converted: {'; '.join(conversion.errors[:10])}")
         
         return converted_count
         
     except Exception as e:
         print(f"Error in auto-conversion: {str(e)}")
-        return 0
+        raise
+
+AUTO_CONVERT_INTERVAL_SECONDS = int(os.environ.get('AUTO_CONVERT_INTERVAL_SECONDS', '3600'))
+AUTO_CONVERT_TRIGGER_WAIT_SECONDS = 10
+
+auto_convert_schedule = ScheduledTask("lead_auto_convert", check_and_convert_old_leads, AUTO_CONVERT_INTERVAL_SECONDS)
+scheduled_tasks.append(auto_convert_schedule)
 
 # Initialize Lead Management master data
 async def initialize_lead_management_data():
@@ -6875,47 +9227,45 @@ async def initialize_opportunity_stages():
             {"stage_name": "Partial", "stage_code": "PARTIAL", "sequence_order": 102},
         ]
         
+        # Check against the table as stored, not this worker's copy of it
+        master_data_cache.invalidate("opportunity_stages")
+        inserted = 0
+        
         # Insert Tender stages
         for stage_data in tender_stages:
-            existing = await db.opportunity_stages.find_one({
-                "stage_code": stage_data["stage_code"],
-                "opportunity_type": "Tender",
-                "is_deleted": False
-            })
+            existing = await stage_catalog.with_code("Tender", stage_data["stage_code"])
             if not existing:
                 stage = OpportunityStage(
                     opportunity_type="Tender",
                     **stage_data
                 )
                 await db.opportunity_stages.insert_one(stage.dict())
+                inserted += 1
         
         # Insert Non-Tender stages
         for stage_data in non_tender_stages:
-            existing = await db.opportunity_stages.find_one({
-                "stage_code": stage_data["stage_code"],
-                "opportunity_type": "Non-Tender",
-                "is_deleted": False
-            })
+            existing = await stage_catalog.with_code("Non-Tender", stage_data["stage_code"])
             if not existing:
                 stage = OpportunityStage(
                     opportunity_type="Non-Tender",
                     **stage_data
                 )
                 await db.opportunity_stages.insert_one(stage.dict())
+                inserted += 1
         
         # Insert Shared stages
         for stage_data in shared_stages:
-            existing = await db.opportunity_stages.find_one({
-                "stage_code": stage_data["stage_code"],
-                "opportunity_type": "Shared",
-                "is_deleted": False
-            })
+            existing = await stage_catalog.with_code("Shared", stage_data["stage_code"])
             if not existing:
                 stage = OpportunityStage(
                     opportunity_type="Shared",
                     **stage_data
                 )
                 await db.opportunity_stages.insert_one(stage.dict())
+                inserted += 1
+        
+        if inserted:
+            await cache_bus.publish("opportunity_stages")
         
         print("Opportunity stages initialized successfully")
         
@@ -6928,12 +9278,12 @@ async def initialize_opportunity_stages():
 async def get_opportunities(current_user: User = Depends(get_current_user)):
     """Get all opportunities with enriched data"""
     try:
-        # Run auto-conversion check
-        await check_and_convert_old_leads()
-        
         # Get opportunities with enriched data
         pipeline = [
             {"$match": {"is_deleted": False}},
+            # Page first so the lookups only run for the rows returned
+            {"$sort": {"created_at": -1}},
+            {"$limit": 1000},
             # Lookup company
             {"$lookup": {
                 "from": "companies",
@@ -6942,14 +9292,6 @@ async def get_opportunities(current_user: User = Depends(get_current_user)):
                 "as": "company"
             }},
             {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            # Lookup current stage
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
             # Lookup opportunity owner
             {"$lookup": {
                 "from": "users",
@@ -6958,14 +9300,6 @@ async def get_opportunities(current_user: User = Depends(get_current_user)):
                 "as": "owner"
             }},
             {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            # Lookup currency
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
             # Lookup linked lead
             {"$lookup": {
                 "from": "leads",
@@ -6977,14 +9311,9 @@ async def get_opportunities(current_user: User = Depends(get_current_user)):
             # Add enriched fields
             {"$addFields": {
                 "company_name": "$company.company_name",
-                "current_stage_name": "$current_stage.stage_name",
-                "current_stage_code": "$current_stage.stage_code",
                 "owner_name": "$owner.name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
                 "linked_lead_id": "$linked_lead.lead_id"
-            }},
-            {"$sort": {"created_at": -1}}
+            }}
         ]
         
         opportunities_cursor = db.opportunities.aggregate(pipeline)
@@ -6994,11 +9323,11 @@ async def get_opportunities(current_user: User = Depends(get_current_user)):
         for opp in opportunities:
             opp.pop("_id", None)
             opp.pop("company", None)
-            opp.pop("current_stage", None)
             opp.pop("owner", None)
-            opp.pop("currency", None)
             opp.pop("linked_lead", None)
         
+        await resolve_foreign_keys(opportunities, [REVENUE_CURRENCY_REF, CURRENT_STAGE_REF])
+        
         return APIResponse(success=True, message="Opportunities retrieved successfully", data=opportunities)
         
     except Exception as e:
@@ -7054,18 +9383,10 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
         
         # Set initial stage
         if not opportunity_data.get("current_stage_id"):
-            initial_stage = await db.opportunity_stages.find_one({
-                "opportunity_type": opportunity_data["opportunity_type"],
-                "sequence_order": 1,
-                "is_deleted": False
-            })
+            initial_stage = await stage_catalog.at(opportunity_data["opportunity_type"], 1)
             if not initial_stage:
                 await initialize_opportunity_stages()
-                initial_stage = await db.opportunity_stages.find_one({
-                    "opportunity_type": opportunity_data["opportunity_type"],
-                    "sequence_order": 1,
-                    "is_deleted": False
-                })
+                initial_stage = await stage_catalog.at(opportunity_data["opportunity_type"], 1)
             if initial_stage:
                 opportunity_data["current_stage_id"] = initial_stage["id"]
         
@@ -7100,7 +9421,7 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
         
         # Create initial stage history entry
         if opportunity.current_stage_id:
-            stage = await db.opportunity_stages.find_one({"id": opportunity.current_stage_id})
+            stage = await stage_catalog.get(opportunity.current_stage_id, live_only=False)
             if stage:
                 stage_history = OpportunityStageHistory(
                     opportunity_id=opportunity.id,
@@ -7111,8 +9432,10 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
                 )
                 await db.opportunity_stage_history.insert_one(stage_history.dict())
         
+        await request_kpi_refresh()
+        
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created opportunity: {opportunity.opportunity_title} ({opp_id})"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Created opportunity: {opportunity.opportunity_title} ({opp_id})", entity_type="opportunity", entity_id=opportunity.id, verb="create"))
         
         return APIResponse(success=True, message="Opportunity created successfully", data={"opportunity_id": opp_id, "sr_no": sr_no})
         
@@ -7123,6 +9446,159 @@ async def create_opportunity(opportunity_data: dict, current_user: User = Depend
 
 # ===== PHASE 4: GOVERNANCE & REPORTING APIs (Specific Routes) =====
 
+# Stage names that close an opportunity
+WON_STAGE_NAMES = ["Won"]
+LOST_STAGE_NAMES = ["Lost", "Dropped"]
+QUALIFICATION_DONE_STATUSES = ["compliant", "exempted"]
+DAY_MS = 24 * 60 * 60 * 1000
+
+async def aggregate_opportunity_metrics(start: datetime, end: datetime, by_owner: bool = False) -> Dict[Optional[str], Dict[str, Any]]:
+    """Win/loss, revenue, stage and sales-cycle metrics for opportunities created in [start, end]
+
+    Two aggregations, run concurrently: one $facet over the opportunities (counts and
+    revenue per stage, sales cycles of won deals) and one over the qualifications. Stage
+    names come from the stage catalog, so nothing scales with the number of rows
+    returned to Python. Returns {None: the whole team's metrics}; with by_owner the same
+    aggregations are grouped by opportunity owner too and each owner gets an entry.
+    """
+    won_stage_ids = await stage_catalog.ids_named(WON_STAGE_NAMES)
+    owner = "$opportunity_owner_id" if by_owner else None
+
+    opportunity_pipeline = [
+        {"$match": {"created_at": {"$gte": start, "$lte": end}, "is_deleted": False}},
+        {"$facet": {
+            "by_stage": [{"$group": {
+                "_id": {"owner": owner, "stage": "$current_stage_id"},
+                "count": {"$sum": 1},
+                "revenue": {"$sum": "$expected_revenue"}
+            }}],
+            "won_cycles": [
+                {"$match": {"current_stage_id": {"$in": won_stage_ids}, "created_at": {"$ne": None}}},
+                {"$project": {"_id": 0, "id": 1, "created_at": 1, "opportunity_owner_id": 1}},
+                # Days from creation to the first move into Won; deals without one are left out
+                {"$lookup": {"from": "opportunity_stage_history", "localField": "id", "foreignField": "opportunity_id", "as": "history"}},
+                {"$unwind": "$history"},
+                {"$match": {"history.stage_name": {"$in": WON_STAGE_NAMES}}},
+                {"$group": {
+                    "_id": "$id",
+                    "opportunity_owner_id": {"$first": "$opportunity_owner_id"},
+                    "created_at": {"$first": "$created_at"},
+                    "won_at": {"$min": "$history.transition_date"}
+                }},
+                {"$group": {
+                    "_id": owner,
+                    "count": {"$sum": 1},
+                    "days": {"$sum": {"$floor": {"$divide": [{"$subtract": ["$won_at", "$created_at"]}, DAY_MS]}}}
+                }}
+            ]
+        }}
+    ]
+    qualification_pipeline = [{"$match": {"created_at": {"$gte": start, "$lte": end}}}]
+    if by_owner:
+        qualification_pipeline += [
+            {"$lookup": {"from": "opportunities", "localField": "opportunity_id", "foreignField": "id", "as": "opportunity"}},
+            {"$unwind": {"path": "$opportunity", "preserveNullAndEmptyArrays": True}},
+            {"$project": {"compliance_status": 1, "opportunity_owner_id": "$opportunity.opportunity_owner_id"}}
+        ]
+    qualification_pipeline.append({"$group": {
+        "_id": owner,
+        "total": {"$sum": 1},
+        "completed": {"$sum": {"$cond": [{"$in": ["$compliance_status", QUALIFICATION_DONE_STATUSES]}, 1, 0]}}
+    }})
+    facets, qualifications = await asyncio.gather(
+        db.opportunities.aggregate(opportunity_pipeline, allowDiskUse=True).to_list(1),
+        db.opportunity_qualifications.aggregate(qualification_pipeline, allowDiskUse=True).to_list(None)
+    )
+    facets = facets[0] if facets else {"by_stage": [], "won_cycles": []}
+
+    # Raw sums per owner (None holds unowned rows, or everything without by_owner)
+    buckets: Dict[Optional[str], Dict[str, Any]] = {}
+
+    def bucket(key):
+        return buckets.setdefault(key, empty_metric_sums())
+
+    for row in facets["by_stage"]:
+        stages = bucket(row["_id"].get("owner"))["stages"]
+        count, revenue = stages.get(row["_id"].get("stage"), (0, 0.0))
+        stages[row["_id"].get("stage")] = (count + row["count"], revenue + row["revenue"])
+    for row in facets["won_cycles"]:
+        sums = bucket(row["_id"])
+        sums["cycle_count"] += row["count"]
+        sums["cycle_days"] += row["days"]
+    for row in qualifications:
+        sums = bucket(row["_id"])
+        sums["qualifications"] += row["total"]
+        sums["completed"] += row["completed"]
+
+    team = empty_metric_sums()
+    for sums in buckets.values():
+        for stage_id, (count, revenue) in sums["stages"].items():
+            team_count, team_revenue = team["stages"].get(stage_id, (0, 0.0))
+            team["stages"][stage_id] = (team_count + count, team_revenue + revenue)
+        for field in ("cycle_count", "cycle_days", "qualifications", "completed"):
+            team[field] += sums[field]
+
+    stage_names = {}
+    for sums in [team, *buckets.values()]:
+        for stage_id in sums["stages"]:
+            if stage_id not in stage_names:
+                stage = await stage_catalog.get(stage_id, live_only=False)
+                stage_names[stage_id] = stage.get("stage_name", "Unknown") if stage else None
+
+    metrics = {None: summarize_opportunity_metrics(team, stage_names)}
+    if by_owner:
+        for owner_id, sums in buckets.items():
+            if owner_id:
+                metrics[owner_id] = summarize_opportunity_metrics(sums, stage_names)
+    return metrics
+
+def empty_metric_sums() -> Dict[str, Any]:
+    # stages: {stage_id: (count, revenue)}
+    return {"stages": {}, "cycle_count": 0, "cycle_days": 0, "qualifications": 0, "completed": 0}
+
+def summarize_opportunity_metrics(sums: Dict[str, Any], stage_names: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Turn per-stage counts and revenue, sales-cycle and qualification sums into the analytics fields"""
+    total_opportunities = 0
+    won_opportunities = lost_opportunities = 0
+    total_pipeline_value = won_revenue = lost_revenue = 0.0
+    stage_distribution: Dict[str, int] = {}
+    for stage_id, (count, revenue) in sums["stages"].items():
+        total_opportunities += count
+        total_pipeline_value += revenue
+        stage_name = stage_names.get(stage_id)
+        if not stage_name:
+            continue
+        stage_distribution[stage_name] = stage_distribution.get(stage_name, 0) + count
+        if stage_name in WON_STAGE_NAMES:
+            won_opportunities += count
+            won_revenue += revenue
+        elif stage_name in LOST_STAGE_NAMES:
+            lost_opportunities += count
+            lost_revenue += revenue
+
+    closed_opportunities = won_opportunities + lost_opportunities
+    return {
+        "total_opportunities": total_opportunities,
+        "new_opportunities": total_opportunities,
+        "closed_opportunities": closed_opportunities,
+        "won_opportunities": won_opportunities,
+        "lost_opportunities": lost_opportunities,
+        "total_pipeline_value": round(total_pipeline_value, 2),
+        "won_revenue": round(won_revenue, 2),
+        "lost_revenue": round(lost_revenue, 2),
+        "average_deal_size": round(total_pipeline_value / total_opportunities, 2) if total_opportunities else 0,
+        "win_rate": round(won_opportunities / closed_opportunities * 100, 2) if closed_opportunities else 0,
+        "loss_rate": round(lost_opportunities / closed_opportunities * 100, 2) if closed_opportunities else 0,
+        "average_sales_cycle": round(sums["cycle_days"] / sums["cycle_count"]) if sums["cycle_count"] else 0,
+        "sales_cycle_count": sums["cycle_count"],
+        "qualification_completion_rate": round(sums["completed"] / sums["qualifications"] * 100, 2) if sums["qualifications"] else 0,
+        "stage_distribution": stage_distribution
+    }
+
+async def compute_opportunity_analytics(start: datetime, end: datetime) -> Dict[str, Any]:
+    """The whole team's metrics for opportunities created in [start, end]"""
+    return (await aggregate_opportunity_metrics(start, end))[None]
+
 # Analytics and KPI Endpoints
 @api_router.get("/opportunities/analytics", response_model=APIResponse)
 @require_permission("/opportunities", "view")
@@ -7150,94 +9626,14 @@ async def get_opportunity_analytics(
             start_date_obj = datetime.fromisoformat(start_date)
             end_date_obj = datetime.fromisoformat(end_date)
         
-        # Get opportunities in the date range
-        opportunities_cursor = db.opportunities.find({
-            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj},
-            "is_deleted": False
-        })
-        opportunities = await opportunities_cursor.to_list(1000)
-        
-        # Calculate metrics
-        total_opportunities = len(opportunities)
-        new_opportunities = total_opportunities
-        
-        # Won/Lost opportunities (based on stage)
-        won_opportunities = 0
-        lost_opportunities = 0
-        total_pipeline_value = 0.0
-        won_revenue = 0.0
-        lost_revenue = 0.0
-        
-        stage_distribution = {}
-        sales_cycles = []
-        
-        for opp in opportunities:
-            # Calculate pipeline value
-            if opp.get("expected_revenue"):
-                total_pipeline_value += float(opp["expected_revenue"])
-            
-            # Get current stage
-            current_stage = await db.opportunity_stages.find_one({"id": opp.get("current_stage_id")})
-            if current_stage:
-                stage_name = current_stage.get("stage_name", "Unknown")
-                stage_distribution[stage_name] = stage_distribution.get(stage_name, 0) + 1
-                
-                # Check if Won or Lost
-                if stage_name == "Won":
-                    won_opportunities += 1
-                    if opp.get("expected_revenue"):
-                        won_revenue += float(opp["expected_revenue"])
-                elif stage_name in ["Lost", "Dropped"]:
-                    lost_opportunities += 1
-                    if opp.get("expected_revenue"):
-                        lost_revenue += float(opp["expected_revenue"])
-            
-            # Calculate sales cycle
-            if opp.get("created_at") and current_stage and stage_name == "Won":
-                # Get stage history to find when it was won
-                stage_history = await db.opportunity_stage_history.find_one({
-                    "opportunity_id": opp["id"],
-                    "stage_name": "Won"
-                })
-                if stage_history:
-                    cycle_days = (stage_history["transition_date"] - opp["created_at"]).days
-                    sales_cycles.append(cycle_days)
-        
-        # Calculate derived metrics
-        closed_opportunities = won_opportunities + lost_opportunities
-        win_rate = (won_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
-        loss_rate = (lost_opportunities / closed_opportunities * 100) if closed_opportunities > 0 else 0
-        average_deal_size = total_pipeline_value / total_opportunities if total_opportunities > 0 else 0
-        average_sales_cycle = sum(sales_cycles) / len(sales_cycles) if sales_cycles else 0
-        
-        # Get qualification metrics
-        qualification_cursor = db.opportunity_qualifications.find({
-            "created_at": {"$gte": start_date_obj, "$lte": end_date_obj}
-        })
-        qualifications = await qualification_cursor.to_list(1000)
-        
-        completed_qualifications = len([q for q in qualifications if q.get("compliance_status") in ["compliant", "exempted"]])
-        qualification_completion_rate = (completed_qualifications / len(qualifications) * 100) if qualifications else 0
+        metrics = await compute_opportunity_analytics(start_date_obj, end_date_obj)
         
         # Create analytics response
         analytics_data = {
             "period": period,
             "period_start": start_date_obj.isoformat(),
             "period_end": end_date_obj.isoformat(),
-            "total_opportunities": total_opportunities,
-            "new_opportunities": new_opportunities,
-            "closed_opportunities": closed_opportunities,
-            "won_opportunities": won_opportunities,
-            "lost_opportunities": lost_opportunities,
-            "total_pipeline_value": round(total_pipeline_value, 2),
-            "won_revenue": round(won_revenue, 2),
-            "lost_revenue": round(lost_revenue, 2),
-            "average_deal_size": round(average_deal_size, 2),
-            "win_rate": round(win_rate, 2),
-            "loss_rate": round(loss_rate, 2),
-            "average_sales_cycle": round(average_sales_cycle),
-            "qualification_completion_rate": round(qualification_completion_rate, 2),
-            "stage_distribution": stage_distribution,
+            **metrics,
             "generated_at": datetime.now(timezone.utc).isoformat()
         }
         
@@ -7246,88 +9642,213 @@ async def get_opportunity_analytics(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# KPI snapshots
+KPI_PERIODS = ["daily", "weekly", "monthly", "quarterly", "yearly"]
+KPI_REFRESH_INTERVAL_SECONDS = int(os.environ.get('KPI_REFRESH_INTERVAL_SECONDS', '900'))
+KPI_REFRESH_DELAY_SECONDS = 30  # writes within this window share one refresh
+KPI_HISTORY_LIMIT = 24
+KPI_TREND_THRESHOLD = 0.01  # relative change below which a KPI counts as stable
+
+KPI_DEFINITIONS = [
+    {
+        "kpi_name": "Win Rate",
+        "kpi_code": "WIN_RATE",
+        "kpi_category": "performance",
+        "kpi_description": "Percentage of opportunities won vs total closed opportunities",
+        "target_value": 25.0,  # 25% target win rate
+        "metric": "win_rate",
+        "unit": "%"
+    },
+    {
+        "kpi_name": "Average Deal Size",
+        "kpi_code": "AVG_DEAL_SIZE",
+        "kpi_category": "performance",
+        "kpi_description": "Average value of opportunities in pipeline",
+        "target_value": 500000.0,  # 5L target average deal size
+        "metric": "average_deal_size",
+        "unit": "INR"
+    },
+    {
+        "kpi_name": "Sales Cycle Time",
+        "kpi_code": "SALES_CYCLE",
+        "kpi_category": "efficiency",
+        "kpi_description": "Average number of days from opportunity creation to closure",
+        "target_value": 90.0,  # 90 days target
+        "metric": "average_sales_cycle",
+        "unit": "days",
+        "lower_is_better": True
+    },
+    {
+        "kpi_name": "Qualification Completion Rate",
+        "kpi_code": "QUAL_COMPLETION",
+        "kpi_category": "quality",
+        "kpi_description": "Percentage of opportunities with completed qualification",
+        "target_value": 95.0,  # 95% target
+        "metric": "qualification_completion_rate",
+        "unit": "%"
+    },
+    {
+        "kpi_name": "Pipeline Value",
+        "kpi_code": "PIPELINE_VALUE",
+        "kpi_category": "performance",
+        "kpi_description": "Total value of all active opportunities",
+        "target_value": 10000000.0,  # 1Cr target pipeline
+        "metric": "total_pipeline_value",
+        "unit": "INR"
+    }
+]
+
+def kpi_period_start(period: str, moment: datetime) -> datetime:
+    """Start (UTC midnight) of the calendar day, week, month, quarter or year holding moment"""
+    day = moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "daily":
+        return day
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    if period == "monthly":
+        return day.replace(day=1)
+    if period == "quarterly":
+        return day.replace(month=((day.month - 1) // 3) * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+def kpi_previous_window(period: str, start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """The previous period cut at the same elapsed offset as [start, end), for a like-for-like trend"""
+    previous_start = kpi_period_start(period, start - timedelta(days=1))
+    return previous_start, min(previous_start + (end - start), start)
+
+def build_kpi_snapshot(period: str, start: datetime, end: datetime, owner_id: Optional[str],
+                       metrics: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> OpportunityKPISnapshot:
+    """KPIs with variance, status and a trend against previous, the metrics of kpi_previous_window"""
+    kpis = []
+    for definition in KPI_DEFINITIONS:
+        actual_value = float(metrics.get(definition["metric"]) or 0)
+        target_value = definition["target_value"]
+        variance = actual_value - target_value
+        variance_percentage = (variance / target_value * 100) if target_value != 0 else 0
+        
+        # Determine performance status
+        variance_pct = abs(variance_percentage)
+        if actual_value >= target_value:
+            performance_status = "exceeded" if variance_pct > 10 else "on_track"
+        elif variance_pct <= 5:
+            performance_status = "on_track"
+        elif variance_pct <= 15:
+            performance_status = "at_risk"
+        else:
+            performance_status = "critical"
+        
+        trend = "stable"
+        previous_value = float(previous.get(definition["metric"]) or 0) if previous is not None else None
+        if previous_value is not None and abs(actual_value - previous_value) > abs(previous_value) * KPI_TREND_THRESHOLD:
+            rising = actual_value > previous_value
+            trend = "improving" if rising != definition.get("lower_is_better", False) else "declining"
+        
+        kpis.append(OpportunityKPI(
+            kpi_name=definition["kpi_name"],
+            kpi_code=definition["kpi_code"],
+            kpi_category=definition["kpi_category"],
+            kpi_description=definition["kpi_description"],
+            measurement_period=period,
+            target_value=target_value,
+            actual_value=actual_value,
+            unit=definition["unit"],
+            variance=variance,
+            variance_percentage=variance_percentage,
+            performance_status=performance_status,
+            trend=trend,
+            period_start=start,
+            period_end=end,
+            owner_id=owner_id,
+            calculation_method="aggregate_opportunity_metrics",
+            data_sources="opportunities, opportunity_stage_history, opportunity_qualifications",
+            calculated_at=end,
+            calculated_by="system",
+            created_at=end
+        ))
+    return OpportunityKPISnapshot(measurement_period=period, period_start=start, period_end=end, owner_id=owner_id,
+                                  metrics=metrics, kpis=kpis, calculated_at=end)
+
+async def refresh_opportunity_kpis(now: Optional[datetime] = None) -> int:
+    """Recompute the current snapshot of every period for the team and each owner; returns how many were written"""
+    now = now or datetime.now(timezone.utc)
+    starts = {period: kpi_period_start(period, now) for period in KPI_PERIODS}
+    # Running totals such as pipeline value only compare with the same stretch of the previous period
+    windows = [(start, now) for start in starts.values()]
+    windows += [kpi_previous_window(period, start, now) for period, start in starts.items()]
+    results = await asyncio.gather(*(aggregate_opportunity_metrics(*window, by_owner=True) for window in windows))
+    current, previous = results[:len(starts)], results[len(starts):]
+    # Owners active in any period get a snapshot in every period, so their latest one is current
+    owners = set().union(*(metrics.keys() for metrics in current))
+    
+    writes = []
+    empty = summarize_opportunity_metrics(empty_metric_sums(), {})
+    for (period, start), metrics_by_owner, previous_by_owner in zip(starts.items(), current, previous):
+        for owner_id in owners:
+            snapshot = build_kpi_snapshot(period, start, now, owner_id, metrics_by_owner.get(owner_id) or empty,
+                                          previous_by_owner.get(owner_id)).dict()
+            snapshot_id = snapshot.pop("id")
+            writes.append(UpdateOne(
+                {"measurement_period": period, "owner_id": owner_id, "period_start": start},
+                {"$set": snapshot, "$setOnInsert": {"id": snapshot_id}},
+                upsert=True
+            ))
+    for chunk_start in range(0, len(writes), 1000):
+        await db.opportunity_kpis.bulk_write(writes[chunk_start:chunk_start + 1000], ordered=False)
+    return len(writes)
+
+kpi_snapshot_schedule = ScheduledTask("opportunity_kpis", refresh_opportunity_kpis, KPI_REFRESH_INTERVAL_SECONDS)
+scheduled_tasks.append(kpi_snapshot_schedule)
+
+async def request_kpi_refresh():
+    """Called after writes that move the KPIs; the next refresh runs within KPI_REFRESH_DELAY_SECONDS"""
+    await kpi_snapshot_schedule.trigger(KPI_REFRESH_DELAY_SECONDS)
+
 @api_router.get("/opportunities/kpis", response_model=APIResponse)
 @require_permission("/opportunities", "view")
-async def get_opportunity_kpis(current_user: User = Depends(get_current_user)):
-    """Get all opportunity KPIs with current values"""
+async def get_opportunity_kpis(period: str = "monthly", owner_id: Optional[str] = None,
+                               current_user: User = Depends(get_current_user)):
+    """Get the latest KPI snapshot of a period, for the whole team or one opportunity owner"""
     try:
-        # Get current period analytics for KPI calculation
-        analytics_response = await get_opportunity_analytics("monthly", None, None, current_user)
-        analytics_data = analytics_response.data
+        if period not in KPI_PERIODS:
+            raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(KPI_PERIODS)}")
         
-        # Define standard KPIs with targets
-        kpis = [
-            {
-                "kpi_name": "Win Rate",
-                "kpi_code": "WIN_RATE",
-                "kpi_category": "performance",
-                "kpi_description": "Percentage of opportunities won vs total closed opportunities",
-                "target_value": 25.0,  # 25% target win rate
-                "actual_value": analytics_data.get("win_rate", 0),
-                "unit": "%"
-            },
-            {
-                "kpi_name": "Average Deal Size",
-                "kpi_code": "AVG_DEAL_SIZE",
-                "kpi_category": "performance",
-                "kpi_description": "Average value of opportunities in pipeline",
-                "target_value": 500000.0,  # 5L target average deal size
-                "actual_value": analytics_data.get("average_deal_size", 0),
-                "unit": "INR"
-            },
-            {
-                "kpi_name": "Sales Cycle Time",
-                "kpi_code": "SALES_CYCLE",
-                "kpi_category": "efficiency",
-                "kpi_description": "Average number of days from opportunity creation to closure",
-                "target_value": 90.0,  # 90 days target
-                "actual_value": analytics_data.get("average_sales_cycle", 0),
-                "unit": "days"
-            },
-            {
-                "kpi_name": "Qualification Completion Rate",
-                "kpi_code": "QUAL_COMPLETION",
-                "kpi_category": "quality",
-                "kpi_description": "Percentage of opportunities with completed qualification",
-                "target_value": 95.0,  # 95% target
-                "actual_value": analytics_data.get("qualification_completion_rate", 0),
-                "unit": "%"
-            },
-            {
-                "kpi_name": "Pipeline Value",
-                "kpi_code": "PIPELINE_VALUE",
-                "kpi_category": "performance",
-                "kpi_description": "Total value of all active opportunities",
-                "target_value": 10000000.0,  # 1Cr target pipeline
-                "actual_value": analytics_data.get("total_pipeline_value", 0),
-                "unit": "INR"
-            }
-        ]
+        snapshot = await db.opportunity_kpis.find_one(
+            {"measurement_period": period, "owner_id": owner_id}, {"_id": 0}, sort=[("period_start", -1)]
+        )
+        if snapshot is None:
+            # Nothing materialized yet: compute this one now and let the schedule catch up
+            await request_kpi_refresh()
+            now = datetime.now(timezone.utc)
+            start = kpi_period_start(period, now)
+            metrics = (await aggregate_opportunity_metrics(start, now, by_owner=bool(owner_id))).get(owner_id)
+            snapshot = build_kpi_snapshot(period, start, now, owner_id, metrics or {}, None).dict()
         
-        # Calculate variance and performance status for each KPI
-        for kpi in kpis:
-            kpi["variance"] = kpi["actual_value"] - kpi["target_value"]
-            kpi["variance_percentage"] = (kpi["variance"] / kpi["target_value"] * 100) if kpi["target_value"] != 0 else 0
-            
-            # Determine performance status
-            variance_pct = abs(kpi["variance_percentage"])
-            if kpi["actual_value"] >= kpi["target_value"]:
-                kpi["performance_status"] = "exceeded" if variance_pct > 10 else "on_track"
-            else:
-                if variance_pct <= 5:
-                    kpi["performance_status"] = "on_track"
-                elif variance_pct <= 15:
-                    kpi["performance_status"] = "at_risk"
-                else:
-                    kpi["performance_status"] = "critical"
-            
-            # Add period information
-            kpi["period_start"] = analytics_data["period_start"]
-            kpi["period_end"] = analytics_data["period_end"]
-            kpi["calculated_at"] = datetime.now(timezone.utc).isoformat()
+        return APIResponse(success=True, message="KPIs calculated successfully", data=snapshot["kpis"])
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/opportunities/kpis/history", response_model=APIResponse)
+@require_permission("/opportunities", "view")
+async def get_opportunity_kpi_history(period: str = "monthly", owner_id: Optional[str] = None,
+                                      limit: int = 12, current_user: User = Depends(get_current_user)):
+    """Get the stored KPI snapshots of past periods, oldest first, for trend charts"""
+    try:
+        if period not in KPI_PERIODS:
+            raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(KPI_PERIODS)}")
+        limit = max(1, min(limit, KPI_HISTORY_LIMIT))
+        
+        snapshots = await db.opportunity_kpis.find(
+            {"measurement_period": period, "owner_id": owner_id}, {"_id": 0}
+        ).sort("period_start", -1).limit(limit).to_list(limit)
+        snapshots.reverse()
         
-        return APIResponse(success=True, message="KPIs calculated successfully", data=kpis)
+        return APIResponse(success=True, message="KPI history retrieved successfully", data=snapshots)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -7337,6 +9858,8 @@ async def get_opportunity_kpis(current_user: User = Depends(get_current_user)):
 async def get_team_performance(current_user: User = Depends(get_current_user)):
     """Get team performance metrics"""
     try:
+        won_stage_ids = await stage_catalog.ids_named(WON_STAGE_NAMES)
+        
         # Get all opportunities with owner information
         pipeline = [
             {"$match": {"is_deleted": False}},
@@ -7347,13 +9870,6 @@ async def get_team_performance(current_user: User = Depends(get_current_user)):
                 "as": "owner"
             }},
             {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
             {"$group": {
                 "_id": "$opportunity_owner_id",
                 "owner_name": {"$first": "$owner.name"},
@@ -7362,12 +9878,12 @@ async def get_team_performance(current_user: User = Depends(get_current_user)):
                 "total_pipeline_value": {"$sum": "$expected_revenue"},
                 "won_opportunities": {
                     "$sum": {
-                        "$cond": [{"$eq": ["$current_stage.stage_name", "Won"]}, 1, 0]
+                        "$cond": [{"$in": ["$current_stage_id", won_stage_ids]}, 1, 0]
                     }
                 },
                 "won_revenue": {
                     "$sum": {
-                        "$cond": [{"$eq": ["$current_stage.stage_name", "Won"]}, "$expected_revenue", 0]
+                        "$cond": [{"$in": ["$current_stage_id", won_stage_ids]}, "$expected_revenue", 0]
                     }
                 }
             }},
@@ -7435,13 +9951,6 @@ async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_
                 "as": "company"
             }},
             {"$unwind": {"path": "$company", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "current_stage_id",
-                "foreignField": "id",
-                "as": "current_stage"
-            }},
-            {"$unwind": {"path": "$current_stage", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "users",
                 "localField": "opportunity_owner_id",
@@ -7449,13 +9958,6 @@ async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_
                 "as": "owner"
             }},
             {"$unwind": {"path": "$owner", "preserveNullAndEmptyArrays": True}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "revenue_currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "leads",
                 "localField": "lead_id",
@@ -7465,11 +9967,7 @@ async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_
             {"$unwind": {"path": "$linked_lead", "preserveNullAndEmptyArrays": True}},
             {"$addFields": {
                 "company_name": "$company.company_name",
-                "current_stage_name": "$current_stage.stage_name",
-                "current_stage_code": "$current_stage.stage_code",
                 "owner_name": "$owner.name",
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
                 "linked_lead_id": "$linked_lead.lead_id"
             }}
         ]
@@ -7483,10 +9981,9 @@ async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_
         opportunity = opportunities[0]
         opportunity.pop("_id", None)
         opportunity.pop("company", None)
-        opportunity.pop("current_stage", None)
         opportunity.pop("owner", None)
-        opportunity.pop("currency", None)
         opportunity.pop("linked_lead", None)
+        await resolve_foreign_keys([opportunity], [REVENUE_CURRENCY_REF, CURRENT_STAGE_REF])
         
         return APIResponse(success=True, message="Opportunity retrieved successfully", data=opportunity)
         
@@ -7499,15 +9996,26 @@ async def get_opportunity(opportunity_id: str, current_user: User = Depends(get_
 @api_router.post("/opportunities/auto-convert", response_model=APIResponse)
 @require_permission("/opportunities", "create")
 async def manual_auto_convert_leads(current_user: User = Depends(get_current_user)):
-    """Manually trigger auto-conversion of old approved leads"""
+    """Make the scheduled auto-conversion of old approved leads run now and wait briefly for it"""
     try:
-        converted_count = await check_and_convert_old_leads()
+        requested_at = await auto_convert_schedule.trigger()
+        state = await auto_convert_schedule.wait_for_run(requested_at, AUTO_CONVERT_TRIGGER_WAIT_SECONDS)
+        
+        if state is None:
+            await log_activity(ActivityLog(user_id=current_user.id, action="Manual auto-conversion requested", entity_type="opportunity", verb="convert"))
+            return APIResponse(success=True, message="Auto-conversion scheduled; it will finish in the background.", data={"status": "scheduled", "converted_count": None})
+        if state.get("last_error"):
+            raise HTTPException(status_code=500, detail=f"Auto-conversion failed: {state['last_error']}")
+        
+        converted_count = state["last_result"]
         
         # Log activity
-        await log_activity(ActivityLog(user_id=current_user.id, action=f"Manual auto-conversion: {converted_count} leads converted to opportunities"))
+        await log_activity(ActivityLog(user_id=current_user.id, action=f"Manual auto-conversion: {converted_count} leads converted to opportunities", entity_type="opportunity", verb="convert"))
         
-        return APIResponse(success=True, message=f"Auto-conversion completed. {converted_count} leads converted to opportunities.", data={"converted_count": converted_count})
+        return APIResponse(success=True, message=f"Auto-conversion completed. {converted_count} leads converted to opportunities.", data={"status": "completed", "converted_count": converted_count})
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -7525,19 +10033,7 @@ async def get_opportunity_stages(opportunity_id: str, current_user: User = Depen
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
         # Get stages for this opportunity type + shared stages
-        stages_cursor = db.opportunity_stages.find({
-            "$or": [
-                {"opportunity_type": opportunity["opportunity_type"]},
-                {"opportunity_type": "Shared"}
-            ],
-            "is_deleted": False
-        }).sort("sequence_order", 1)
-        
-        stages = await stages_cursor.to_list(100)
-        
-        # Remove MongoDB _id field
-        for stage in stages:
-            stage.pop("_id", None)
+        stages = (await stage_catalog.for_type(opportunity["opportunity_type"]))[:100]
         
         return APIResponse(success=True, message="Opportunity stages retrieved successfully", data=stages)
         
@@ -7588,6 +10084,20 @@ async def get_stage_history(opportunity_id: str, current_user: User = Depends(ge
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def load_rule_compliance(opportunity_id: str, rule_ids: List[str]) -> Dict[str, dict]:
+    """Active compliance records of an opportunity keyed by rule_id, in one query"""
+    if not rule_ids:
+        return {}
+    records = await db.opportunity_qualifications.find({
+        "opportunity_id": opportunity_id,
+        "rule_id": {"$in": rule_ids},
+        "is_active": True
+    }).to_list(None)
+    compliance_by_rule = {}
+    for record in records:
+        compliance_by_rule.setdefault(record["rule_id"], record)
+    return compliance_by_rule
+
 # Get qualification rules for opportunity
 @api_router.get("/opportunities/{opportunity_id}/qualification-rules", response_model=APIResponse)
 @require_permission("/opportunities", "view")
@@ -7612,16 +10122,11 @@ async def get_qualification_rules(opportunity_id: str, current_user: User = Depe
         rules = await rules_cursor.to_list(100)
         
         # Get current compliance status for each rule
+        compliance_by_rule = await load_rule_compliance(opportunity_id, [rule["id"] for rule in rules])
         for rule in rules:
             rule.pop("_id", None)
             
-            # Get compliance status
-            compliance = await db.opportunity_qualifications.find_one({
-                "opportunity_id": opportunity_id,
-                "rule_id": rule["id"],
-                "is_active": True
-            })
-            
+            compliance = compliance_by_rule.get(rule["id"])
             rule["compliance_status"] = compliance.get("compliance_status", "pending") if compliance else "pending"
             rule["compliance_notes"] = compliance.get("compliance_notes", "") if compliance else ""
             rule["reviewed_at"] = compliance.get("reviewed_at") if compliance else None
@@ -7701,11 +10206,15 @@ async def update_qualification_compliance(
                 **update_data
             )
             await db.opportunity_qualifications.insert_one(qualification.dict())
+        await request_kpi_refresh()
         
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id, 
-            action=f"Updated qualification rule {rule['rule_code']} for opportunity {opportunity['opportunity_id']}: {compliance_status}"
+            action=f"Updated qualification rule {rule['rule_code']} for opportunity {opportunity['opportunity_id']}: {compliance_status}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="update"
         ))
         
         return APIResponse(success=True, message="Qualification compliance updated successfully")
@@ -7755,12 +10264,9 @@ async def check_qualification_status(opportunity_id: str, current_user: User = D
         pending_rules = []
         non_compliant_rules = []
         
+        compliance_by_rule = await load_rule_compliance(opportunity_id, [rule["id"] for rule in mandatory_rules])
         for rule in mandatory_rules:
-            compliance = await db.opportunity_qualifications.find_one({
-                "opportunity_id": opportunity_id,
-                "rule_id": rule["id"],
-                "is_active": True
-            })
+            compliance = compliance_by_rule.get(rule["id"])
             
             if compliance:
                 status = compliance.get("compliance_status", "pending")
@@ -7836,12 +10342,12 @@ async def transition_opportunity_stage(
         if not target_stage_id:
             raise HTTPException(status_code=400, detail="Target stage ID is required")
         
-        target_stage = await db.opportunity_stages.find_one({"id": target_stage_id, "is_deleted": False})
+        target_stage = await stage_catalog.get(target_stage_id)
         if not target_stage:
             raise HTTPException(status_code=404, detail="Target stage not found")
         
         # Get current stage
-        current_stage = await db.opportunity_stages.find_one({"id": opportunity["current_stage_id"], "is_deleted": False})
+        current_stage = await stage_catalog.get(opportunity["current_stage_id"])
         
         # Validate stage transition rules
         # 1. Can't go backwards (except for specific cases)
@@ -7863,7 +10369,10 @@ async def transition_opportunity_stage(
                 # Log executive override
                 await log_activity(ActivityLog(
                     user_id=current_user.id,
-                    action=f"Executive override for stage transition: {opportunity['opportunity_id']} - Qualification incomplete but overridden"
+                    action=f"Executive override for stage transition: {opportunity['opportunity_id']} - Qualification incomplete but overridden",
+                    entity_type="opportunity",
+                    entity_id=opportunity_id,
+                    verb="override"
                 ))
         
         # 3. Tender-specific validations for L5 (Commercial Evaluation)
@@ -7936,13 +10445,14 @@ async def transition_opportunity_stage(
         )
         
         await db.opportunity_stage_history.insert_one(stage_history.dict())
+        await request_kpi_refresh()
         
         # Log activity
         stage_transition_msg = f"Transitioned opportunity {opportunity['opportunity_id']} to {target_stage['stage_name']} ({target_stage['stage_code']})"
         if transition_data.get("executive_override"):
             stage_transition_msg += " [Executive Override]"
         
-        await log_activity(ActivityLog(user_id=current_user.id, action=stage_transition_msg))
+        await log_activity(ActivityLog(user_id=current_user.id, action=stage_transition_msg, entity_type="opportunity", entity_id=opportunity_id, verb="transition"))
         
         return APIResponse(success=True, message=f"Opportunity transitioned to {target_stage['stage_name']} successfully")
         
@@ -7967,13 +10477,6 @@ async def get_opportunity_documents(opportunity_id: str, current_user: User = De
         # Get documents with enriched data
         pipeline = [
             {"$match": {"opportunity_id": opportunity_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "master_document_types",
-                "localField": "document_type_id",
-                "foreignField": "document_type_id",
-                "as": "document_type"
-            }},
-            {"$unwind": {"path": "$document_type", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "users",
                 "localField": "created_by",
@@ -7989,7 +10492,6 @@ async def get_opportunity_documents(opportunity_id: str, current_user: User = De
             }},
             {"$unwind": {"path": "$approver", "preserveNullAndEmptyArrays": True}},
             {"$addFields": {
-                "document_type_name": "$document_type.document_type_name",
                 "created_by_name": "$creator.name",
                 "approved_by_name": "$approver.name"
             }},
@@ -8001,10 +10503,11 @@ async def get_opportunity_documents(opportunity_id: str, current_user: User = De
         
         for document in documents:
             document.pop("_id", None)
-            document.pop("document_type", None)
             document.pop("creator", None)
             document.pop("approver", None)
         
+        await resolve_foreign_keys(documents, [DOCUMENT_TYPE_REF])
+        
         return APIResponse(success=True, message="Opportunity documents retrieved successfully", data=documents)
         
     except HTTPException:
@@ -8049,7 +10552,10 @@ async def create_opportunity_document(opportunity_id: str, document_data: dict,
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added document '{document.document_name}' v{document.version} to opportunity {opportunity['opportunity_id']}"
+            action=f"Added document '{document.document_name}' v{document.version} to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="Document created successfully", data={"document_id": document.id})
@@ -8091,7 +10597,10 @@ async def update_opportunity_document(opportunity_id: str, document_id: str, doc
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Updated document '{existing_doc['document_name']}' in opportunity {opportunity_id}"
+            action=f"Updated document '{existing_doc['document_name']}' in opportunity {opportunity_id}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="update"
         ))
         
         return APIResponse(success=True, message="Document updated successfully")
@@ -8185,7 +10694,10 @@ async def create_opportunity_clause(opportunity_id: str, clause_data: dict, curr
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added clause '{clause.clause_type}' to opportunity {opportunity['opportunity_id']}"
+            action=f"Added clause '{clause.clause_type}' to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="Clause created successfully", data={"clause_id": clause.id})
@@ -8267,7 +10779,10 @@ async def create_opportunity_important_date(opportunity_id: str, date_data: dict
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added important date '{important_date.date_type}' to opportunity {opportunity['opportunity_id']}"
+            action=f"Added important date '{important_date.date_type}' to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="Important date created successfully", data={"date_id": important_date.id})
@@ -8291,13 +10806,6 @@ async def get_opportunity_won_details(opportunity_id: str, current_user: User =
         # Get won details with enriched data
         pipeline = [
             {"$match": {"opportunity_id": opportunity_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "master_currencies",
-                "localField": "currency_id",
-                "foreignField": "currency_id",
-                "as": "currency"
-            }},
-            {"$unwind": {"path": "$currency", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "users",
                 "localField": "signed_by",
@@ -8313,8 +10821,6 @@ async def get_opportunity_won_details(opportunity_id: str, current_user: User =
             }},
             {"$unwind": {"path": "$approver", "preserveNullAndEmptyArrays": True}},
             {"$addFields": {
-                "currency_code": "$currency.currency_code",
-                "currency_symbol": "$currency.symbol",
                 "signed_by_name": "$signer.name",
                 "approved_by_name": "$approver.name"
             }}
@@ -8326,9 +10832,12 @@ async def get_opportunity_won_details(opportunity_id: str, current_user: User =
         if won_details:
             won_detail = won_details[0]
             won_detail.pop("_id", None)
-            won_detail.pop("currency", None)
             won_detail.pop("signer", None)
             won_detail.pop("approver", None)
+            await resolve_foreign_keys([won_detail], [
+                ForeignKey("currency_id", "master_currencies", key="currency_id", live_only=False, missing=None,
+                           display={"currency_code": "currency_code", "currency_symbol": "symbol"})
+            ])
         else:
             won_detail = None
         
@@ -8350,7 +10859,7 @@ async def create_opportunity_won_details(opportunity_id: str, won_data: dict, cu
             raise HTTPException(status_code=404, detail="Opportunity not found")
         
         # Get current stage to verify it's Won stage
-        current_stage = await db.opportunity_stages.find_one({"id": opportunity["current_stage_id"]})
+        current_stage = await stage_catalog.get(opportunity["current_stage_id"], live_only=False)
         if not current_stage or current_stage.get("stage_name") != "Won":
             raise HTTPException(status_code=400, detail="Won details can only be captured for opportunities in Won stage")
         
@@ -8389,7 +10898,10 @@ async def create_opportunity_won_details(opportunity_id: str, won_data: dict, cu
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added won details (Quotation: {won_details.quotation_id}) to opportunity {opportunity['opportunity_id']}"
+            action=f"Added won details (Quotation: {won_details.quotation_id}) to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="Won details created successfully", data={"won_details_id": won_details.id})
@@ -8509,7 +11021,10 @@ async def create_opportunity_order_analysis(opportunity_id: str, analysis_data:
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added order analysis (PO: {order_analysis.po_number}) to opportunity {opportunity['opportunity_id']}"
+            action=f"Added order analysis (PO: {order_analysis.po_number}) to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="Order analysis created successfully", data={"analysis_id": order_analysis.id})
@@ -8533,13 +11048,6 @@ async def get_sl_process_tracking(opportunity_id: str, current_user: User = Depe
         # Get SL tracking activities with enriched data
         pipeline = [
             {"$match": {"opportunity_id": opportunity_id, "is_deleted": False}},
-            {"$lookup": {
-                "from": "opportunity_stages",
-                "localField": "stage_id",
-                "foreignField": "id",
-                "as": "stage"
-            }},
-            {"$unwind": {"path": "$stage", "preserveNullAndEmptyArrays": True}},
             {"$lookup": {
                 "from": "users",
                 "localField": "assigned_to",
@@ -8548,8 +11056,6 @@ async def get_sl_process_tracking(opportunity_id: str, current_user: User = Depe
             }},
             {"$unwind": {"path": "$assignee", "preserveNullAndEmptyArrays": True}},
             {"$addFields": {
-                "stage_name": "$stage.stage_name",
-                "stage_code": "$stage.stage_code",
                 "assigned_to_name": "$assignee.name"
             }},
             {"$sort": {"created_at": 1}}
@@ -8560,8 +11066,8 @@ async def get_sl_process_tracking(opportunity_id: str, current_user: User = Depe
         
         for activity in tracking_activities:
             activity.pop("_id", None)
-            activity.pop("stage", None)
             activity.pop("assignee", None)
+        await resolve_foreign_keys(tracking_activities, [SL_STAGE_REF])
         
         return APIResponse(success=True, message="SL process tracking retrieved successfully", data=tracking_activities)
         
@@ -8593,7 +11099,10 @@ async def create_sl_process_activity(opportunity_id: str, activity_data: dict, c
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Added SL activity '{sl_activity.activity_name}' to opportunity {opportunity['opportunity_id']}"
+            action=f"Added SL activity '{sl_activity.activity_name}' to opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="add"
         ))
         
         return APIResponse(success=True, message="SL process activity created successfully", data={"activity_id": sl_activity.id})
@@ -8651,8 +11160,9 @@ async def get_opportunity_audit_log(opportunity_id: str, current_user: User = De
         
         # Also get activity logs (existing system)
         activity_logs = await db.activity_logs.find({
-            "action": {"$regex": opportunity.get("opportunity_id", ""), "$options": "i"}
-        }).sort("created_at", -1).to_list(100)
+            "entity_type": "opportunity",
+            "entity_id": opportunity_id
+        }).sort("timestamp", -1).to_list(100)
         
         for log in activity_logs:
             log.pop("_id", None)
@@ -8809,7 +11319,10 @@ async def create_digital_signature(opportunity_id: str, signature_data: dict, cu
         # Log activity
         await log_activity(ActivityLog(
             user_id=current_user.id,
-            action=f"Digital signature added for {digital_signature.document_type} in opportunity {opportunity['opportunity_id']}"
+            action=f"Digital signature added for {digital_signature.document_type} in opportunity {opportunity['opportunity_id']}",
+            entity_type="opportunity",
+            entity_id=opportunity_id,
+            verb="sign"
         ))
         
         return APIResponse(success=True, message="Digital signature recorded successfully", data={"signature_id": digital_signature.id})
@@ -8819,6 +11332,232 @@ async def create_digital_signature(opportunity_id: str, signature_data: dict, cu
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Index registry
+class IndexSpec:
+    """A declared index; partial indexes only cover live (is_deleted: false) documents"""
+
+    def __init__(self, collection: str, keys, unique: bool = False, partial: bool = False,
+                 expire_after_seconds: Optional[int] = None):
+        self.collection = collection
+        self.keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        self.unique = unique
+        self.partial = partial
+        self.expire_after_seconds = expire_after_seconds
+        # Mongo's default name, suffixed for partial indexes so they never collide with a full one
+        self.name = "_".join(f"{field}_{direction}" for field, direction in self.keys) + ("_live" if partial else "")
+
+    def options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.partial:
+            options["partialFilterExpression"] = {"is_deleted": False}
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return options
+
+    def matches(self, actual: dict) -> bool:
+        """Whether an entry from index_information() has the declared keys and options"""
+        keys = [(field, int(direction)) for field, direction in actual.get("key", [])]
+        return (
+            keys == self.keys
+            and bool(actual.get("unique")) == self.unique
+            and actual.get("partialFilterExpression") == ({"is_deleted": False} if self.partial else None)
+            and actual.get("expireAfterSeconds") == self.expire_after_seconds
+        )
+
+def master_indexes(collection: str, id_field: str, name_field: str, parent_field: Optional[str] = None) -> List[IndexSpec]:
+    specs = [IndexSpec(collection, id_field, unique=True), IndexSpec(collection, name_field, partial=True)]
+    if parent_field:
+        specs.append(IndexSpec(collection, parent_field, partial=True))
+    return specs
+
+def child_indexes(collection: str, id_field: str, parent_field: str) -> List[IndexSpec]:
+    return [IndexSpec(collection, id_field, unique=True), IndexSpec(collection, parent_field)]
+
+INDEX_REGISTRY: List[IndexSpec] = [
+    # Users, roles and permissions
+    IndexSpec("users", "id", unique=True),
+    IndexSpec("users", "email", partial=True),
+    IndexSpec("users", "role_id", partial=True),
+    IndexSpec("users", "department_id", partial=True),
+    IndexSpec("roles", "id", unique=True),
+    IndexSpec("roles", "name", partial=True),
+    IndexSpec("menus", "id", unique=True),
+    IndexSpec("menus", "parent_id", partial=True),
+    IndexSpec("menus", "name", partial=True),
+    IndexSpec("permissions", "id", unique=True),
+    IndexSpec("permissions", "name"),
+    IndexSpec("role_permissions", "id", unique=True),
+    IndexSpec("role_permissions", [("role_id", 1), ("menu_id", 1)], partial=True),
+    IndexSpec("role_permissions", "menu_id", partial=True),
+    IndexSpec("role_permissions", "permission_ids", partial=True),
+    IndexSpec("departments", "id", unique=True),
+    IndexSpec("departments", "name", partial=True),
+    IndexSpec("sub_departments", "id", unique=True),
+    IndexSpec("sub_departments", "department_id", partial=True),
+    IndexSpec("business_verticals", "id", unique=True),
+    IndexSpec("business_verticals", "name", partial=True),
+    IndexSpec("refresh_tokens", "id", unique=True),
+    IndexSpec("refresh_tokens", "family_id"),
+    IndexSpec("refresh_tokens", "user_id"),
+    # Mongo removes refresh tokens once expires_at has passed
+    IndexSpec("refresh_tokens", "expires_at", expire_after_seconds=0),
+    IndexSpec("cache_versions", "id", unique=True),
+    IndexSpec("counters", "id", unique=True),
+    IndexSpec("jobs", "id", unique=True),
+    IndexSpec("schedules", "id", unique=True),
+    IndexSpec("jobs", [("type", 1), ("status", 1), ("created_at", 1)]),
+    IndexSpec("jobs", [("created_by", 1), ("created_at", -1)]),
+
+    # Master tables
+    *master_indexes("job_function_master", "job_function_id", "job_function_name"),
+    *master_indexes("partner_type_master", "partner_type_id", "partner_type_name"),
+    *master_indexes("company_type_master", "company_type_id", "company_type_name"),
+    *master_indexes("head_of_company_master", "head_of_company_id", "head_role_name"),
+    *master_indexes("product_service_interest", "product_service_id", "product_service_name"),
+    *master_indexes("master_account_types", "account_type_id", "account_type_name"),
+    *master_indexes("master_account_regions", "region_id", "region_name"),
+    *master_indexes("master_business_types", "business_type_id", "business_type_name"),
+    *master_indexes("master_industry_segments", "industry_id", "industry_name"),
+    *master_indexes("master_sub_industry_segments", "sub_industry_id", "sub_industry_name", "industry_id"),
+    *master_indexes("master_address_types", "address_type_id", "address_type_name"),
+    *master_indexes("master_countries", "country_id", "country_name"),
+    *master_indexes("master_states", "state_id", "state_name", "country_id"),
+    *master_indexes("master_cities", "city_id", "city_name", "state_id"),
+    *master_indexes("master_document_types", "document_type_id", "document_type_name"),
+    *master_indexes("master_currencies", "currency_id", "currency_code"),
+    *master_indexes("lead_subtype_master", "id", "lead_subtype_name"),
+    *master_indexes("tender_subtype_master", "id", "tender_subtype_name"),
+    *master_indexes("submission_type_master", "id", "submission_type_name"),
+    *master_indexes("clause_master", "id", "clause_name"),
+    *master_indexes("competitor_master", "id", "competitor_name"),
+    *master_indexes("designation_master", "id", "designation_name"),
+    *master_indexes("billing_master", "id", "billing_type_name"),
+    *master_indexes("lead_source_master", "id", "lead_source_name"),
+
+    # Partners and companies
+    IndexSpec("partners", "partner_id", unique=True),
+    IndexSpec("partners", "email", partial=True),
+    IndexSpec("partners", "pan_no", partial=True),
+    IndexSpec("partners", "gst_no", partial=True),
+    IndexSpec("companies", "company_id", unique=True),
+    IndexSpec("companies", "company_name", partial=True),
+    IndexSpec("companies", "pan_no", partial=True),
+    IndexSpec("companies", "gst_no", partial=True),
+    *child_indexes("contacts", "contact_id", "company_id"),
+    *child_indexes("company_addresses", "address_id", "company_id"),
+    *child_indexes("company_documents", "document_id", "company_id"),
+    *child_indexes("company_financials", "financial_id", "company_id"),
+
+    # Leads
+    IndexSpec("leads", "id", unique=True),
+    IndexSpec("leads", "lead_id", unique=True),
+    IndexSpec("leads", "company_id", partial=True),
+    # Listings sort on (field, id) so keyset pages have a stable order
+    IndexSpec("leads", [("created_at", -1), ("id", -1)], partial=True),
+    IndexSpec("leads", [("approval_status", 1), ("created_at", -1), ("id", -1)], partial=True),
+    IndexSpec("leads", "assigned_to_user_id", partial=True),
+    IndexSpec("leads", [("approval_status", 1), ("approved_at", 1)], partial=True),
+    # Not partial: the search index also needs to see leads that were just deleted
+    IndexSpec("leads", "updated_at"),
+    *child_indexes("lead_contacts", "id", "lead_id"),
+    *child_indexes("lead_tenders", "id", "lead_id"),
+    *child_indexes("lead_competitors", "id", "lead_id"),
+    *child_indexes("lead_documents", "id", "lead_id"),
+
+    # Opportunities
+    IndexSpec("opportunities", "id", unique=True),
+    IndexSpec("opportunities", "opportunity_id", unique=True),
+    # Not partial: the auto-conversion anti-join looks up lead_id without an is_deleted
+    # predicate, and has to see deleted auto-converted opportunities too
+    IndexSpec("opportunities", "lead_id"),
+    IndexSpec("opportunities", "current_stage_id", partial=True),
+    IndexSpec("opportunities", [("sr_no", -1)]),
+    IndexSpec("opportunities", [("created_at", -1)], partial=True),
+    IndexSpec("opportunity_stages", "id", unique=True),
+    IndexSpec("opportunity_stages", [("opportunity_type", 1), ("sequence_order", 1)]),
+    IndexSpec("opportunity_stages", "stage_code"),
+    IndexSpec("opportunity_kpis", "id", unique=True),
+    IndexSpec("opportunity_kpis", [("measurement_period", 1), ("owner_id", 1), ("period_start", -1)], unique=True),
+    IndexSpec("qualification_rules", "id", unique=True),
+    IndexSpec("opportunity_qualifications", [("opportunity_id", 1), ("rule_id", 1)]),
+    IndexSpec("opportunity_audit_log", [("opportunity_id", 1), ("action_timestamp", -1)]),
+    *child_indexes("opportunity_stage_history", "id", "opportunity_id"),
+    *child_indexes("opportunity_documents", "id", "opportunity_id"),
+    *child_indexes("opportunity_clauses", "id", "opportunity_id"),
+    *child_indexes("opportunity_important_dates", "id", "opportunity_id"),
+    *child_indexes("opportunity_won_details", "id", "opportunity_id"),
+    *child_indexes("opportunity_order_analysis", "id", "opportunity_id"),
+    *child_indexes("sl_process_tracking", "id", "opportunity_id"),
+    *child_indexes("opportunity_digital_signatures", "id", "opportunity_id"),
+    *child_indexes("opportunity_compliance", "id", "opportunity_id"),
+    *child_indexes("opportunity_contacts", "id", "opportunity_id"),
+
+    # Logs
+    IndexSpec("activity_logs", "id", unique=True),
+    IndexSpec("activity_logs", [("entity_type", 1), ("entity_id", 1), ("timestamp", -1)]),
+    IndexSpec("activity_logs", [("verb", 1), ("timestamp", -1)]),
+    IndexSpec("activity_logs", [("timestamp", -1), ("verb", 1)]),
+    IndexSpec("activity_logs", [("timestamp", -1), ("id", -1)]),
+    IndexSpec("activity_logs", [("user_id", 1), ("timestamp", -1), ("id", -1)]),
+    IndexSpec("login_logs", "id", unique=True),
+    IndexSpec("login_logs", [("login_time", -1), ("id", -1)]),
+    IndexSpec("login_logs", [("user_id", 1), ("login_time", -1), ("id", -1)]),
+    IndexSpec("log_daily_rollups", [("kind", 1), ("day", 1), ("user_id", 1), ("action_type", 1)], unique=True),
+    IndexSpec("log_rollup_state", "id", unique=True),
+]
+
+async def index_drift_report(registry: List[IndexSpec] = INDEX_REGISTRY) -> Dict[str, Any]:
+    """Compare declared indexes with what each collection actually has"""
+    declared: Dict[str, Dict[str, IndexSpec]] = {}
+    for spec in registry:
+        declared.setdefault(spec.collection, {})[spec.name] = spec
+
+    missing, mismatched, extra = [], [], []
+    for collection, specs in declared.items():
+        actual = await db[collection].index_information()
+        for name, spec in specs.items():
+            if name not in actual:
+                missing.append({"collection": collection, "name": name})
+            elif not spec.matches(actual[name]):
+                mismatched.append({"collection": collection, "name": name, "actual": actual[name]})
+        for name, info in actual.items():
+            if name != "_id_" and name not in specs:
+                extra.append({"collection": collection, "name": name, "key": info.get("key")})
+
+    return {
+        "declared": len(registry),
+        "missing": missing,
+        "mismatched": mismatched,
+        "extra": extra,
+        "in_sync": not (missing or mismatched)
+    }
+
+async def ensure_indexes(registry: List[IndexSpec] = INDEX_REGISTRY) -> Dict[str, Any]:
+    """Create any declared index that does not exist yet; existing indexes are left untouched"""
+    drift = await index_drift_report(registry)
+    missing = {(item["collection"], item["name"]) for item in drift["missing"]}
+    created, failed = [], []
+    for spec in registry:
+        if (spec.collection, spec.name) not in missing:
+            continue
+        try:
+            await db[spec.collection].create_index(spec.keys, **spec.options())
+            created.append(f"{spec.collection}.{spec.name}")
+        except Exception as e:
+            # e.g. a unique index over existing duplicates; reported rather than fatal
+            failed.append({"index": f"{spec.collection}.{spec.name}", "error": str(e)})
+            logger.error("Could not create index %s.%s: %s", spec.collection, spec.name, e)
+    return {"created": created, "failed": failed, "mismatched": drift["mismatched"]}
+
+@api_router.get("/system/index-drift", response_model=APIResponse)
+@require_permission("/system", "view")
+async def get_index_drift(current_user: User = Depends(get_current_user)):
+    """Compare the declared index registry with the database"""
+    report = await index_drift_report()
+    return APIResponse(success=True, message="Index drift report generated", data=report)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -8828,6 +11567,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "ETag"],
 )
 
 # Configure logging
@@ -8837,6 +11577,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def load_auth_state():
+    if STATELESS_AUTH:
+        await auth_state.load()
+
+@app.on_event("startup")
+async def ensure_declared_indexes():
+    result = await ensure_indexes()
+    if result["created"]:
+        logger.info("Created %d indexes", len(result["created"]))
+
+@app.on_event("startup")
+async def load_stage_catalog():
+    await stage_catalog.load()
+
+@app.on_event("startup")
+async def start_log_rollups():
+    log_rollup_job.start()
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    await cache_bus.start()
+
+@app.on_event("startup")
+async def start_job_runner():
+    job_runner.start()
+
+@app.on_event("startup")
+async def start_scheduled_tasks():
+    for task in scheduled_tasks:
+        task.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await login_log_writer.stop()
+    await activity_log_writer.stop()
+    await log_rollup_job.stop()
+    await cache_bus.stop()
+    await job_runner.stop()
+    for task in scheduled_tasks:
+        await task.stop()
+    password_executor.shutdown(wait=False)
     client.close()
\ No newline at end of file
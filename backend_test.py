@@ -1,6 +1,7 @@
 import requests
 import sys
 import json
+import time
 from datetime import datetime
 
 class ERPBackendTester:
@@ -95,6 +96,7 @@ class ERPBackendTester:
         
         if success and response.get('success') and 'data' in response:
             self.token = response['data'].get('access_token')
+            refresh_token = response['data'].get('refresh_token')
             self.user_id = response['data'].get('user', {}).get('id')
             print(f"   Token obtained: {self.token[:20]}...")
             print(f"   User ID: {self.user_id}")
@@ -110,7 +112,16 @@ class ERPBackendTester:
                 "auth/me",
                 200
             )
-            return success
+
+            # A refresh token is not accepted in place of an access token
+            refresh_rejected, _ = self.run_test(
+                "Refresh Token Rejected as Bearer Token",
+                "GET",
+                "auth/me",
+                401,
+                headers={'Authorization': f'Bearer {refresh_token}'}
+            )
+            return success and refresh_rejected
         
         return False
 
@@ -201,8 +212,9 @@ class ERPBackendTester:
         
         initial_leads_count = 0
         if success3 and response3.get('success'):
-            leads = response3.get('data', [])
-            initial_leads_count = len(leads)
+            leads = response3.get('data', {}).get('leads', [])
+            # /leads is paginated; count every lead, not just the first page
+            initial_leads_count = response3.get('data', {}).get('pagination', {}).get('total_items', len(leads))
             print(f"   Initial leads count: {initial_leads_count}")
             
             # Check enriched data structure if leads exist
@@ -304,7 +316,7 @@ class ERPBackendTester:
             
             actual_lead_id = None
             if success_get_all and response_get_all.get('success'):
-                all_leads = response_get_all['data']
+                all_leads = response_get_all['data']['leads']
                 for lead in all_leads:
                     if lead.get('lead_id') == created_lead_id:
                         actual_lead_id = lead.get('id')
@@ -395,8 +407,7 @@ class ERPBackendTester:
         )
         
         if success9 and response9.get('success'):
-            final_leads = response9.get('data', [])
-            final_count = len(final_leads)
+            final_count = response9.get('data', {}).get('pagination', {}).get('total_items', 0)
             expected_count = initial_leads_count + (1 if success4 else 0)
             
             if final_count == expected_count:
@@ -517,7 +528,7 @@ class ERPBackendTester:
         
         test_lead_id = None
         if leads_success and leads_response.get('success'):
-            all_leads = leads_response['data']
+            all_leads = leads_response['data']['leads']
             for lead in all_leads:
                 if lead.get('project_title') == lead_data['project_title']:
                     test_lead_id = lead.get('id')
@@ -856,12 +867,55 @@ class ERPBackendTester:
             # If export fails, still consider it a minor issue if it's due to no data
             print("   ⚠️  Export endpoint issue - may be due to no leads available")
         
-        # 16. POST /api/leads/import - Import leads from CSV (test with sample data)
-        # Note: The import endpoint expects leads_data as a query parameter, not JSON body
-        # Let's test with a simpler approach
-        success16 = True  # Skip import test for now as it requires specific parameter format
+        # 16. POST /api/leads/import - Import leads from CSV (rows as a JSON list)
+        import_suffix = datetime.now().strftime('%H%M%S%f')
+        import_row = {
+            "lead_subtype_id": subtypes[0]['id'],
+            "lead_source_id": sources[0]['id'],
+            "company_id": companies[0]['company_id'],
+            "expected_revenue": 50000,
+            "revenue_currency_id": currencies[0]['currency_id'],
+            "convert_to_opportunity_date": "2024-12-31",
+            "assigned_to_user_id": users[0]['id']
+        }
+        import_rows = [
+            {**import_row, "project_title": f"Imported Lead A {import_suffix}"},
+            {**import_row, "project_title": f"Imported Lead B {import_suffix}", "notes": "second row"},
+            {**import_row, "project_title": f"Imported Lead A {import_suffix}"},  # duplicate in file
+            {**import_row, "project_title": f"Imported Lead C {import_suffix}", "company_id": "missing-company"}
+        ]
+        success16, response16 = self.run_test(
+            "POST /api/leads/import - Import Leads",
+            "POST",
+            "leads/import",
+            200,
+            data=import_rows
+        )
+        if success16:
+            # The import runs as a background job; poll it until it finishes
+            job = response16.get('data', {})
+            for _ in range(60):
+                if job.get('status') in ('succeeded', 'failed', 'cancelled'):
+                    break
+                time.sleep(0.5)
+                job_success, job_response = self.run_test(
+                    "GET /api/jobs/{id} - Import Job Status",
+                    "GET",
+                    f"jobs/{job.get('id')}",
+                    200
+                )
+                job = job_response.get('data', {}) if job_success else {}
+            print(f"   Import job {job.get('status')}")
+            import_result = job.get('result') or {}
+            print(f"   Imported {import_result.get('imported_count')}/{import_result.get('total_count')} rows")
+            for error in import_result.get('errors', []):
+                print(f"   Row error: {error}")
+            if import_result.get('imported_count') == 2 and len(import_result.get('errors', [])) == 2:
+                print("   ✅ Valid rows imported, duplicate and unknown company rejected per row")
+            else:
+                print("   ❌ Unexpected import result")
+                success16 = False
         test_results.append(success16)
-        print("   ✅ Import endpoint structure verified (skipped actual import test)")
         
         # ===== ADVANCED SEARCH TESTING =====
         print("\n🔍 Testing Advanced Search...")
@@ -963,7 +1017,7 @@ class ERPBackendTester:
             
             delete_test_lead_id = None
             if leads_success:
-                all_leads = leads_response['data']
+                all_leads = leads_response['data']['leads']
                 for lead in all_leads:
                     if lead.get('project_title') == "Delete Test Lead":
                         delete_test_lead_id = lead.get('id')
@@ -1051,8 +1105,11 @@ class ERPBackendTester:
         test_results.append(success2)
         
         if success2 and response2.get('success'):
-            converted_count = response2.get('data', {}).get('converted_count', 0)
-            print(f"   ✅ Auto-conversion working: {converted_count} leads converted")
+            data = response2.get('data', {})
+            if data.get('status') == 'completed':
+                print(f"   ✅ Auto-conversion working: {data.get('converted_count', 0)} leads converted")
+            else:
+                print("   ✅ Auto-conversion scheduled")
         
         # ===== 3. SETUP TEST DATA =====
         print("\n🔍 Setting up test data for opportunity creation...")
@@ -1176,7 +1233,7 @@ class ERPBackendTester:
         non_tender_lead_id = None
         
         if leads_success:
-            all_leads = leads_response['data']
+            all_leads = leads_response['data']['leads']
             for lead in all_leads:
                 if lead.get('project_title') == tender_lead_data['project_title']:
                     tender_lead_id = lead.get('id')
@@ -1363,7 +1420,7 @@ class ERPBackendTester:
             
             unapproved_lead_id = None
             if leads_success:
-                all_leads = leads_response['data']
+                all_leads = leads_response['data']['leads']
                 for lead in all_leads:
                     if lead.get('project_title') == "Unapproved Lead Test":
                         unapproved_lead_id = lead.get('id')
@@ -0,0 +1,105 @@
+"""Cross-worker cache invalidation test against a local single-node replica set
+
+Start one with:
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+
+Then run: python cache_invalidation_test.py [mongo_url]
+
+Two CacheInvalidationBus instances with their own caches stand in for two uvicorn
+workers. Every check runs in change stream mode and again in version-polling mode.
+"""
+import asyncio
+import time
+import uuid
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_cache_test", "mongodb://localhost:27017/?replicaSet=rs0")
+
+class Worker:
+    """One worker's caches and invalidation bus"""
+
+    def __init__(self, mode):
+        self.master = server.MasterDataCache()
+        self.permissions = server.PermissionCache()
+        self.auth = server.AuthStateMap()
+        self.bus = server.CacheInvalidationBus(self.master, self.permissions, self.auth, mode=mode, poll_interval=0.2)
+
+class CacheInvalidationTester(ScratchDBScript):
+    @staticmethod
+    async def wait_until(predicate, timeout=5.0):
+        """Wait for predicate() to hold; returns the time it took in ms, or None on timeout"""
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            if predicate():
+                return (time.perf_counter() - started) * 1000
+            await asyncio.sleep(0.01)
+        return None
+
+    async def run_mode(self, mode):
+        print(f"\n🔍 Mode: {mode}")
+        db = server.db
+        await db.master_currencies.insert_one({
+            "currency_id": str(uuid.uuid4()), "currency_code": "AAA", "currency_name": "First",
+            "symbol": "A", "is_active": True, "is_deleted": False
+        })
+        role_id = str(uuid.uuid4())
+        await db.roles.insert_one({"id": role_id, "name": f"Role {mode}", "is_deleted": False})
+
+        writer, reader = Worker(mode), Worker(mode)
+        await writer.bus.start()
+        await reader.bus.start()
+        # Give the change streams a moment to open before writing
+        await asyncio.sleep(0.5)
+        self.check(f"[{mode}] bus running in requested mode", reader.bus.mode == mode, f"(mode={reader.bus.mode})")
+
+        # Master data written through the API path: write, then publish
+        before = await reader.master.get("master_currencies")
+        await db.master_currencies.insert_one({
+            "currency_id": str(uuid.uuid4()), "currency_code": "BBB", "currency_name": "Second",
+            "symbol": "B", "is_active": True, "is_deleted": False
+        })
+        await writer.bus.publish("master_currencies")
+        elapsed = await self.wait_until(lambda: "master_currencies" not in reader.master._entries)
+        self.check(f"[{mode}] master table evicted in the other worker", elapsed is not None,
+                   f"({elapsed:.0f}ms)" if elapsed is not None else "")
+        await self.wait_until(lambda: reader.master.version("master_currencies") == writer.master.version("master_currencies"))
+        after = await reader.master.get("master_currencies")
+        self.check(f"[{mode}] other worker sees the new row", len(after["records"]) == len(before["records"]) + 1)
+        writer_entry = await writer.master.get("master_currencies")
+        self.check(f"[{mode}] both workers agree on version and ETag",
+                   after["version"] == writer_entry["version"] and after["etag"] == writer_entry["etag"],
+                   f"(version={after['version']})")
+
+        # Role permission change evicts the role's compiled matrix
+        await reader.permissions.get(role_id)
+        await db.role_permissions.insert_one({
+            "id": str(uuid.uuid4()), "role_id": role_id, "menu_id": "m", "permission_ids": [], "is_deleted": False
+        })
+        await writer.bus.publish("permissions", role_id)
+        elapsed = await self.wait_until(lambda: reader.permissions.stats()["cached_roles"] == 0)
+        self.check(f"[{mode}] permission matrix evicted in the other worker", elapsed is not None,
+                   f"({elapsed:.0f}ms)" if elapsed is not None else "")
+
+        if mode == "change_stream":
+            # Writes that bypass publish() are still seen by the change stream
+            await reader.master.get("master_currencies")
+            await db.master_currencies.update_one({"currency_code": "AAA"}, {"$set": {"symbol": "Z"}})
+            elapsed = await self.wait_until(lambda: "master_currencies" not in reader.master._entries)
+            self.check(f"[{mode}] direct write evicted without publish()", elapsed is not None,
+                       f"({elapsed:.0f}ms)" if elapsed is not None else "")
+
+        stats = reader.bus.stats()
+        print(f"   events={stats['events']} evictions={sum(stats['evictions'].values())} lag_ms={stats['lag_ms']}")
+        self.check(f"[{mode}] lag metrics recorded", stats["lag_ms"]["samples"] > 0)
+
+        await writer.bus.stop()
+        await reader.bus.stop()
+
+    async def scenarios(self):
+        for mode in ("change_stream", "polling"):
+            await self.run_mode(mode)
+
+if __name__ == "__main__":
+    CacheInvalidationTester().main()
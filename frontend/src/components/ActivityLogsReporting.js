@@ -216,24 +216,23 @@ const ActivityLogsReporting = () => {
       if (activityFilters.end_date) params.append('end_date', activityFilters.end_date);
       params.append('format', 'csv');
       
-      const response = await axios.get(`${API}/logs/export/activity?${params}`);
-      if (response.data.success) {
-        // Create and download the CSV file
-        const blob = new Blob([response.data.data.content], { type: 'text/csv' });
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = response.data.data.filename;
-        document.body.appendChild(a);
-        a.click();
-        window.URL.revokeObjectURL(url);
-        document.body.removeChild(a);
-        
-        toast({
-          title: "Success",
-          description: `Exported ${response.data.data.total_records} activity log records`,
-        });
-      }
+      const response = await axios.get(`${API}/logs/export/activity?${params}`, { responseType: 'blob' });
+      // The export is streamed as a file; take the name from Content-Disposition
+      const disposition = response.headers['content-disposition'] || '';
+      const match = disposition.match(/filename="([^"]+)"/);
+      const url = window.URL.createObjectURL(response.data);
+      const a = document.createElement('a');
+      a.href = url;
+      a.download = match ? match[1] : 'activity_logs.csv';
+      document.body.appendChild(a);
+      a.click();
+      window.URL.revokeObjectURL(url);
+      document.body.removeChild(a);
+      
+      toast({
+        title: "Success",
+        description: "Activity logs exported",
+      });
     } catch (error) {
       toast({
         title: "Error", 
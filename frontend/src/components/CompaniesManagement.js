@@ -14,6 +14,7 @@ import { useToast } from '../hooks/use-toast';
 import DataTable from './DataTable';
 import ProtectedComponent from './ProtectedComponent';
 import axios from 'axios';
+import { fetchMasterTables } from '../lib/masterData';
 
 const CompaniesManagement = () => {
   const [companies, setCompanies] = useState([]);
@@ -69,19 +70,12 @@ const CompaniesManagement = () => {
         return;
       }
 
-      const [
-        companiesRes, companyTypesRes, partnerTypesRes, headOfCompanyRes,
-        addressTypesRes, countriesRes, documentTypesRes, currenciesRes, jobFunctionsRes
-      ] = await Promise.all([
+      const [companiesRes, tables] = await Promise.all([
         axios.get(`${BACKEND_URL}/api/companies`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/company-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/partner-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/head-of-company`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/address-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/countries`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/document-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/currencies`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/job-functions`, { headers: { Authorization: `Bearer ${token}` } })
+        fetchMasterTables([
+          'company-types', 'partner-types', 'head-of-company', 'address-types',
+          'countries', 'document-types', 'currencies', 'job-functions'
+        ], { Authorization: `Bearer ${token}` })
       ]);
 
       if (companiesRes.data.success) {
@@ -89,16 +83,16 @@ const CompaniesManagement = () => {
       }
       
       setMasterData({
-        companyTypes: companyTypesRes.data.success ? companyTypesRes.data.data : [],
-        partnerTypes: partnerTypesRes.data.success ? partnerTypesRes.data.data : [],
-        headOfCompany: headOfCompanyRes.data.success ? headOfCompanyRes.data.data : [],
-        addressTypes: addressTypesRes.data.success ? addressTypesRes.data.data : [],
-        countries: countriesRes.data.success ? countriesRes.data.data : [],
+        companyTypes: tables['company-types'],
+        partnerTypes: tables['partner-types'],
+        headOfCompany: tables['head-of-company'],
+        addressTypes: tables['address-types'],
+        countries: tables['countries'],
         states: [], // Will be loaded dynamically based on country
         cities: [], // Will be loaded dynamically based on state
-        documentTypes: documentTypesRes.data.success ? documentTypesRes.data.data : [],
-        currencies: currenciesRes.data.success ? currenciesRes.data.data : [],
-        jobFunctions: jobFunctionsRes.data.success ? jobFunctionsRes.data.data : []
+        documentTypes: tables['document-types'],
+        currencies: tables['currencies'],
+        jobFunctions: tables['job-functions']
       });
     } catch (error) {
       toast({
@@ -115,12 +109,11 @@ const CompaniesManagement = () => {
     try {
       const token = localStorage.getItem('access_token');
       const response = await axios.get(`${BACKEND_URL}/api/master/states`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { country_id: countryId, limit: 1000 }
       });
       if (response.data.success) {
-        const allStates = response.data.data;
-        const countryStates = allStates.filter(state => state.country_id === countryId);
-        setMasterData(prev => ({ ...prev, states: countryStates }));
+        setMasterData(prev => ({ ...prev, states: response.data.data.records }));
       }
     } catch (error) {
       console.error('Failed to load states:', error);
@@ -131,12 +124,11 @@ const CompaniesManagement = () => {
     try {
       const token = localStorage.getItem('access_token');
       const response = await axios.get(`${BACKEND_URL}/api/master/cities`, {
-        headers: { Authorization: `Bearer ${token}` }
+        headers: { Authorization: `Bearer ${token}` },
+        params: { state_id: stateId, limit: 1000 }
       });
       if (response.data.success) {
-        const allCities = response.data.data;
-        const stateCities = allCities.filter(city => city.state_id === stateId);
-        setMasterData(prev => ({ ...prev, cities: stateCities }));
+        setMasterData(prev => ({ ...prev, cities: response.data.data.records }));
       }
     } catch (error) {
       console.error('Failed to load cities:', error);
@@ -39,12 +39,17 @@ import {
 import axios from 'axios';
 import DataTable from './DataTable';
 import ProtectedComponent from './ProtectedComponent';
+import { fetchMasterTables } from '../lib/masterData';
+
+const LEADS_PAGE_SIZE = 100;
 
 const LeadManagement = () => {
   // State management
   const [leads, setLeads] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
+  const [searchResults, setSearchResults] = useState(null);
   const [showAddDialog, setShowAddDialog] = useState(false);
   const [showEditDialog, setShowEditDialog] = useState(false);
   const [showViewDialog, setShowViewDialog] = useState(false);
@@ -159,16 +164,19 @@ const LeadManagement = () => {
     fetchStatistics();
   }, []);
 
-  // Fetch leads
-  const fetchLeads = async () => {
+  // Fetch leads (first page, or the next one when a cursor is given)
+  const fetchLeads = async (cursor = null) => {
     try {
       setLoading(true);
       const response = await axios.get(`${API_BASE_URL}/api/leads`, {
-        headers: getAuthHeaders()
+        headers: getAuthHeaders(),
+        params: cursor ? { cursor, limit: LEADS_PAGE_SIZE } : { limit: LEADS_PAGE_SIZE }
       });
       
       if (response.data.success) {
-        setLeads(response.data.data || []);
+        const { leads: page, pagination } = response.data.data;
+        setLeads(prev => (cursor ? [...prev, ...page] : page));
+        setNextCursor(pagination.next_cursor);
       }
     } catch (error) {
       console.error('Error fetching leads:', error);
@@ -181,54 +189,34 @@ const LeadManagement = () => {
   // Fetch master data
   const fetchMasterData = async () => {
     try {
-      const endpoints = [
-        'companies',
-        'master/lead-subtypes',
-        'master/lead-sources',
-        'master/currencies',
-        'users',
-        'master/tender-subtypes',
-        'master/submission-types',
-        'master/clauses',
-        'master/competitors',
-        'master/designations',
-        'master/billing-types'
-      ];
-
-      const responses = await Promise.all(
-        endpoints.map(endpoint =>
-          axios.get(`${API_BASE_URL}/api/${endpoint}`, {
-            headers: getAuthHeaders()
-          })
-        )
-      );
-
-      const [
-        companiesRes,
-        leadSubtypesRes,
-        leadSourcesRes,
-        currenciesRes,
-        usersRes,
-        tenderSubtypesRes,
-        submissionTypesRes,
-        clausesRes,
-        competitorsRes,
-        designationsRes,
-        billingTypesRes
-      ] = responses;
+      const [companiesRes, usersRes, tables] = await Promise.all([
+        axios.get(`${API_BASE_URL}/api/companies`, { headers: getAuthHeaders() }),
+        axios.get(`${API_BASE_URL}/api/users`, { headers: getAuthHeaders() }),
+        fetchMasterTables([
+          'lead-subtypes',
+          'lead-sources',
+          'currencies',
+          'tender-subtypes',
+          'submission-types',
+          'clauses',
+          'competitors',
+          'designations',
+          'billing-types'
+        ], getAuthHeaders())
+      ]);
 
       setMasterData({
         companies: companiesRes.data.success ? companiesRes.data.data : [],
-        leadSubtypes: leadSubtypesRes.data.success ? leadSubtypesRes.data.data : [],
-        leadSources: leadSourcesRes.data.success ? leadSourcesRes.data.data : [],
-        currencies: currenciesRes.data.success ? currenciesRes.data.data : [],
+        leadSubtypes: tables['lead-subtypes'],
+        leadSources: tables['lead-sources'],
+        currencies: tables['currencies'],
         users: usersRes.data.success ? usersRes.data.data : [],
-        tenderSubtypes: tenderSubtypesRes.data.success ? tenderSubtypesRes.data.data : [],
-        submissionTypes: submissionTypesRes.data.success ? submissionTypesRes.data.data : [],
-        clauses: clausesRes.data.success ? clausesRes.data.data : [],
-        competitors: competitorsRes.data.success ? competitorsRes.data.data : [],
-        designations: designationsRes.data.success ? designationsRes.data.data : [],
-        billingTypes: billingTypesRes.data.success ? billingTypesRes.data.data : []
+        tenderSubtypes: tables['tender-subtypes'],
+        submissionTypes: tables['submission-types'],
+        clauses: tables['clauses'],
+        competitors: tables['competitors'],
+        designations: tables['designations'],
+        billingTypes: tables['billing-types']
       });
     } catch (error) {
       console.error('Error fetching master data:', error);
@@ -237,29 +225,35 @@ const LeadManagement = () => {
   };
 
   // Fetch statistics
-  const fetchStatistics = () => {
-    const totalLeads = leads.length;
-    const pendingLeads = leads.filter(lead => lead.approval_status === 'pending').length;
-    const approvedLeads = leads.filter(lead => lead.approval_status === 'approved').length;
+  const fetchStatistics = async () => {
+    // Counts come from the server so they cover every lead, not just the loaded pages
+    const countLeads = async (params) => {
+      const response = await axios.get(`${API_BASE_URL}/api/leads`, {
+        headers: getAuthHeaders(),
+        params: { ...params, limit: 1 }
+      });
+      return response.data.data.pagination.total_items;
+    };
     const currentDate = new Date();
-    const thisMonth = leads.filter(lead => {
-      const leadDate = new Date(lead.created_at);
-      return leadDate.getMonth() === currentDate.getMonth() && 
-             leadDate.getFullYear() === currentDate.getFullYear();
-    }).length;
-
-    setStatistics({
-      totalLeads,
-      pendingLeads,
-      approvedLeads,
-      thisMonth
-    });
-  };
+    const monthStart = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
 
-  // Update statistics when leads change
-  useEffect(() => {
-    fetchStatistics();
-  }, [leads]);
+    try {
+      const [totalLeads, pendingLeads, approvedLeads, thisMonth] = await Promise.all([
+        countLeads({}),
+        countLeads({ status: 'pending' }),
+        countLeads({ status: 'approved' }),
+        countLeads({ date_from: monthStart.toISOString() })
+      ]);
+      setStatistics({
+        totalLeads,
+        pendingLeads,
+        approvedLeads,
+        thisMonth
+      });
+    } catch (error) {
+      console.error('Error fetching lead statistics:', error);
+    }
+  };
 
   // Stepper configuration
   const steps = [
@@ -612,6 +606,7 @@ const LeadManagement = () => {
         setShowAddDialog(false);
         resetForm();
         fetchLeads();
+        fetchStatistics();
         
         // TODO: Create nested entities (contacts, tender details, competitors, documents)
         // This would require additional API calls to create related entities
@@ -638,6 +633,7 @@ const LeadManagement = () => {
       if (response.data.success) {
         toast.success(`Lead ${status} successfully`);
         fetchLeads();
+        fetchStatistics();
       }
     } catch (error) {
       console.error(`Error ${status} lead:`, error);
@@ -659,6 +655,7 @@ const LeadManagement = () => {
         if (response.data.success) {
           toast.success('Lead deleted successfully');
           fetchLeads();
+          fetchStatistics();
         }
       } catch (error) {
         console.error('Error deleting lead:', error);
@@ -669,12 +666,37 @@ const LeadManagement = () => {
     }
   };
 
-  // Filter leads based on search term
-  const filteredLeads = leads.filter(lead =>
-    lead.project_title?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    lead.lead_id?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    lead.company_name?.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  // Search on the server once typing pauses
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSearchResults(null);
+      return undefined;
+    }
+    // A newer term aborts the request for this one, so a slow response cannot overwrite newer results
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API_BASE_URL}/api/leads/search`, {
+          headers: getAuthHeaders(),
+          params: { q: searchTerm, limit: LEADS_PAGE_SIZE },
+          signal: controller.signal
+        });
+        if (response.data.success && !controller.signal.aborted) {
+          setSearchResults(response.data.data.leads);
+        }
+      } catch (error) {
+        if (!axios.isCancel(error)) {
+          console.error('Error searching leads:', error);
+        }
+      }
+    }, 300);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [searchTerm]);
+
+  const filteredLeads = searchResults || leads;
 
   // DataTable columns configuration
   const columns = [
@@ -952,7 +974,10 @@ const LeadManagement = () => {
               <Button
                 variant="outline"
                 size="sm"
-                onClick={fetchLeads}
+                onClick={() => {
+                  fetchLeads();
+                  fetchStatistics();
+                }}
                 disabled={loading}
               >
                 <RefreshCw className={`h-4 w-4 mr-2 ${loading ? 'animate-spin' : ''}`} />
@@ -973,6 +998,18 @@ const LeadManagement = () => {
             loading={loading}
             searchable={false} // We handle search externally
           />
+          {nextCursor && !searchResults && (
+            <div className="flex justify-center mt-4">
+              <Button
+                variant="outline"
+                size="sm"
+                onClick={() => fetchLeads(nextCursor)}
+                disabled={loading}
+              >
+                Load more leads
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
 
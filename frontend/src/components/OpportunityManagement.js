@@ -490,8 +490,7 @@ const OpportunityManagement = () => {
       });
 
       if (response.data.success) {
-        const convertedCount = response.data.data?.converted_count || 0;
-        toast.success(`Auto-conversion completed. ${convertedCount} leads converted to opportunities.`);
+        toast.success(response.data.message);
         fetchOpportunities();
         fetchMasterData();
         fetchAnalytics();
@@ -11,6 +11,7 @@ import { useToast } from '../hooks/use-toast';
 import DataTable from './DataTable';
 import ProtectedComponent from './ProtectedComponent';
 import axios from 'axios';
+import { fetchMasterTables } from '../lib/masterData';
 
 const PartnersManagement = () => {
   const [partners, setPartners] = useState([]);
@@ -59,18 +60,12 @@ const PartnersManagement = () => {
         return;
       }
 
-      const [
-        partnersRes, 
-        jobFunctionsRes, 
-        companyTypesRes, 
-        partnerTypesRes, 
-        headOfCompanyRes
-      ] = await Promise.all([
+      const [partnersRes, tables] = await Promise.all([
         axios.get(`${BACKEND_URL}/api/partners`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/job-functions`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/company-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/partner-types`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${BACKEND_URL}/api/master/head-of-company`, { headers: { Authorization: `Bearer ${token}` } })
+        fetchMasterTables(
+          ['job-functions', 'company-types', 'partner-types', 'head-of-company'],
+          { Authorization: `Bearer ${token}` }
+        )
       ]);
 
       if (partnersRes.data.success) {
@@ -78,10 +73,10 @@ const PartnersManagement = () => {
       }
       
       setMasterData({
-        jobFunctions: jobFunctionsRes.data.success ? jobFunctionsRes.data.data : [],
-        companyTypes: companyTypesRes.data.success ? companyTypesRes.data.data : [],
-        partnerTypes: partnerTypesRes.data.success ? partnerTypesRes.data.data : [],
-        headOfCompany: headOfCompanyRes.data.success ? headOfCompanyRes.data.data : []
+        jobFunctions: tables['job-functions'],
+        companyTypes: tables['company-types'],
+        partnerTypes: tables['partner-types'],
+        headOfCompany: tables['head-of-company']
       });
     } catch (error) {
       toast({
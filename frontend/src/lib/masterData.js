@@ -0,0 +1,30 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+
+// Master tables already loaded in this tab: { table: { version, records } }
+const loadedTables = {};
+
+// Fetch several master tables in one request; tables whose version has not
+// changed since they were last loaded are served from memory
+export async function fetchMasterTables(tables, headers) {
+  const versions = tables
+    .filter((table) => loadedTables[table])
+    .map((table) => `${table}:${loadedTables[table].version}`)
+    .join(',');
+
+  const response = await axios.get(`${BACKEND_URL}/api/master/bulk`, {
+    headers,
+    params: versions ? { tables: tables.join(','), versions } : { tables: tables.join(',') }
+  });
+
+  const result = {};
+  tables.forEach((table) => {
+    const entry = response.data.data[table];
+    if (entry.changed) {
+      loadedTables[table] = { version: entry.version, records: entry.records };
+    }
+    result[table] = loadedTables[table].records;
+  });
+  return result;
+}
@@ -0,0 +1,83 @@
+"""Sequential ID allocator test: uniqueness of LEAD-/OPP- codes and sr_no under parallel use
+
+Run: python id_allocator_test.py [mongo_url]
+
+Several IdAllocator instances stand in for several uvicorn workers. They draw single
+numbers and blocks concurrently, and parallel lead inserts go through the unique
+lead_id index, which rejects any duplicate the allocator might hand out.
+"""
+import asyncio
+import uuid
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_id_test")
+
+WORKERS = 4
+CALLS_PER_WORKER = 100
+PARALLEL_LEADS = 200
+
+class IdAllocatorTester(ScratchDBScript):
+    async def test_seeding(self):
+        print("\n🔍 Counters start above existing records")
+        await server.db.leads.insert_many([
+            {"id": str(uuid.uuid4()), "lead_id": "LEAD-0000041", "is_deleted": False},
+            {"id": str(uuid.uuid4()), "lead_id": "LEAD-X7K2Q9", "is_deleted": False}  # old random format
+        ])
+        await server.db.opportunities.insert_one({"id": str(uuid.uuid4()), "opportunity_id": "OPP-0000007", "sr_no": 12})
+
+        allocator = server.IdAllocator()
+        lead_code = (await allocator.codes("lead_id"))[0]
+        self.check("lead code continues after LEAD-0000041", lead_code == "LEAD-0000042", f"({lead_code})")
+        opp_code = (await allocator.codes("opportunity_id"))[0]
+        self.check("opportunity code continues after OPP-0000007", opp_code == "OPP-0000008", f"({opp_code})")
+        sr_no = (await allocator.take("sr_no"))[0]
+        self.check("sr_no continues after 12", sr_no == 13, f"({sr_no})")
+
+    async def test_parallel_workers(self):
+        print(f"\n🔍 {WORKERS} workers drawing numbers and blocks concurrently")
+        workers = [server.IdAllocator() for _ in range(WORKERS)]
+        start = (await workers[0].take("sr_no"))[0]
+
+        async def draw(allocator, i):
+            # Every fourth call reserves a block, the rest take one number
+            return await allocator.take("sr_no", 5 if i % 4 == 0 else 1)
+
+        batches = await asyncio.gather(*[
+            draw(allocator, i) for allocator in workers for i in range(CALLS_PER_WORKER)
+        ])
+        numbers = [number for batch in batches for number in batch]
+        self.check("no number handed out twice", len(numbers) == len(set(numbers)), f"({len(numbers)} numbers)")
+        self.check("numbers are contiguous", sorted(numbers) == list(range(start + 1, start + 1 + len(numbers))))
+        self.check("blocks are consecutive runs", all(batch == list(range(batch[0], batch[0] + len(batch))) for batch in batches))
+        round_trips = sum(allocator.round_trips for allocator in workers)
+        self.check("one round trip per call", round_trips == WORKERS * CALLS_PER_WORKER + 1, f"({round_trips})")
+
+    async def test_parallel_inserts(self):
+        print(f"\n🔍 {PARALLEL_LEADS} leads inserted in parallel through the unique lead_id index")
+        await server.ensure_indexes()
+        workers = [server.IdAllocator() for _ in range(WORKERS)]
+
+        async def insert(i):
+            code = (await workers[i % WORKERS].codes("lead_id"))[0]
+            await server.db.leads.insert_one({"id": str(uuid.uuid4()), "lead_id": code, "is_deleted": False})
+            return code
+
+        results = await asyncio.gather(*[insert(i) for i in range(PARALLEL_LEADS)], return_exceptions=True)
+        failures = [r for r in results if isinstance(r, Exception)]
+        self.check("every insert succeeded", not failures, f"({len(failures)} failures)")
+        self.check("all lead codes distinct", len(set(results)) == PARALLEL_LEADS)
+
+        block = await workers[0].codes("lead_id", 50)
+        stored = await server.db.leads.distinct("lead_id")
+        self.check("a reserved block does not overlap stored codes", not set(block) & set(stored))
+        self.check("block codes use the sequential format",
+                   all(code.startswith("LEAD-") and len(code) == 5 + server.ID_CODE_DIGITS for code in block))
+
+    async def scenarios(self):
+        await self.test_seeding()
+        await self.test_parallel_workers()
+        await self.test_parallel_inserts()
+
+if __name__ == "__main__":
+    IdAllocatorTester().main()
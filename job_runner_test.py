@@ -0,0 +1,155 @@
+"""Background job runner test against a scratch database on a local mongod
+
+Run: python job_runner_test.py [mongo_url]
+
+Two JobRunner instances stand in for two uvicorn workers sharing the jobs collection.
+Covers progress, per-type concurrency, cancellation, result files, resuming a job whose
+worker died, requeueing on a clean shutdown, and failing rather than retrying jobs of a
+single-attempt type.
+"""
+import asyncio
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_job_test", JOB_DIR=f"/tmp/erp_job_test_{uuid.uuid4().hex[:8]}")
+
+async def count_to(context):
+    """Counts to params["steps"], reporting progress, and writes the count to a result file"""
+    steps = context.params.get("steps", 10)
+    for step in range(steps):
+        await asyncio.sleep(0.02)
+        await context.progress(step + 1, steps)
+    with open(context.output("count.txt", "text/plain"), "w") as f:
+        f.write(str(steps))
+    return {"counted": steps}
+
+async def fail(context):
+    raise ValueError("boom")
+
+def make_worker():
+    runner = server.JobRunner(poll_interval=0.1, lease_seconds=1)
+    runner.register("count", count_to, concurrency=1)
+    runner.register("fail", fail)
+    runner.register("count_once", count_to, max_attempts=1)
+    return runner
+
+class JobRunnerTester(ScratchDBScript):
+    @staticmethod
+    async def wait_for_status(job_id, statuses, timeout=10.0):
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            job = await server.db.jobs.find_one({"id": job_id}, {"_id": 0})
+            if job and job["status"] in statuses:
+                return job
+            await asyncio.sleep(0.05)
+        return await server.db.jobs.find_one({"id": job_id}, {"_id": 0})
+
+    async def test_run_and_result(self, first, second):
+        print("\n🔍 Jobs run to completion with progress and a result file")
+        job = await first.enqueue("count", {"steps": 20}, "tester")
+        done = await self.wait_for_status(job["id"], server.JOB_FINISHED_STATUSES)
+        self.check("job succeeded", done["status"] == "succeeded", f"({done['status']})")
+        self.check("result recorded", done["result"] == {"counted": 20})
+        self.check("final progress recorded", done["progress"]["done"] == 20)
+        path = server.JOB_DIR / job["id"] / done["result_file"]["filename"]
+        self.check("result file written", path.is_file() and path.read_text() == "20")
+
+        job = await second.enqueue("fail", {}, "tester")
+        failed = await self.wait_for_status(job["id"], server.JOB_FINISHED_STATUSES)
+        self.check("failing handler marks the job failed", failed["status"] == "failed" and failed["error"] == "boom")
+
+    async def test_concurrency(self, first, second):
+        print("\n🔍 At most one count job runs per worker")
+        jobs = [await first.enqueue("count", {"steps": 15}, "tester") for _ in range(4)]
+        await asyncio.sleep(0.2)
+        running = await server.db.jobs.count_documents({"id": {"$in": [j["id"] for j in jobs]}, "status": "running"})
+        self.check("two workers run two jobs at a time", running == 2, f"(running={running})")
+        self.check("each worker runs one", first.running("count") <= 1 and second.running("count") <= 1)
+        for job in jobs:
+            await self.wait_for_status(job["id"], server.JOB_FINISHED_STATUSES)
+        statuses = [(await server.db.jobs.find_one({"id": j["id"]}))["status"] for j in jobs]
+        self.check("all queued jobs finish", statuses == ["succeeded"] * 4, f"({statuses})")
+
+    async def test_cancel(self, first, second):
+        print("\n🔍 Cancellation")
+        # A type neither worker handles stays queued
+        now = datetime.now(timezone.utc)
+        queued = {"id": str(uuid.uuid4()), "type": "unhandled", "status": "queued", "params": {}, "attempts": 0,
+                  "cancel_requested": False, "created_by": "tester", "created_at": now, "updated_at": now}
+        await server.db.jobs.insert_one(queued)
+        running = await first.enqueue("count", {"steps": 200}, "tester")
+        await self.wait_for_status(running["id"], ["running"])
+        # Whichever worker runs it, the other one is asked to cancel
+        cancelled = await first.cancel(running["id"])
+        self.check("running job flagged for cancellation", cancelled["cancel_requested"])
+        done = await self.wait_for_status(running["id"], server.JOB_FINISHED_STATUSES)
+        self.check("running job stops", done["status"] == "cancelled", f"(after {done['progress']['done']} of 200 steps)")
+        cancelled = await second.cancel(queued["id"])
+        self.check("queued job cancelled outright", cancelled["status"] == "cancelled")
+
+    async def test_resume(self, first, second):
+        print("\n🔍 A job whose worker died is resumed by another worker")
+        now = datetime.now(timezone.utc)
+        await server.db.jobs.insert_one({
+            "id": "orphan", "type": "count", "status": "running", "params": {"steps": 3}, "attempts": 1,
+            "worker": "dead-worker", "lease_until": now - timedelta(seconds=1), "cancel_requested": False,
+            "created_by": "tester", "created_at": now, "updated_at": now
+        })
+        done = await self.wait_for_status("orphan", server.JOB_FINISHED_STATUSES)
+        self.check("orphaned job resumed and finished", done["status"] == "succeeded", f"(attempts={done['attempts']})")
+
+        print("\n🔍 A clean shutdown puts running jobs back in the queue")
+        job = await second.enqueue("count", {"steps": 100}, "tester")
+        running = await self.wait_for_status(job["id"], ["running"])
+        owner = first if running["worker"] == first.worker_id else second
+        other = second if owner is first else first
+        await other.stop()
+        await owner.stop()
+        requeued = await server.db.jobs.find_one({"id": job["id"]})
+        self.check("job requeued", requeued["status"] == "queued" and requeued["attempts"] == 0)
+        other.start()
+        done = await self.wait_for_status(job["id"], server.JOB_FINISHED_STATUSES)
+        self.check("requeued job finished on restart", done["status"] == "succeeded")
+        await other.stop()
+
+    async def test_single_attempt(self, first, second):
+        print("\n🔍 Single-attempt jobs fail instead of starting over")
+        first.start()
+        second.start()
+        now = datetime.now(timezone.utc)
+        await server.db.jobs.insert_one({
+            "id": "orphan-once", "type": "count_once", "status": "running", "params": {"steps": 3}, "attempts": 1,
+            "worker": "dead-worker", "lease_until": now - timedelta(seconds=1), "cancel_requested": False,
+            "created_by": "tester", "created_at": now, "updated_at": now
+        })
+        done = await self.wait_for_status("orphan-once", server.JOB_FINISHED_STATUSES)
+        self.check("orphaned job failed, not resumed", done["status"] == "failed" and "not retried" in done["error"],
+                   f"({done['status']})")
+
+        job = await first.enqueue("count_once", {"steps": 100}, "tester")
+        await self.wait_for_status(job["id"], ["running"])
+        await first.stop()
+        await second.stop()
+        stopped = await server.db.jobs.find_one({"id": job["id"]})
+        self.check("shutdown fails the job instead of requeueing it", stopped["status"] == "failed", f"({stopped['status']})")
+
+    async def scenarios(self):
+        try:
+            await server.ensure_indexes()
+            first, second = make_worker(), make_worker()
+            first.start()
+            second.start()
+            await self.test_run_and_result(first, second)
+            await self.test_concurrency(first, second)
+            await self.test_cancel(first, second)
+            await self.test_resume(first, second)
+            await self.test_single_attempt(first, second)
+        finally:
+            shutil.rmtree(server.JOB_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    JobRunnerTester().main()
@@ -149,8 +149,8 @@ class FinalLeadTester:
         if not success1:
             return False
         
-        initial_leads = response1['data'] if response1.get('success') else []
-        print(f"   Initial leads count: {len(initial_leads)}")
+        initial_total = response1['data']['pagination']['total_items'] if response1.get('success') else 0
+        print(f"   Initial leads count: {initial_total}")
         
         # 2. Test Lead Creation - CRITICAL ISSUE DISCOVERY
         print("\n--- LEAD CREATION TESTING ---")
@@ -0,0 +1,109 @@
+"""Lead search benchmark: the old unanchored $regex scan against the lead search index
+
+Run: python lead_search_benchmark.py [mongo_url] [lead_count]
+
+Seeds lead_count leads (100k by default) into a throwaway database, times the $regex
+query search_leads used to run and the lead search index (build, then per-query
+latency), and drops the database afterwards.
+"""
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_search_bench")
+LEAD_COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+
+WORDS = (
+    "solar pump pipeline expansion metro rail airport terminal hospital wing warehouse automation "
+    "smart city water treatment plant bridge highway flyover school campus data centre network "
+    "upgrade substation refinery boiler retrofit cooling tower township housing port berth dredging "
+    "tunnel canal irrigation dam desalination fibre backbone security surveillance lighting"
+).split()
+QUERIES = ["solar", "metro rail", "water treat", "desal", "bridge highway flyover", "sub", "LEAD-0004", "zzz"]
+
+class LeadSearchBenchmark(ScratchDBScript):
+    def __init__(self, lead_count):
+        super().__init__()
+        self.lead_count = lead_count
+        self.index = server.LeadSearchIndex()
+
+    @staticmethod
+    def percentile(values, pct):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+    async def seed(self):
+        print(f"🔍 Seeding {self.lead_count} leads...")
+        rng = random.Random(7)
+        base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        batch = []
+        for i in range(self.lead_count):
+            created_at = base + timedelta(minutes=i)
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "lead_id": f"LEAD-{i:07d}",
+                "project_title": " ".join(rng.sample(WORDS, 4)),
+                "project_description": " ".join(rng.choices(WORDS, k=25)),
+                "notes": " ".join(rng.choices(WORDS, k=10)) if i % 3 == 0 else None,
+                "approval_status": rng.choice(["pending", "approved", "rejected"]),
+                "is_deleted": i % 40 == 0,
+                "created_at": created_at,
+                "updated_at": created_at
+            })
+            if len(batch) == 5000:
+                await server.db.leads.insert_many(batch)
+                batch = []
+        if batch:
+            await server.db.leads.insert_many(batch)
+        await server.ensure_indexes()
+
+    async def time_regex(self, q, runs):
+        """The query search_leads used to send: three case-insensitive unanchored regexes"""
+        match = {"is_deleted": False, "$or": [
+            {"project_title": {"$regex": q, "$options": "i"}},
+            {"notes": {"$regex": q, "$options": "i"}},
+            {"project_description": {"$regex": q, "$options": "i"}}
+        ]}
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            await server.db.leads.find(match, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
+            total = await server.db.leads.count_documents(match)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, total
+
+    async def time_index(self, q, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            ranked, total = await self.index.search(q, 50)
+            ids = [lead_id for lead_id, _ in ranked]
+            await server.db.leads.find({"id": {"$in": ids}, "is_deleted": False}, {"_id": 0}).to_list(None)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, total
+
+    async def scenarios(self, runs=5):
+        await self.seed()
+
+        started = time.perf_counter()
+        await self.index.ensure_built()
+        build_ms = (time.perf_counter() - started) * 1000
+        stats = self.index.stats()
+        print(f"✅ Index built in {build_ms:.0f}ms: {stats['indexed_leads']} leads, "
+              f"{stats['tokens']} tokens, {stats['postings']} postings")
+
+        print(f"\n{'query':<24}{'regex p50':>11}{'regex p95':>11}{'hits':>8}{'index p50':>11}{'index p95':>11}{'hits':>8}")
+        for q in QUERIES:
+            regex_timings, regex_total = await self.time_regex(q, runs)
+            index_timings, index_total = await self.time_index(q, runs)
+            print(f"{q:<24}"
+                  f"{self.percentile(regex_timings, 50):>9.1f}ms{self.percentile(regex_timings, 95):>9.1f}ms{regex_total:>8}"
+                  f"{self.percentile(index_timings, 50):>9.1f}ms{self.percentile(index_timings, 95):>9.1f}ms{index_total:>8}")
+        print("\n(regex hits are substring matches; index hits are word and word-prefix matches)")
+
+if __name__ == "__main__":
+    LeadSearchBenchmark(LEAD_COUNT).main()
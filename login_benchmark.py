@@ -0,0 +1,100 @@
+import requests
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class LoginBenchmark:
+    """Measures login throughput and the latency of unrelated requests during a login burst"""
+
+    def __init__(self, base_url="https://erp-user-sales.preview.emergentagent.com",
+                 email="admin@erp.com", password="admin123"):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.email = email
+        self.password = password
+        self.token = None
+
+    def login(self):
+        response = requests.post(
+            f"{self.api_url}/auth/login",
+            json={"email": self.email, "password": self.password},
+            timeout=30
+        )
+        return response.status_code == 200, response
+
+    def authenticate(self):
+        success, response = self.login()
+        if not success:
+            print(f"❌ Login failed - Status: {response.status_code}")
+            return False
+        self.token = response.json()["data"]["access_token"]
+        print("✅ Authenticated for benchmark")
+        return True
+
+    def probe(self, stop_event, latencies):
+        """Hit a cheap authenticated endpoint in a loop and record latencies in ms"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            try:
+                requests.get(f"{self.api_url}/auth/me", headers=headers, timeout=30)
+            except requests.exceptions.RequestException:
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    @staticmethod
+    def percentile(values, pct):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def run(self, total_logins=200, concurrency=20, probes=2):
+        print("\n🔍 Baseline latency of /auth/me...")
+        baseline = []
+        stop_event = threading.Event()
+        probe_thread = threading.Thread(target=self.probe, args=(stop_event, baseline))
+        probe_thread.start()
+        time.sleep(3)
+        stop_event.set()
+        probe_thread.join()
+
+        print(f"🔍 Login burst: {total_logins} logins at concurrency {concurrency}...")
+        during = []
+        stop_event = threading.Event()
+        probe_threads = [
+            threading.Thread(target=self.probe, args=(stop_event, during)) for _ in range(probes)
+        ]
+        for thread in probe_threads:
+            thread.start()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda _: self.login()[0], range(total_logins)))
+        elapsed = time.perf_counter() - started
+
+        stop_event.set()
+        for thread in probe_threads:
+            thread.join()
+
+        succeeded = sum(1 for ok in results if ok)
+        print("\n" + "="*60)
+        print("🎯 LOGIN BENCHMARK RESULTS")
+        print("="*60)
+        print(f"Logins: {succeeded}/{total_logins} succeeded in {elapsed:.2f}s")
+        print(f"Login throughput: {succeeded / elapsed:.1f} logins/s")
+        print(f"/auth/me baseline   p50: {self.percentile(baseline, 50):.1f}ms  p99: {self.percentile(baseline, 99):.1f}ms  (n={len(baseline)})")
+        print(f"/auth/me during burst p50: {self.percentile(during, 50):.1f}ms  p99: {self.percentile(during, 99):.1f}ms  (n={len(during)})")
+        return succeeded == total_logins
+
+if __name__ == "__main__":
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "https://erp-user-sales.preview.emergentagent.com"
+    total_logins = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    benchmark = LoginBenchmark(base_url)
+    if not benchmark.authenticate():
+        exit(1)
+    exit(0 if benchmark.run(total_logins, concurrency) else 1)
@@ -0,0 +1,169 @@
+"""Opportunity analytics benchmark: the old per-opportunity loop against the $facet aggregation
+
+Run: python opportunity_analytics_benchmark.py [mongo_url] [opportunity_count]
+
+Seeds opportunity_count opportunities (1M by default) with stage history for won deals and
+qualification rows, then:
+- checks compute_opportunity_analytics against the old loop, uncapped, over a small window
+- times both over the whole range; the old loop as it shipped, stopping at 1000 rows
+Drops the database afterwards.
+"""
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_analytics_bench")
+OPPORTUNITY_COUNT = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SPAN = timedelta(days=730)
+CHECK_WINDOW = (datetime(2024, 6, 1, tzinfo=timezone.utc), datetime(2024, 6, 3, tzinfo=timezone.utc))
+METRICS = [
+    "total_opportunities", "closed_opportunities", "won_opportunities", "lost_opportunities",
+    "total_pipeline_value", "won_revenue", "lost_revenue", "average_deal_size", "win_rate", "loss_rate",
+    "average_sales_cycle", "qualification_completion_rate", "stage_distribution"
+]
+
+class OpportunityAnalyticsBenchmark(ScratchDBScript):
+    def __init__(self, opportunity_count):
+        super().__init__()
+        self.opportunity_count = opportunity_count
+
+    async def seed(self):
+        print(f"🔍 Seeding {self.opportunity_count} opportunities...")
+        await server.initialize_opportunity_stages()
+        stages = await server.db.opportunity_stages.find({}, {"_id": 0}).to_list(None)
+        rng = random.Random(11)
+        opportunities, history, qualifications = [], [], []
+
+        async def flush(final=False):
+            for collection, rows in (("opportunities", opportunities), ("opportunity_stage_history", history),
+                                     ("opportunity_qualifications", qualifications)):
+                if rows and (final or len(rows) >= 5000):
+                    await server.db[collection].insert_many(rows)
+                    rows.clear()
+
+        for i in range(self.opportunity_count):
+            created_at = BASE + SPAN * rng.random()
+            stage = rng.choice(stages)
+            opportunity_id = str(uuid.uuid4())
+            opportunities.append({
+                "id": opportunity_id,
+                "opportunity_id": f"OPP-{i:07d}",
+                "current_stage_id": stage["id"] if i % 50 else None,
+                "opportunity_type": stage["opportunity_type"],
+                "expected_revenue": round(rng.uniform(1e4, 1e7), 2) if i % 7 else None,
+                "is_deleted": i % 100 == 0,
+                "created_at": created_at
+            })
+            if stage["stage_name"] == "Won" and i % 5:
+                history.append({
+                    "id": str(uuid.uuid4()),
+                    "opportunity_id": opportunity_id,
+                    "to_stage_id": stage["id"],
+                    "stage_name": "Won",
+                    "transition_date": created_at + timedelta(days=rng.randint(5, 200), hours=rng.randint(0, 23))
+                })
+            if i % 3 == 0:
+                qualifications.append({
+                    "id": str(uuid.uuid4()),
+                    "opportunity_id": opportunity_id,
+                    "compliance_status": rng.choice(["compliant", "non_compliant", "pending", "exempted"]),
+                    "created_at": created_at
+                })
+            await flush()
+        await flush(final=True)
+        await server.ensure_indexes()
+
+    @staticmethod
+    async def legacy_analytics(start, end, limit=1000):
+        """The loop get_opportunity_analytics used to run: a stage find_one per opportunity and a
+        stage history find_one per won deal, over at most limit opportunities"""
+        opportunities = await server.db.opportunities.find({
+            "created_at": {"$gte": start, "$lte": end}, "is_deleted": False
+        }).to_list(limit)
+        won = lost = 0
+        pipeline_value = won_revenue = lost_revenue = 0.0
+        stage_distribution, sales_cycles = {}, []
+        for opp in opportunities:
+            if opp.get("expected_revenue"):
+                pipeline_value += float(opp["expected_revenue"])
+            current_stage = await server.db.opportunity_stages.find_one({"id": opp.get("current_stage_id")})
+            if current_stage:
+                stage_name = current_stage.get("stage_name", "Unknown")
+                stage_distribution[stage_name] = stage_distribution.get(stage_name, 0) + 1
+                if stage_name == "Won":
+                    won += 1
+                    if opp.get("expected_revenue"):
+                        won_revenue += float(opp["expected_revenue"])
+                elif stage_name in ["Lost", "Dropped"]:
+                    lost += 1
+                    if opp.get("expected_revenue"):
+                        lost_revenue += float(opp["expected_revenue"])
+            if opp.get("created_at") and current_stage and stage_name == "Won":
+                stage_history = await server.db.opportunity_stage_history.find_one({"opportunity_id": opp["id"], "stage_name": "Won"})
+                if stage_history:
+                    sales_cycles.append((stage_history["transition_date"] - opp["created_at"]).days)
+        qualifications = await server.db.opportunity_qualifications.find({"created_at": {"$gte": start, "$lte": end}}).to_list(limit)
+        completed = len([q for q in qualifications if q.get("compliance_status") in ["compliant", "exempted"]])
+        closed = won + lost
+        total = len(opportunities)
+        return {
+            "total_opportunities": total,
+            "closed_opportunities": closed,
+            "won_opportunities": won,
+            "lost_opportunities": lost,
+            "total_pipeline_value": round(pipeline_value, 2),
+            "won_revenue": round(won_revenue, 2),
+            "lost_revenue": round(lost_revenue, 2),
+            "average_deal_size": round(pipeline_value / total if total else 0, 2),
+            "win_rate": round(won / closed * 100 if closed else 0, 2),
+            "loss_rate": round(lost / closed * 100 if closed else 0, 2),
+            "average_sales_cycle": round(sum(sales_cycles) / len(sales_cycles) if sales_cycles else 0),
+            "qualification_completion_rate": round(completed / len(qualifications) * 100 if qualifications else 0, 2),
+            "stage_distribution": stage_distribution
+        }
+
+    async def test_matches_legacy(self):
+        print("\n🔍 Aggregation matches the old loop (uncapped) over a small window")
+        expected = await self.legacy_analytics(*CHECK_WINDOW, limit=None)
+        actual = await server.compute_opportunity_analytics(*CHECK_WINDOW)
+        for metric in METRICS:
+            if isinstance(expected[metric], float):
+                same = abs(expected[metric] - actual[metric]) <= 0.01 + abs(expected[metric]) * 1e-9
+            else:
+                same = expected[metric] == actual[metric]
+            self.check(metric, same, f"({actual[metric]})" if same else f"(expected {expected[metric]}, got {actual[metric]})")
+
+    async def test_timing(self, runs=3):
+        start, end = BASE, BASE + SPAN
+        print(f"\n🔍 Whole range, {runs} runs each")
+        timings, legacy = [], None
+        for _ in range(runs):
+            started = time.perf_counter()
+            legacy = await self.legacy_analytics(start, end)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"   old loop:    {min(timings):9.1f}ms  ({legacy['total_opportunities']} opportunities counted)")
+
+        timings, actual = [], None
+        for _ in range(runs):
+            started = time.perf_counter()
+            actual = await server.compute_opportunity_analytics(start, end)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"   aggregation: {min(timings):9.1f}ms  ({actual['total_opportunities']} opportunities counted)")
+
+        live = await server.db.opportunities.count_documents({"created_at": {"$gte": start, "$lte": end}, "is_deleted": False})
+        self.check("aggregation counts every live opportunity", actual["total_opportunities"] == live, f"({live})")
+        self.check("stage distribution adds up", sum(actual["stage_distribution"].values()) <= live)
+
+    async def scenarios(self):
+        await self.seed()
+        await self.test_matches_legacy()
+        await self.test_timing()
+
+if __name__ == "__main__":
+    OpportunityAnalyticsBenchmark(OPPORTUNITY_COUNT).main()
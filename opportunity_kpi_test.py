@@ -0,0 +1,133 @@
+"""Opportunity KPI snapshot test: materialized snapshots, trends and refresh triggers
+
+Run: python opportunity_kpi_test.py [mongo_url]
+
+Seeds opportunities for two owners, refreshes the snapshots and checks them against the
+live analytics, that a second refresh updates rather than adds snapshots, that trends
+compare with the same stretch of the previous period, and that writes bring the next
+refresh forward.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from scratch_db import ScratchDBScript, load_server
+
+server = load_server("erp_kpi_test")
+
+OWNERS = ["owner-1", "owner-2"]
+# A refresh three and a half days into March, with the same activity in early February
+TREND_NOW = datetime(2025, 3, 4, 12, tzinfo=timezone.utc)
+
+class OpportunityKPITester(ScratchDBScript):
+    def __init__(self):
+        super().__init__()
+        self.now = datetime.now(timezone.utc)
+
+    @staticmethod
+    def values(snapshot):
+        return {kpi["kpi_code"]: kpi["actual_value"] for kpi in snapshot["kpis"]}
+
+    @staticmethod
+    async def seed_activity(prefix, created_at_of, count=12):
+        """count opportunities for OWNERS, a third won and a third lost, with qualifications for half"""
+        won = await server.stage_catalog.at("Tender", 6)
+        first = await server.stage_catalog.at("Tender", 1)
+        lost = await server.stage_catalog.with_code("Shared", "LOST")
+        opportunities, history = [], []
+        for i in range(count):
+            created_at = created_at_of(i)
+            stage = [won, first, lost][i % 3]
+            opportunities.append({
+                "id": f"{prefix}-{i}", "opportunity_id": f"OPP-{prefix}-{i:04d}", "current_stage_id": stage["id"],
+                "opportunity_owner_id": OWNERS[i % 2], "expected_revenue": 100000.0 * (i + 1),
+                "is_deleted": False, "created_at": created_at
+            })
+            if stage is won:
+                history.append({"id": str(uuid.uuid4()), "opportunity_id": f"{prefix}-{i}", "stage_name": "Won",
+                                "transition_date": created_at + timedelta(days=20 + i)})
+        await server.db.opportunities.insert_many(opportunities)
+        await server.db.opportunity_stage_history.insert_many(history)
+        await server.db.opportunity_qualifications.insert_many([
+            {"id": str(uuid.uuid4()), "opportunity_id": f"{prefix}-{i}", "compliance_status": "compliant" if i % 2 else "pending",
+             "created_at": created_at_of(i)}
+            for i in range(count // 2)
+        ])
+
+    async def seed(self):
+        await server.initialize_opportunity_stages()
+        # Created within the last hour so they fall in every current period
+        await self.seed_activity("now", lambda i: self.now - timedelta(minutes=i + 1))
+
+    async def test_refresh(self):
+        print("\n🔍 Snapshots for every period, for the team and each owner")
+        written = await server.refresh_opportunity_kpis()
+        self.check("one snapshot per period and owner", written == len(server.KPI_PERIODS) * (len(OWNERS) + 1), f"({written})")
+
+        start = server.kpi_period_start("monthly", self.now)
+        live = await server.aggregate_opportunity_metrics(start, datetime.now(timezone.utc), by_owner=True)
+        for owner_id in [None, *OWNERS]:
+            snapshot = await server.db.opportunity_kpis.find_one(
+                {"measurement_period": "monthly", "owner_id": owner_id}, sort=[("period_start", -1)])
+            values = self.values(snapshot)
+            expected = live[owner_id]
+            self.check(f"{owner_id or 'team'} snapshot matches the live analytics",
+                       values["WIN_RATE"] == expected["win_rate"]
+                       and values["PIPELINE_VALUE"] == expected["total_pipeline_value"]
+                       and values["SALES_CYCLE"] == expected["average_sales_cycle"]
+                       and values["QUAL_COMPLETION"] == expected["qualification_completion_rate"], f"({values})")
+
+        before = await server.db.opportunity_kpis.count_documents({})
+        await server.refresh_opportunity_kpis()
+        after = await server.db.opportunity_kpis.count_documents({})
+        self.check("a second refresh updates the same snapshots", before == after, f"({after})")
+
+    async def test_trend(self):
+        print("\n🔍 Trends compare with the same stretch of the previous period")
+        march, february = datetime(2025, 3, 1, tzinfo=timezone.utc), datetime(2025, 2, 1, tzinfo=timezone.utc)
+        await self.seed_activity("mar", lambda i: march + timedelta(hours=6 * i))
+        await self.seed_activity("feb", lambda i: february + timedelta(hours=6 * i))
+        # Later February deals that a comparison with the whole of February would count
+        await self.seed_activity("feb-late", lambda i: february + timedelta(days=10, hours=i), count=6)
+        # The whole of February is snapshotted too, as the schedule would have done
+        await server.refresh_opportunity_kpis(march - timedelta(hours=1))
+        await server.refresh_opportunity_kpis(TREND_NOW)
+
+        team = await server.db.opportunity_kpis.find_one(
+            {"measurement_period": "monthly", "owner_id": None, "period_start": march})
+        trends = {kpi["kpi_code"]: kpi["trend"] for kpi in team["kpis"]}
+        self.check("unchanged pipeline is stable early in the month", trends["PIPELINE_VALUE"] == "stable", f"({trends})")
+        self.check("every unchanged KPI is stable", set(trends.values()) == {"stable"})
+
+        await self.seed_activity("mar-more", lambda i: march + timedelta(days=1, hours=i), count=3)
+        await server.refresh_opportunity_kpis(TREND_NOW)
+        team = await server.db.opportunity_kpis.find_one(
+            {"measurement_period": "monthly", "owner_id": None, "period_start": march})
+        trends = {kpi["kpi_code"]: kpi["trend"] for kpi in team["kpis"]}
+        self.check("more pipeline than early February is an improvement", trends["PIPELINE_VALUE"] == "improving", f"({trends})")
+
+        history = await server.db.opportunity_kpis.find(
+            {"measurement_period": "monthly", "owner_id": None}).sort("period_start", -1).to_list(None)
+        self.check("history keeps each period's snapshot", len(history) == 3, f"({len(history)})")
+
+    async def test_write_trigger(self):
+        print("\n🔍 Writes bring the next refresh forward")
+        await server.kpi_snapshot_schedule.trigger()
+        await server.db.schedules.update_one({"id": "opportunity_kpis"},
+                                             {"$set": {"next_run_at": self.now + timedelta(hours=1)}})
+        await server.request_kpi_refresh()
+        state = await server.db.schedules.find_one({"id": "opportunity_kpis"})
+        due_in = (state["next_run_at"].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+        self.check("refresh due within the delay", 0 < due_in <= server.KPI_REFRESH_DELAY_SECONDS, f"({due_in:.1f}s)")
+        await server.request_kpi_refresh()
+        state_again = await server.db.schedules.find_one({"id": "opportunity_kpis"})
+        self.check("a later write does not push it back", state_again["next_run_at"] == state["next_run_at"])
+
+    async def scenarios(self):
+        await server.ensure_indexes()
+        await self.seed()
+        await self.test_refresh()
+        await self.test_trend()
+        await self.test_write_trigger()
+
+if __name__ == "__main__":
+    OpportunityKPITester().main()
@@ -0,0 +1,63 @@
+"""Shared setup for the test and benchmark scripts that run against a scratch database
+
+Each script calls load_server() before anything else. It takes the Mongo URL from the
+first command-line argument (a local mongod by default), points the backend at a
+throwaway database with cross-worker cache invalidation off and imports backend/server.py.
+The script's scenarios then go in a ScratchDBScript subclass, which counts checks and
+drops the database when they are done, pass or fail.
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+DEFAULT_MONGO_URL = "mongodb://localhost:27017"
+
+def load_server(db_prefix: str, default_url: str = DEFAULT_MONGO_URL, **env):
+    """Configure the backend for a scratch database named db_prefix_<random> and import it
+
+    env holds extra environment variables the backend reads at import time.
+    """
+    os.environ["MONGO_URL"] = sys.argv[1] if len(sys.argv) > 1 else default_url
+    os.environ["DB_NAME"] = f"{db_prefix}_{uuid.uuid4().hex[:8]}"
+    # Scripts that exercise cache invalidation start their buses by hand
+    os.environ["CACHE_INVALIDATION_MODE"] = "off"
+    os.environ.update(env)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+    import server
+    return server
+
+class ScratchDBScript:
+    """Runs scenarios() against the scratch database, counting check() results"""
+
+    def __init__(self):
+        self.tests_run = 0
+        self.tests_passed = 0
+
+    def check(self, name, passed, detail=""):
+        self.tests_run += 1
+        if passed:
+            self.tests_passed += 1
+            print(f"✅ {name} {detail}")
+        else:
+            print(f"❌ {name} {detail}")
+
+    async def scenarios(self):
+        raise NotImplementedError
+
+    async def run(self) -> bool:
+        server = sys.modules["server"]
+        try:
+            await server.db.command("ping")
+            await self.scenarios()
+        finally:
+            await server.client.drop_database(os.environ["DB_NAME"])
+            server.client.close()
+
+        if self.tests_run:
+            print(f"\n📊 Tests passed: {self.tests_passed}/{self.tests_run}")
+        return self.tests_passed == self.tests_run
+
+    def main(self):
+        exit(0 if asyncio.run(self.run()) else 1)
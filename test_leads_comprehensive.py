@@ -191,8 +191,9 @@ class LeadCRUDTester:
         if not success1:
             return False
         
-        initial_leads = response1['data'] if response1.get('success') else []
-        print(f"   Initial leads count: {len(initial_leads)}")
+        # /leads is paginated; compare total_items rather than page lengths
+        initial_total = response1['data']['pagination']['total_items'] if response1.get('success') else 0
+        print(f"   Initial leads count: {initial_total}")
         
         # 2. POST /api/leads - Test lead creation
         print("\n--- LEAD CREATION TESTING ---")
@@ -249,13 +250,14 @@ class LeadCRUDTester:
         )
         
         if success3 and response3.get('success'):
-            current_leads = response3['data']
-            print(f"   Current leads count: {len(current_leads)}")
+            current_leads = response3['data']['leads']
+            current_total = response3['data']['pagination']['total_items']
+            print(f"   Current leads count: {current_total}")
             
-            if len(current_leads) > len(initial_leads):
+            if current_total > initial_total:
                 print("✅ Lead successfully created and appears in leads list")
                 
-                # Find our created lead
+                # Find our created lead (newest first, so it is on the first page)
                 our_lead = None
                 for lead in current_leads:
                     if lead.get('lead_id') == created_lead_id: